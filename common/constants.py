@@ -1,4 +1,6 @@
 MODEL_PATH_ENV_VAR = "MODEL_PATH"
+MODEL_CACHE_DIR = "MODEL_CACHE_DIR"
+MODEL_RELOAD_INTERVAL = "MODEL_RELOAD_INTERVAL"
 MODEL_PATH_FOR_DRAFT_QUALITY_MODEL_TYPE = "/mnt/models/model.bz2"
 DEFAULT_MODEL_PATH = "/mnt/models/model.bin"
 WIKI_URL_ENV_VAR = "WIKI_URL"
@@ -10,10 +12,49 @@ API_USER_AGENT = "revscoring demo"
 FEATURE_VAL_KEY = "feature_values"
 EXTENDED_OUTPUT_KEY = "extended_output"
 EVENT_KEY = "event"
+PROFILE_KEY = "profile"
+PREDICTION_RESULTS_KEY = "prediction_results"
+REV_IDS_KEY = "rev_ids"
+BATCH_RESULTS_KEY = "batch_results"
+SERVING_MODEL_KEY = "serving_model"
 EVENTGATE_URL = "EVENTGATE_URL"
 EVENTGATE_STREAM = "EVENTGATE_STREAM"
 AIOHTTP_CLIENT_TIMEOUT = "AIOHTTP_CLIENT_TIMEOUT"
 TLS_CERT_BUNDLE_PATH = "/etc/ssl/certs/wmf-ca-certificates.crt"
 WIKI_HOST_ENV_VAR = "WIKI_HOST"
 MISSING_REV_ID_ERR = "Missing 'rev_id' in input data."
-INVALID_REV_ID_ERR = "Expected 'rev_id' to be an integer."
\ No newline at end of file
+INVALID_REV_ID_ERR = "Expected 'rev_id' to be an integer."
+INVALID_REV_IDS_ERR = "Expected 'rev_ids' to be a non-empty list of integers."
+
+MWAPI_BATCHING = "MWAPI_BATCHING"
+MWAPI_BATCH_WINDOW_MS = "MWAPI_BATCH_WINDOW_MS"
+MWAPI_BATCH_MAX_SIZE = "MWAPI_BATCH_MAX_SIZE"
+MWAPI_CACHE_MAX_BYTES = "MWAPI_CACHE_MAX_BYTES"
+MWAPI_CACHE_REVISION_TTL = "MWAPI_CACHE_REVISION_TTL"
+MWAPI_CACHE_USER_TTL = "MWAPI_CACHE_USER_TTL"
+MWAPI_CACHE_BADREVID_TTL = "MWAPI_CACHE_BADREVID_TTL"
+MWAPI_POOL_LIMIT = "MWAPI_POOL_LIMIT"
+MWAPI_POOL_LIMIT_PER_HOST = "MWAPI_POOL_LIMIT_PER_HOST"
+MWAPI_KEEPALIVE_TIMEOUT = "MWAPI_KEEPALIVE_TIMEOUT"
+MWAPI_DNS_CACHE_TTL = "MWAPI_DNS_CACHE_TTL"
+USE_EVENT_CONTENT = "USE_EVENT_CONTENT"
+MWAPI_COMPRESSION = "MWAPI_COMPRESSION"
+MWAPI_FAST_JSON = "MWAPI_FAST_JSON"
+MWAPI_HEDGING = "MWAPI_HEDGING"
+MWAPI_HEDGE_PERCENTILE = "MWAPI_HEDGE_PERCENTILE"
+MWAPI_HEDGE_MIN_DELAY_MS = "MWAPI_HEDGE_MIN_DELAY_MS"
+MWAPI_MAX_RETRIES = "MWAPI_MAX_RETRIES"
+MWAPI_RETRY_BACKOFF_MS = "MWAPI_RETRY_BACKOFF_MS"
+RESPONSE_STORE_MODE = "RESPONSE_STORE_MODE"
+RESPONSE_STORE_PATH = "RESPONSE_STORE_PATH"
+SHARED_FEATURES_CACHE_MAX_BYTES = "SHARED_FEATURES_CACHE_MAX_BYTES"
+SHARED_FEATURES_TTL = "SHARED_FEATURES_TTL"
+FEATURE_STORE_PATH = "FEATURE_STORE_PATH"
+DATASOURCE_CACHE_MAX_BYTES = "DATASOURCE_CACHE_MAX_BYTES"
+DATASOURCE_CACHE_TTL = "DATASOURCE_CACHE_TTL"
+BATCH_MAX_SIZE = "BATCH_MAX_SIZE"
+BATCH_CONCURRENCY = "BATCH_CONCURRENCY"
+PREDICT_BATCHING = "PREDICT_BATCHING"
+PREDICT_BATCH_WINDOW_MS = "PREDICT_BATCH_WINDOW_MS"
+PREDICT_BATCH_MAX_SIZE = "PREDICT_BATCH_MAX_SIZE"
+EXTRACTION_PROFILE_SAMPLE_RATE = "EXTRACTION_PROFILE_SAMPLE_RATE"
@@ -23,4 +23,10 @@ class RevscoringModelType(Enum):
                 return model
         raise LookupError(
             f"INFERENCE_NAME '{inference_name}' could not be matched to a revscoring model type."
-        )
\ No newline at end of file
+        )
+
+
+class ResponseStoreMode(Enum):
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from common.constants import FEATURE_STORE_PATH
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feature_values (
+    rev_id INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    feature_values TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (rev_id, fingerprint)
+) WITHOUT ROWID;
+"""
+
+
+def feature_fingerprint(features: Iterable) -> str:
+    """
+    Computes a stable hash of a list of revscoring features, based on their names and order.
+    Models with the same feature list share the same fingerprint, and a model version
+    that changes its features gets a new one.
+
+    Parameters:
+    - features (Iterable): The revscoring features (for example, model.features).
+
+    Returns:
+    - str: The fingerprint of the feature list.
+    """
+    digest = hashlib.sha256("\n".join(str(f) for f in features).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class FeatureStore:
+    """
+    On-disk store of feature values, backed by a single SQLite database, keyed by rev-id
+    and feature list fingerprint (see feature_fingerprint).
+
+    The feature values of a revision don't change once extracted (the revision is immutable),
+    so re-scoring a revision with a new version of a model using the same features is a pure
+    model pass. Features that depend on the time of extraction (like the editor's edit count)
+    are stored as they were at the first extraction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def get(self, rev_id: int, fingerprint: str) -> Optional[List]:
+        """
+        Returns the feature values stored for a rev-id and fingerprint, or None if missing.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT feature_values FROM feature_values WHERE rev_id = ? AND fingerprint = ?",
+                (rev_id, fingerprint),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, rev_id: int, fingerprint: str, feature_values: List) -> None:
+        """
+        Stores the feature values of a rev-id and fingerprint, replacing the previous ones (if any).
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO feature_values VALUES (?, ?, ?, ?)",
+                (rev_id, fingerprint, json.dumps(feature_values), time.time()),
+            )
+
+    def stats(self) -> Dict:
+        """
+        Returns the number of stored feature vectors (in total and by fingerprint)
+        and the size of the database file in bytes.
+        """
+        with self._lock:
+            fingerprints = dict(self._connection.execute(
+                "SELECT fingerprint, COUNT(*) FROM feature_values GROUP BY fingerprint"
+            ).fetchall())
+            page_count = self._connection.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._connection.execute("PRAGMA page_size").fetchone()[0]
+        return {
+            "rows": sum(fingerprints.values()),
+            "fingerprints": fingerprints,
+            "bytes": page_count * page_size,
+        }
+
+    def compact(self, keep_fingerprints: Optional[Iterable[str]] = None,
+                older_than: Optional[float] = None) -> int:
+        """
+        Deletes the feature vectors that are not needed anymore and reclaims their disk space.
+
+        Parameters:
+        - keep_fingerprints (Iterable[str]): If set, the feature vectors of any other fingerprint
+                                             (for example, of retired model versions) are deleted.
+        - older_than (float): If set, the feature vectors stored more than this many seconds ago
+                              are deleted.
+
+        Returns:
+        - int: The number of deleted feature vectors.
+        """
+        conditions, params = [], []
+        if keep_fingerprints is not None:
+            keep_fingerprints = list(keep_fingerprints)
+            conditions.append(f"fingerprint NOT IN ({', '.join('?' * len(keep_fingerprints))})")
+            params.extend(keep_fingerprints)
+        if older_than is not None:
+            conditions.append("created < ?")
+            params.append(time.time() - older_than)
+        with self._lock:
+            deleted = 0
+            if conditions:
+                with self._connection:
+                    deleted = self._connection.execute(
+                        "DELETE FROM feature_values WHERE " + " AND ".join(conditions), params
+                    ).rowcount
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._connection.execute("VACUUM")
+        logging.info(f"Compacted the feature store at {self.path}, {deleted} rows deleted.")
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+_feature_store = None
+
+
+def get_feature_store() -> Optional[FeatureStore]:
+    """
+    Returns the process-wide FeatureStore at the path set via the FEATURE_STORE_PATH
+    environment variable, or None if it is not set.
+    """
+    global _feature_store
+    if FEATURE_STORE_PATH not in os.environ:
+        return None
+    if _feature_store is None:
+        _feature_store = FeatureStore(os.environ[FEATURE_STORE_PATH])
+        logging.info(f"Using the feature store at {_feature_store.path}.")
+    return _feature_store
+
+
+# Size reporting and compaction of a feature store, for example:
+#   python3.8 -m common.feature_store --path features.sqlite3 stats
+#   python3.8 -m common.feature_store --path features.sqlite3 compact --keep 3f2a... --older_than 7776000
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Feature store maintenance")
+    parser.add_argument('--path', type=str, required=True, help='Path to the feature store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='Report the number of stored feature vectors and the size')
+    compact_parser = subparsers.add_parser('compact', help='Delete stale feature vectors and reclaim space')
+    compact_parser.add_argument('--keep', type=str, nargs='+', default=None,
+                                help='Fingerprints to keep, all the others are deleted')
+    compact_parser.add_argument('--older_than', type=float, default=None,
+                                help='Delete the feature vectors stored more than this many seconds ago')
+    args = parser.parse_args()
+
+    store = FeatureStore(args.path)
+    if args.command == 'compact':
+        store.compact(args.keep, args.older_than)
+    print(json.dumps(store.stats(), indent=2))
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Any, Callable, Optional
+
+import joblib
+import revscoring
+import sklearn
+
+
+def file_sha512(path: str) -> str:
+    """
+    Computes the sha512 hex digest of a file, reading it in chunks.
+
+    Parameters:
+    - path (str): The path to the file.
+
+    Returns:
+    - str: The hex digest of the file's content.
+    """
+    digest = hashlib.sha512()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_checksum(model_path: str) -> Optional[str]:
+    """
+    Reads the expected sha512 digest of a model binary from the <model_path>.sha512 file
+    published next to it (in the format of sha512sum, "<digest> *<file name>").
+
+    Parameters:
+    - model_path (str): The path to the model binary.
+
+    Returns:
+    - str: The expected hex digest, or None if there is no .sha512 file.
+    """
+    try:
+        with open(f"{model_path}.sha512") as f:
+            return f.read().split()[0].lower()
+    except FileNotFoundError:
+        return None
+
+
+def verify_checksum(model_path: str) -> str:
+    """
+    Verifies a model binary against its .sha512 file (if any).
+
+    Raises a ValueError if the digest of the model binary doesn't match the expected one.
+
+    Parameters:
+    - model_path (str): The path to the model binary.
+
+    Returns:
+    - str: The hex digest of the model binary.
+    """
+    digest = file_sha512(model_path)
+    expected = read_checksum(model_path)
+    if expected is None:
+        logging.warning(f"No .sha512 file found for {model_path}, the model binary is not verified.")
+    elif digest != expected:
+        raise ValueError(
+            f"The sha512 digest of {model_path} ({digest}) doesn't match the one of "
+            f"{model_path}.sha512 ({expected})."
+        )
+    return digest
+
+
+def get_cache_key(model_path: str) -> str:
+    """
+    Returns the key of the cached form of a model binary, without reading the binary: it is based
+    on the digest published in its .sha512 file (or on the size and modification time of the binary,
+    if there is no .sha512 file) and on the versions of the libraries that pickle it, so a new model
+    binary (or a new image) never loads a stale or incompatible cache entry.
+
+    Parameters:
+    - model_path (str): The path to the model binary.
+
+    Returns:
+    - str: The cache key.
+    """
+    checksum = read_checksum(model_path)
+    if checksum is None:
+        stat = os.stat(model_path)
+        checksum = f"{stat.st_size}-{stat.st_mtime_ns}"
+    versions = f"{revscoring.__version__}\n{sklearn.__version__}\n{joblib.__version__}"
+    return hashlib.sha256(f"{checksum}\n{versions}".encode('utf-8')).hexdigest()[:16]
+
+
+def load_cached(model_path: str, cache_dir: str, load_function: Callable[[str], Any]) -> Any:
+    """
+    Loads a model from its cached, fast-loading form, creating it on the first load.
+
+    The cached form is an uncompressed joblib pickle, so loading it needs no decompression (unlike
+    the bz2 models) and its numpy arrays are memory-mapped (read-only) rather than read and copied.
+    The model binary is verified against its .sha512 file only when the cached form is created,
+    since hashing a big binary takes longer than loading it; later loads trust the verified copy.
+    A cache entry that can't be read or written is logged and the model binary is used instead.
+
+    Parameters:
+    - model_path (str): The path to the model binary.
+    - cache_dir (str): The directory of the cached artifacts.
+    - load_function (Callable): Loads the model from the model binary (see common.utils.load).
+
+    Returns:
+    - The loaded model object.
+    """
+    cache_path = os.path.join(
+        cache_dir, f"{os.path.basename(model_path)}.{get_cache_key(model_path)}.joblib"
+    )
+    if os.path.exists(cache_path):
+        try:
+            model = joblib.load(cache_path, mmap_mode='r')
+            model.info['environment'].check(raise_exception=False)
+            logging.info(f"Loaded the model {model_path} from {cache_path}.")
+            return model
+        except Exception as e:
+            logging.warning(f"Error loading the cached model {cache_path}, using {model_path}: {e}")
+
+    verify_checksum(model_path)
+    model = load_function(model_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written to a temporary file and renamed, so that concurrent loads
+        # (like the process pool workers) never read a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            joblib.dump(model, tmp_path)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logging.info(f"Cached the model {model_path} at {cache_path}.")
+    except OSError as e:
+        logging.warning(f"Error caching the model {model_path} in {cache_dir}: {e}")
+    return model
@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+from mwapi.errors import APIError, RequestError
+from mwapi.util import _normalize_params
+
+from common.constants import RESPONSE_STORE_MODE, RESPONSE_STORE_PATH
+from common.enums import ResponseStoreMode
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS responses (
+    request_key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL REFERENCES blobs (digest)
+);
+"""
+
+
+class ResponseNotRecordedError(RequestError):
+    """Raised in replay mode for a request whose response is not in the store."""
+
+
+def request_key(endpoint: str, params: Dict) -> str:
+    """
+    Builds the key of a MW API request, independent from the order of the
+    parameters and of the values of multi-value parameters (rvprop, revids, ...),
+    since mwapi joins sets in iteration order, which changes across processes.
+
+    The endpoint is reduced to its host name, so that the same request sent to
+    https://en.wikipedia.org or to an internal endpoint with the Host header set to
+    en.wikipedia.org has the same key.
+
+    Parameters:
+    - endpoint (str): The wiki URL (or host name) the request is sent to.
+    - params (dict): The parameters of the request, as passed to mwapi's get().
+
+    Returns:
+    - str: The canonical key of the request.
+    """
+    normal_params = _normalize_params(params)
+    normal_params.pop("format", None)
+    canonical = {
+        k: "|".join(sorted(str(v).split("|"))) for k, v in normal_params.items()
+    }
+    host = urlparse(endpoint).netloc or endpoint
+    return host + "?" + json.dumps(canonical, sort_keys=True, ensure_ascii=False)
+
+
+class ResponseStore:
+    """
+    On-disk store of MW API responses, backed by a single SQLite database.
+
+    Responses are content-addressed: the body is stored once (compressed with zlib)
+    under its sha256 digest in the blobs table, and the responses table indexes the
+    request keys (see request_key) to the digests. Identical responses (like the ones
+    of the same user) are stored only once, and lookups go through the primary key
+    index, so the store can hold millions of responses in a single file.
+    The database is opened in WAL mode, so that it can be read by many processes
+    while one is writing to it.
+    """
+
+    def __init__(self, path: str, compression_level: int = 6):
+        self.path = path
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the response document stored for a request key, or None if missing.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT blobs.data FROM responses JOIN blobs USING (digest) "
+                "WHERE responses.request_key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, doc: Any) -> str:
+        """
+        Stores the response document of a request key, replacing the previous one (if any).
+
+        Returns:
+        - str: The digest of the stored document.
+        """
+        body = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO blobs (digest, data) VALUES (?, ?)",
+                (digest, zlib.compress(body, self.compression_level)),
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (request_key, digest) VALUES (?, ?)",
+                (key, digest),
+            )
+        return digest
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of responses and of distinct bodies stored,
+        together with the size of the compressed bodies in bytes.
+        """
+        with self._lock:
+            responses = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            blobs, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM blobs"
+            ).fetchone()
+        return {"responses": responses, "blobs": blobs, "bytes": size}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class _RecordReplayMixin:
+    def __init__(self, session, store: ResponseStore, mode: ResponseStoreMode, endpoint: str):
+        self.session = session
+        self.store = store
+        self.mode = mode
+        self.endpoint = endpoint
+
+    def __getattr__(self, name):
+        # Everything else (headers, pool stats, ...) is served by the wrapped session.
+        return getattr(self.session, name)
+
+    def _replay(self, key: str) -> Optional[Any]:
+        doc = self.store.get(key)
+        if doc is None and self.mode == ResponseStoreMode.REPLAY:
+            raise ResponseNotRecordedError(f"No recorded MW API response for {key}")
+        if doc is not None and "error" in doc:
+            raise APIError.from_doc(doc["error"])
+        return doc
+
+
+class RecordReplaySession(_RecordReplayMixin):
+    """
+    Wraps a blocking mwapi.Session (or anything exposing its get(**params) method,
+    like the session used by revscoring's api.Extractor).
+    - In record mode, every response is fetched from the MW API and written to the store.
+      Responses that are already in the store are served from it.
+    - In replay mode, responses are served from the store only, without any network call.
+    """
+
+    def get(self, **params) -> Dict:
+        key = request_key(self.endpoint, params)
+        doc = self._replay(key)
+        if doc is not None:
+            return doc
+        try:
+            doc = self.session.get(**params)
+        except APIError as e:
+            self.store.put(key, {"error": {"code": e.code, "info": e.info, "*": e.content}})
+            raise
+        self.store.put(key, doc)
+        return doc
+
+
+class AsyncRecordReplaySession(_RecordReplayMixin):
+    """
+    Same as RecordReplaySession, for sessions exposing the get(**params) coroutine
+    of mwapi.AsyncSession (like the model servers' MWAPIClient).
+    The store is read and written (SQLite queries, JSON and zlib coding) in the
+    default executor's threads, so that it doesn't block the event loop.
+    """
+
+    async def get(self, **params) -> Dict:
+        key = request_key(self.endpoint, params)
+        loop = asyncio.get_running_loop()
+        doc = await loop.run_in_executor(None, self._replay, key)
+        if doc is not None:
+            return doc
+        try:
+            doc = await self.session.get(**params)
+        except APIError as e:
+            error_doc = {"error": {"code": e.code, "info": e.info, "*": e.content}}
+            await loop.run_in_executor(None, self.store.put, key, error_doc)
+            raise
+        await loop.run_in_executor(None, self.store.put, key, doc)
+        return doc
+
+
+_response_store = None
+
+
+def get_response_store_mode() -> ResponseStoreMode:
+    """
+    Reads the record/replay mode from the RESPONSE_STORE_MODE environment variable
+    (off by default).
+    """
+    return ResponseStoreMode(os.environ.get(RESPONSE_STORE_MODE, ResponseStoreMode.OFF.value).lower())
+
+
+def get_response_store() -> Optional[ResponseStore]:
+    """
+    Returns the process-wide ResponseStore configured via the RESPONSE_STORE_PATH
+    environment variable, or None if the record/replay mode is off.
+    """
+    global _response_store
+    if get_response_store_mode() == ResponseStoreMode.OFF:
+        return None
+    if _response_store is None:
+        if RESPONSE_STORE_PATH not in os.environ:
+            raise ValueError(
+                f"The {RESPONSE_STORE_PATH} environment variable is required "
+                f"when {RESPONSE_STORE_MODE} is not off."
+            )
+        _response_store = ResponseStore(os.environ[RESPONSE_STORE_PATH])
+        logging.info(
+            f"Using the MW API response store at {_response_store.path} "
+            f"in {get_response_store_mode().value} mode."
+        )
+    return _response_store
+
+
+def wrap_session(session, endpoint: str):
+    """
+    Wraps a MW API session with the record/replay layer if the RESPONSE_STORE_MODE
+    environment variable enables it, otherwise returns the session as it is.
+
+    Parameters:
+    - session: A blocking (mwapi.Session-like) or asynchronous (mwapi.AsyncSession-like)
+               session; the wrapper is chosen based on whether its get() is a coroutine.
+    - endpoint (str): The wiki URL (or host name) the session sends requests to.
+
+    Returns:
+    - The wrapped session, or the session itself if the mode is off.
+    """
+    store = get_response_store()
+    if store is None:
+        return session
+    mode = get_response_store_mode()
+    if asyncio.iscoroutinefunction(session.get):
+        return AsyncRecordReplaySession(session, store, mode, endpoint)
+    return RecordReplaySession(session, store, mode, endpoint)
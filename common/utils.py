@@ -1,18 +1,24 @@
 import bz2
 import os
+import numpy as np
 from revscoring import Model
+from revscoring.features import vectorize_values
+from revscoring.scoring.models import util as model_util
+from revscoring.scoring.models.sklearn import ProbabilityClassifier
 from common.constants import MODEL_PATH_ENV_VAR, MODEL_PATH_FOR_DRAFT_QUALITY_MODEL_TYPE, DEFAULT_MODEL_PATH, \
-    WIKI_URL_ENV_VAR, WIKI_URL_NOT_FOUND_IN_ENV_ERR
+    WIKI_URL_ENV_VAR, WIKI_URL_NOT_FOUND_IN_ENV_ERR, MODEL_CACHE_DIR
 from common.enums import RevscoringModelType
+from common.model_cache import load_cached
 
 
 def get_model_path(model_kind: RevscoringModelType):
     """
     Determines the path to a model file based on the model kind and environment variables.
 
-    Checks for a model path in the MODEL_PATH_ENV_VAR environment variable; if not found, it
-    selects a default path based on the model kind. Supports custom paths for different types
-    of models.
+    Checks for a model path in the MODEL_PATH_<MODEL KIND> environment variable (for example
+    MODEL_PATH_EDITQUALITY_DAMAGING, needed when a process hosts several models), then in the
+    MODEL_PATH_ENV_VAR one; if not found, it selects a default path based on the model kind.
+    Supports custom paths for different types of models.
 
     Parameters:
     - model_kind (RevscoringModelType): The kind of model, affecting the default path selection.
@@ -20,7 +26,10 @@ def get_model_path(model_kind: RevscoringModelType):
     Returns:
     - str: The determined path to the model file.
     """
-    if MODEL_PATH_ENV_VAR in os.environ:
+    model_kind_env_var = f"{MODEL_PATH_ENV_VAR}_{model_kind.name}"
+    if model_kind_env_var in os.environ:
+        model_path = os.environ[model_kind_env_var]
+    elif MODEL_PATH_ENV_VAR in os.environ:
         model_path = os.environ[MODEL_PATH_ENV_VAR]
     elif model_kind == RevscoringModelType.DRAFTQUALITY:
         model_path = MODEL_PATH_FOR_DRAFT_QUALITY_MODEL_TYPE
@@ -61,12 +70,57 @@ def score(model, feature_values):
     return model.score(feature_values)
 
 
+def score_many(model, feature_values_list):
+    """
+    Scores many sets of feature values with a single (vectorized) call to the model's estimators,
+    returning the same results as calling score() for each of them.
+
+    revscoring's Model.score_many re-fits the model's scaler on the values to score, which changes
+    the results (and the scaler used by subsequent calls to score()), so only the fitted scaler is
+    applied here. Models that are not probability classifiers are scored one set at a time.
+
+    Parameters:
+    - model: The model used for scoring.
+    - feature_values_list: A list of lists of feature values to be scored by the model.
+
+    Returns:
+    - list: The scoring results, in the same order as feature_values_list.
+    """
+    if not isinstance(model, ProbabilityClassifier) or not feature_values_list:
+        return [model.score(feature_values) for feature_values in feature_values_list]
+    fv_vectors = [vectorize_values(feature_values) for feature_values in feature_values_list]
+    if model.scaler is not None:
+        fv_vectors = model.scaler.transform(fv_vectors)
+    if model.multilabel:
+        predictions = np.transpose([estimator.predict(fv_vectors) for _, estimator in model.estimators])
+        probabilities = np.transpose(
+            [estimator.predict_proba(fv_vectors)[:, 1] for _, estimator in model.estimators]
+        )
+        labels = model.labels
+    else:
+        predictions = model.estimator.predict(fv_vectors)
+        probabilities = model.estimator.predict_proba(fv_vectors)
+        labels = model.estimator.classes_
+    results = []
+    for prediction, probability in zip(predictions, probabilities):
+        if model.multilabel:
+            prediction = list(prediction)
+        doc = {
+            'prediction': model.label_normalizer.denormalize(prediction),
+            'probability': {label: proba for label, proba in zip(labels, probability)},
+        }
+        results.append(model_util.normalize_json(doc))
+    return results
+
+
 def load(model_kind: RevscoringModelType, model_path: str):
     """
     Loads a model from a specified path, handling different types of model files.
 
     If the model kind is DRAFTQUALITY, the model file is assumed to be compressed with bz2.
     Otherwise, it is loaded directly from a standard file.
+    If the MODEL_CACHE_DIR environment variable is set, the model file is verified against its
+    .sha512 file and loaded from a cached fast-loading form (see common.model_cache).
 
     Parameters:
     - model_kind (RevscoringModelType): The kind of the model, which determines how to load it.
@@ -76,11 +130,23 @@ def load(model_kind: RevscoringModelType, model_path: str):
     - The loaded model object.
     """
     if model_kind == RevscoringModelType.DRAFTQUALITY:
-        with bz2.open(model_path) as f:
-            return Model.load(f)
+        load_function = _load_bz2
     else:
-        with open(model_path) as f:
-            return Model.load(f)
+        load_function = _load_plain
+    cache_dir = os.environ.get(MODEL_CACHE_DIR)
+    if cache_dir:
+        return load_cached(model_path, cache_dir, load_function)
+    return load_function(model_path)
+
+
+def _load_bz2(model_path: str):
+    with bz2.open(model_path) as f:
+        return Model.load(f)
+
+
+def _load_plain(model_path: str):
+    with open(model_path) as f:
+        return Model.load(f)
 
 
 def convert(value):
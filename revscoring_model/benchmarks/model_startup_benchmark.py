@@ -0,0 +1,141 @@
+import argparse
+import bz2
+import hashlib
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "model_servers"))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", ".."))
+
+from common.constants import MODEL_CACHE_DIR  # noqa: E402
+from common.enums import RevscoringModelType  # noqa: E402
+from common.utils import load  # noqa: E402
+
+
+def synthetic_model_path(trees: int) -> str:
+    """Train a random forest on wikitext features, whose size (about 0.7MB
+    per tree) is in the range of the production models, for when no real
+    model binary is passed via --model_paths."""
+    from revscoring.features import wikitext
+    from revscoring.scoring.models import RandomForest
+
+    revision = wikitext.revision
+    features = [
+        revision.chars,
+        revision.words,
+        revision.parent.chars,
+        revision.parent.words,
+        revision.diff.words_added,
+    ]
+    model = RandomForest(
+        features, [True, False], n_estimators=trees, min_samples_leaf=1
+    )
+    model.train(
+        [
+            ([random.random() * 100 for _ in features], random.random() < 0.5)
+            for _ in range(20_000)
+        ]
+    )
+    path = os.path.join(tempfile.mkdtemp(), "model.bin")
+    with open(path, "wb") as f:
+        model.dump(f)
+    return path
+
+
+def prepare_model(model_kind: RevscoringModelType, model_path: str) -> str:
+    """Copy a model binary to a temporary directory, in the format of its
+    model type (bz2 for draftquality), with its .sha512 file."""
+    directory = tempfile.mkdtemp()
+    if model_kind == RevscoringModelType.DRAFTQUALITY:
+        path = os.path.join(directory, "model.bz2")
+        with open(model_path, "rb") as src, bz2.open(path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    else:
+        path = os.path.join(directory, "model.bin")
+        shutil.copyfile(model_path, path)
+    with open(path, "rb") as f:
+        digest = hashlib.sha512(f.read()).hexdigest()
+    with open(f"{path}.sha512", "w") as f:
+        f.write(f"{digest} *{path}\n")
+    return path
+
+
+def time_load(model_kind: RevscoringModelType, path: str) -> float:
+    start = time.perf_counter()
+    load(model_kind, path)
+    return time.perf_counter() - start
+
+
+def main(args) -> None:
+    model_paths = args.model_paths or [synthetic_model_path(args.trees)] * len(
+        args.model_types
+    )
+    if len(model_paths) != len(args.model_types):
+        raise ValueError("Expected one --model_paths entry per --model_types entry.")
+    print(
+        f"{'model type':>24} {'size MB':>8} {'binary ms':>10} "
+        f"{'first cached ms':>16} {'cached ms':>10}"
+    )
+    for model_type, model_path in zip(args.model_types, model_paths):
+        model_kind = RevscoringModelType(model_type)
+        path = prepare_model(model_kind, model_path)
+        cache_dir = tempfile.mkdtemp()
+
+        os.environ.pop(MODEL_CACHE_DIR, None)
+        binary = [time_load(model_kind, path) for _ in range(args.iterations)]
+        os.environ[MODEL_CACHE_DIR] = cache_dir
+        # The first load creates the cached form, the next ones use it.
+        first_cached = time_load(model_kind, path)
+        cached = [time_load(model_kind, path) for _ in range(args.iterations)]
+        os.environ.pop(MODEL_CACHE_DIR)
+
+        print(
+            f"{model_type:>24} {os.path.getsize(path) / 2**20:>8.1f} "
+            f"{statistics.median(binary) * 1000:>10.1f} "
+            f"{first_cached * 1000:>16.1f} "
+            f"{statistics.median(cached) * 1000:>10.1f}"
+        )
+        shutil.rmtree(os.path.dirname(path))
+        shutil.rmtree(cache_dir)
+
+
+# Benchmark of the model loading time at startup (and at every process pool
+# worker start), per model type: loading the model binary as shipped (bz2 for
+# draftquality) versus loading its cached form (MODEL_CACHE_DIR, see
+# common.model_cache). The time of the first cached load includes creating
+# the cached form. A synthetic model is trained if --model_paths is not given.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model startup benchmark")
+    parser.add_argument(
+        "--model_types",
+        type=str,
+        nargs="+",
+        default=[e.value for e in RevscoringModelType],
+        choices=[e.value for e in RevscoringModelType],
+    )
+    parser.add_argument(
+        "--model_paths",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Model binaries (not compressed), one per model type",
+    )
+    parser.add_argument(
+        "--trees",
+        type=int,
+        default=50,
+        help="Number of trees of the synthetic model",
+    )
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    random.seed(0)
+    main(args)
@@ -0,0 +1,120 @@
+import argparse
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_servers")
+)
+
+from mwapi_utils import decode_json, orjson  # noqa: E402
+
+WORDS = [
+    "the",
+    "of",
+    "[[Wikipedia]]",
+    "{{cite web|url=https://example.org}}",
+    "'''bold'''",
+    "==Section==",
+    "café",
+    "Zürich",
+    "日本語",
+    "<ref>source</ref>",
+    "|-",
+    "| cell",
+    "{{Infobox|name=value}}",
+    "[[Category:Example]]",
+]
+
+
+def revision_doc(rev_id: int, parent_id: int, size: int) -> dict:
+    words = []
+    length = 0
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return {
+        "revid": rev_id,
+        "parentid": parent_id,
+        "user": "Example",
+        "userid": 1,
+        "timestamp": "2024-01-01T00:00:00Z",
+        "size": length,
+        "comment": "benchmark",
+        "slots": {"main": {"contentmodel": "wikitext", "*": " ".join(words)}},
+    }
+
+
+def fixture(size: int) -> bytes:
+    """A MW API response body for a revision of (about) size bytes,
+    encoded like the MW API does (non-ASCII characters escaped)."""
+    doc = {
+        "batchcomplete": "",
+        "query": {
+            "pages": {
+                "1": {
+                    "pageid": 1,
+                    "ns": 0,
+                    "title": "Example",
+                    "revisions": [revision_doc(2, 1, size)],
+                }
+            }
+        },
+    }
+    return json.dumps(doc).encode("utf-8")
+
+
+def stdlib_decode(body: bytes):
+    # What aiohttp's ClientResponse.json() does.
+    return json.loads(body.decode("utf-8"))
+
+
+def timeit(function, body: bytes, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(body)
+    return (time.perf_counter() - start) / iterations
+
+
+def main(sizes, iterations: int) -> None:
+    if orjson is None:
+        print("orjson is not installed, decode_json falls back to the json module.")
+    print(
+        f"{'revision size':>14} {'body MB':>8} {'gzip ratio':>10} "
+        f"{'json ms/MB':>11} {'fast ms/MB':>11} {'speedup':>8}"
+    )
+    for size in sizes:
+        body = fixture(size)
+        megabytes = len(body) / 1e6
+        gzip_ratio = len(gzip.compress(body)) / len(body)
+        stdlib = timeit(stdlib_decode, body, iterations)
+        fast = timeit(decode_json, body, iterations)
+        print(
+            f"{size:>14} {megabytes:>8.2f} {gzip_ratio:>10.2f} "
+            f"{stdlib * 1000 / megabytes:>11.2f} {fast * 1000 / megabytes:>11.2f} "
+            f"{stdlib / fast:>7.1f}x"
+        )
+
+
+# Microbenchmark of the decoding of MW API revision documents, comparing
+# the json module (mwapi/aiohttp default) with decode_json (orjson when
+# available) on synthetic revisions of growing size. It also reports the
+# compression ratio of the response body with gzip.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MW API decoding benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 500_000, 2_000_000],
+        help="Sizes (in bytes) of the wikitext of the revisions to decode",
+    )
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+    random.seed(0)
+    main(args.sizes, args.iterations)
@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "model_servers"))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", ".."))
+
+import process_utils  # noqa: E402
+import worker_utils  # noqa: E402
+from common.enums import RevscoringModelType  # noqa: E402
+
+WIKI_URL = "https://en.wikipedia.org"
+USER_AGENT = "process pool benchmark"
+WORDS = [
+    "the",
+    "of",
+    "[[Wikipedia]]",
+    "'''bold'''",
+    "==Section==",
+    "café",
+    "POOP",
+    "!!!",
+]
+
+
+def synthetic_model_path() -> str:
+    """Train a small revscoring model on wikitext features, for when
+    no real model binary is passed via --model_path."""
+    from revscoring.features import revision_oriented, wikitext
+    from revscoring.features.modifiers import log
+    from revscoring.scoring.models import GradientBoosting
+
+    revision = wikitext.revision
+    features = [
+        log(revision.diff.words_added + 1),
+        log(revision.diff.words_removed + 1),
+        revision.diff.markups_added,
+        revision.diff.uppercase_words_added,
+        revision.diff.longest_repeated_char_added,
+        log(revision.chars + 1),
+        revision.parent.words,
+        revision_oriented.revision.user.is_anon,
+    ]
+    model = GradientBoosting(features, [True, False], n_estimators=100)
+    observations = [
+        ([random.random() * 5 for _ in range(len(features) - 1)] + [label], label)
+        for label in (True, False)
+        for _ in range(200)
+    ]
+    model.train(observations)
+    path = os.path.join(tempfile.mkdtemp(), "model.bin")
+    with open(path, "wb") as f:
+        model.dump(f)
+    return path
+
+
+def wikitext(size: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(size // 5))
+
+
+def revision_doc(rev_id: int, parent_id: int, text: str) -> dict:
+    return {
+        "query": {
+            "pages": {
+                "1": {
+                    "pageid": 1,
+                    "ns": 0,
+                    "title": "Example",
+                    "revisions": [
+                        {
+                            "revid": rev_id,
+                            "parentid": parent_id,
+                            "user": "127.0.0.1",
+                            "userid": 0,
+                            "anon": "",
+                            "timestamp": "2024-01-01T00:00:00Z",
+                            "size": len(text),
+                            "comment": "benchmark",
+                            "slots": {"main": {"contentmodel": "wikitext", "*": text}},
+                        }
+                    ],
+                }
+            }
+        }
+    }
+
+
+async def two_hops(pool, rev_id, extended_output, docs):
+    feature_values, _, _ = await process_utils.run_in_process_pool(
+        pool,
+        worker_utils.extract_features,
+        rev_id,
+        extended_output,
+        docs,
+        WIKI_URL,
+        USER_AGENT,
+    )
+    return await process_utils.run_in_process_pool(
+        pool, worker_utils.score_features, feature_values
+    )
+
+
+async def one_hop(pool, rev_id, extended_output, docs):
+    _, _, _, score = await process_utils.run_in_process_pool(
+        pool,
+        worker_utils.extract_and_score,
+        rev_id,
+        extended_output,
+        docs,
+        WIKI_URL,
+        USER_AGENT,
+    )
+    return score
+
+
+async def run(pool, job, requests: int, concurrency: int, extended_output: bool, docs):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request():
+        async with semaphore:
+            start = time.perf_counter()
+            await job(pool, 2, extended_output, docs)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (
+        requests / elapsed,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    )
+
+
+async def main(args) -> None:
+    model_path = args.model_path or synthetic_model_path()
+    model_kind = RevscoringModelType(args.model_type)
+    pool = process_utils.create_process_pool(
+        args.workers, worker_utils.init_worker, (model_kind, model_path)
+    )
+    parent_text = wikitext(args.size)
+    docs = {
+        "revisions": {
+            2: revision_doc(2, 1, parent_text + " " + wikitext(args.size // 10)),
+            1: revision_doc(1, 0, parent_text),
+        },
+        "users": {},
+    }
+    # Warm up the workers (model loading, extractor creation).
+    await run(pool, one_hop, args.workers * 2, args.workers, args.extended_output, docs)
+    print(f"{'concurrency':>11} {'mode':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for name, job in (("two hops", two_hops), ("one hop", one_hop)):
+            throughput, p50, p99 = await run(
+                pool, job, args.requests, concurrency, args.extended_output, docs
+            )
+            print(
+                f"{concurrency:>11} {name:>8} {throughput:>8.1f} {p50:>8.2f} {p99:>8.2f}"
+            )
+    pool.shutdown()
+
+
+# Benchmark of the process pool round trips of RevscoringModelMP: extracting
+# and scoring a rev-id with two pool calls (PREPROCESS_MP and INFERENCE_MP)
+# versus a single fused call (FUSED_MP), under increasing concurrency.
+# A small synthetic model is trained if --model_path is not given.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process pool round trips benchmark")
+    parser.add_argument("--model_path", type=str, default=None)
+    parser.add_argument(
+        "--model_type",
+        type=str,
+        default=RevscoringModelType.EDITQUALITY_GOODFAITH.value,
+        choices=[e.value for e in RevscoringModelType],
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=20_000,
+        help="Size of the parent revision's wikitext",
+    )
+    parser.add_argument("--extended_output", action="store_true")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    random.seed(0)
+    asyncio.run(main(args))
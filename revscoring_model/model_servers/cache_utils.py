@@ -0,0 +1,194 @@
+import copy
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from common.constants import (
+    MWAPI_CACHE_BADREVID_TTL,
+    MWAPI_CACHE_MAX_BYTES,
+    MWAPI_CACHE_REVISION_TTL,
+    MWAPI_CACHE_USER_TTL,
+)
+from metrics_utils import CACHE_BYTES, CACHE_EVICTIONS, CACHE_REQUESTS
+
+
+def approximate_size(value: Any) -> int:
+    """Cheap estimation of the memory used by a JSON-like value
+    (MW API documents), without serializing it.
+    Strings count for their length, containers for their items plus
+    a small fixed overhead per item."""
+    if isinstance(value, str):
+        return len(value) + 50
+    if isinstance(value, dict):
+        return 64 + sum(
+            approximate_size(k) + approximate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(approximate_size(v) for v in value)
+    return 32
+
+
+class TTLLRUCache:
+    """An in-memory cache bounded by the approximate byte size of its values.
+    Every entry has its own time to live, and the least recently used entries
+    are evicted when the byte budget is exceeded.
+    The cache is not thread-safe, it is meant to be used from the asyncio
+    event loop (or from a single-threaded worker process).
+    """
+
+    def __init__(self, name: str, max_bytes: int, default_ttl: float):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        # key -> (expiry timestamp, size, value)
+        self._entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            CACHE_EVICTIONS.labels(self.name, "expired").inc()
+            entry = None
+        if entry is None:
+            self.misses += 1
+            CACHE_REQUESTS.labels(self.name, "miss").inc()
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_REQUESTS.labels(self.name, "hit").inc()
+        return entry[2]
+
+    def set(
+        self, key: Hashable, value: Any, ttl: float = None, size: int = None
+    ) -> None:
+        if size is None:
+            size = approximate_size(value)
+        if size > self.max_bytes:
+            logging.debug(
+                f"Not caching {key} in {self.name}, its size ({size} bytes) "
+                "exceeds the cache budget."
+            )
+            return
+        if key in self._entries:
+            self._remove(key)
+        ttl = self.default_ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+            CACHE_EVICTIONS.labels(self.name, "size").inc()
+        CACHE_BYTES.labels(self.name).set(self.current_bytes)
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+        CACHE_BYTES.labels(self.name).set(self.current_bytes)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class MWAPIDocCache:
+    """Process-wide cache of the MW API documents used to build
+    the revscoring extractor's MWAPICache, shared between requests.
+    - Revision documents never change for a given rev-id, so they are kept
+      for a long time. The parent revision of an edit is often the scored
+      revision of the previous edit of the same page.
+    - User documents change (edit count, groups, etc..) so they are kept
+      for a short time.
+    - Rev-ids returned as badrevids by the MW API are cached as negative
+      entries, to avoid querying them again and again.
+    Rev-ids and user documents are only unique within a wiki, so the keys
+    include the wiki of the cache (see for_wiki).
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        revision_ttl: float,
+        user_ttl: float,
+        badrevid_ttl: float,
+        wiki: str = None,
+    ):
+        self.revision_ttl = revision_ttl
+        self.user_ttl = user_ttl
+        self.badrevid_ttl = badrevid_ttl
+        self.wiki = wiki
+        self._cache = TTLLRUCache("mwapi_docs", max_bytes, revision_ttl)
+
+    def for_wiki(self, wiki: str) -> "MWAPIDocCache":
+        """Returns a view of the cache for the documents of a wiki, sharing
+        the entries (and the budget) of the other views."""
+        view = copy.copy(self)
+        view.wiki = wiki
+        return view
+
+    def get_revision_doc(self, rev_id: int) -> Optional[Dict]:
+        return self._cache.get(("revision", self.wiki, rev_id))
+
+    def add_revision_doc(self, rev_id: int, doc: Dict) -> None:
+        query = doc.get("query", {})
+        key = ("revision", self.wiki, rev_id)
+        if "badrevids" in query:
+            self._cache.set(key, doc, ttl=self.badrevid_ttl)
+        elif query.get("pages"):
+            self._cache.set(key, doc, ttl=self.revision_ttl)
+
+    def get_user_doc(self, user: str) -> Optional[Dict]:
+        return self._cache.get(("user", self.wiki, user))
+
+    def add_user_doc(self, user: str, doc: Dict) -> None:
+        if doc.get("query", {}).get("users"):
+            self._cache.set(("user", self.wiki, user), doc, ttl=self.user_ttl)
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+
+_mwapi_doc_cache = None
+
+
+def get_mwapi_doc_cache(wiki: str = None) -> Optional[MWAPIDocCache]:
+    """Returns the process-wide MWAPIDocCache (the view of a wiki, if
+    passed), creating it on the first call.
+    The cache is configured via environment variables, and it is disabled
+    (None is returned) unless MWAPI_CACHE_MAX_BYTES is set to a positive value.
+    """
+    global _mwapi_doc_cache
+    if _mwapi_doc_cache is None:
+        max_bytes = int(os.environ.get(MWAPI_CACHE_MAX_BYTES, 0))
+        if max_bytes <= 0:
+            return None
+        _mwapi_doc_cache = MWAPIDocCache(
+            max_bytes,
+            revision_ttl=float(os.environ.get(MWAPI_CACHE_REVISION_TTL, 86400)),
+            user_ttl=float(os.environ.get(MWAPI_CACHE_USER_TTL, 60)),
+            badrevid_ttl=float(os.environ.get(MWAPI_CACHE_BADREVID_TTL, 300)),
+        )
+        logging.info(
+            f"Created a MW API documents cache with a budget of {max_bytes} bytes."
+        )
+    if wiki is not None:
+        return _mwapi_doc_cache.for_wiki(wiki)
+    return _mwapi_doc_cache
@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+from metrics_utils import (
+    MICRO_BATCH_SIZE,
+    MICRO_BATCH_WAIT_SECONDS,
+    SINGLE_FLIGHT_COLLAPSED,
+    SINGLE_FLIGHT_WAITERS,
+)
+
+
+class MicroBatcher:
+    """Collect the keys submitted by concurrent callers for a short time
+    window and resolve all of them with a single call to a batch function.
+    The batch is flushed when the window expires or when it reaches
+    its maximum size, whichever comes first. The same key submitted twice
+    in the same window is resolved only once.
+
+    The batch function is a coroutine that accepts a list of keys and
+    returns a dict key -> result. Keys missing from the returned dict
+    are resolved with a LookupError, a result that is an exception is
+    raised to the callers of its key only, and an exception raised by the
+    batch function is propagated to every caller of the batch.
+
+    The size of the batches and the time spent by the keys in the queue
+    are exported, labeled with the name of the batcher.
+    """
+
+    def __init__(
+        self,
+        batch_function: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        max_wait: float,
+        max_size: int,
+        name: str = "default",
+    ):
+        self.batch_function = batch_function
+        self.max_wait = max_wait
+        self.max_size = max(1, max_size)
+        self.name = name
+        self._pending = {}
+        self._submitted = {}
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, key: Hashable) -> Any:
+        """Add a key to the current batch and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(key)
+        if future is None:
+            future = loop.create_future()
+            # Avoid 'exception was never retrieved' warnings when all
+            # the callers waiting for a key have been cancelled.
+            future.add_done_callback(_consume_exception)
+            self._pending[key] = future
+            self._submitted[key] = loop.time()
+            if len(self._pending) >= self.max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.max_wait, self._flush)
+        # The future is shared between callers, so cancelling one of them
+        # must not cancel the future itself.
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        submitted, self._submitted = self._submitted, {}
+        if batch:
+            MICRO_BATCH_SIZE.labels(self.name).observe(len(batch))
+            now = asyncio.get_event_loop().time()
+            for submit_time in submitted.values():
+                MICRO_BATCH_WAIT_SECONDS.labels(self.name).observe(now - submit_time)
+            task = asyncio.ensure_future(self._run_batch(batch))
+            # Keep a reference to the task until it completes, otherwise
+            # it may be garbage collected while still running.
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self.batch_function(list(batch))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            logging.debug(f"Batch of {len(batch)} keys failed: {e}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if future.done():
+                continue
+            if key not in results:
+                future.set_exception(
+                    LookupError(f"The batch function returned no result for {key}.")
+                )
+            elif isinstance(results[key], Exception):
+                future.set_exception(results[key])
+            else:
+                future.set_result(results[key])
+
+
+class ScoreBatcher:
+    """Score the feature values of concurrent requests together: the values
+    submitted for a short time window (or until the batch reaches its maximum
+    size) are scored with a single call to a batch scoring coroutine, and
+    every caller gets its own result (see MicroBatcher). If the batch call
+    fails (like for a single invalid feature vector), the values are scored
+    one by one, so that only the callers whose values fail get the error.
+
+    The scoring coroutine accepts a list of feature value lists and returns
+    the list of their scores, in the same order (like
+    RevscoringModel.score_batch, that may run in a process pool).
+    """
+
+    def __init__(
+        self,
+        score_many: Callable[[List[List]], Awaitable[List[Dict]]],
+        max_wait: float,
+        max_size: int,
+    ):
+        self.score_many = score_many
+        self._batcher = MicroBatcher(self._score, max_wait, max_size, name="score")
+        # Feature values are lists (not hashable), so every call gets
+        # its own key.
+        self._keys = itertools.count()
+        self._feature_values = {}
+
+    async def score(self, feature_values: List) -> Dict:
+        """Add feature values to the current batch and wait for their score."""
+        key = next(self._keys)
+        self._feature_values[key] = feature_values
+        return await self._batcher.submit(key)
+
+    async def _score(self, keys: List[int]) -> Dict[int, Dict]:
+        # Every key submitted to the batcher ends up in a batch (even if its
+        # caller was cancelled), so the feature values are always released.
+        feature_values_list = [self._feature_values.pop(key) for key in keys]
+        try:
+            return dict(zip(keys, await self.score_many(feature_values_list)))
+        except Exception as e:
+            if len(keys) == 1:
+                raise
+            logging.debug(
+                f"Scoring a batch of {len(keys)} failed, scoring one by one: {e}"
+            )
+        results = await asyncio.gather(
+            *(
+                self.score_many([feature_values])
+                for feature_values in feature_values_list
+            ),
+            return_exceptions=True,
+        )
+        scores = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                scores[key] = result
+            else:
+                scores[key] = result[0]
+        return scores
+
+
+def _consume_exception(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception()
+
+
+class SingleFlight:
+    """Registry of in-flight coroutines keyed by query, so that concurrent
+    callers asking for the same key await the same result instead of
+    running the same work (for example, the same MW API call) twice.
+    - Cancelling one caller doesn't cancel the shared work, since other
+      callers may still be waiting for it.
+    - The key is removed from the registry as soon as the work completes,
+      so a failure is propagated only to the callers already waiting
+      for it and the next caller will try again.
+    The number of callers that shared each flight is exported, to measure
+    how much traffic gets collapsed.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self._waiters = {}
+
+    def waiters(self, key: Hashable) -> int:
+        """Returns the number of callers that joined the in-flight work
+        for a key (0 if there isn't any)."""
+        return self._waiters.get(key, 0)
+
+    async def do(
+        self, key: Hashable, coroutine_function: Callable[..., Awaitable], *args
+    ) -> Any:
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_function(*args))
+            self._flights[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._land(key, t))
+        else:
+            SINGLE_FLIGHT_COLLAPSED.labels(self.name).inc()
+        self._waiters[key] += 1
+        return await asyncio.shield(task)
+
+    def _land(self, key: Hashable, task: asyncio.Future):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+            SINGLE_FLIGHT_WAITERS.labels(self.name).observe(self._waiters.pop(key))
+        _consume_exception(task)
@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from revscoring.dependencies import expand
+from revscoring.features import wikitext
+
+from cache_utils import TTLLRUCache
+from common.constants import DATASOURCE_CACHE_MAX_BYTES, DATASOURCE_CACHE_TTL
+
+# The datasources computed from the text of a revision that are worth
+# caching (tokenizing, parsing and sentence splitting are the most expensive
+# steps of the feature extraction), with the approximate memory they use
+# per character of the text.
+CACHED_DATASOURCES = {
+    "tokens": 4,
+    "wikicode": 36,
+    "paragraphs_sentences_and_whitespace": 8,
+    "token_frequency": 1,
+}
+
+# The same datasources are computed for the scored revision and for its
+# parent, so the values cached for a text when it was the scored revision
+# are reused when it is the parent of the next edit (and vice versa).
+_ROLES = (wikitext.revision.datasources, wikitext.revision.parent.datasources)
+
+
+class DatasourceCache:
+    """Cache of the expensive datasources computed from the text of
+    revisions (tokens, parsed wikicode, sentences), keyed by a hash of the
+    text and shared between the scored revision and parent roles.
+
+    When a page gets a burst of edits, the parent of every scored revision
+    is the previous scored revision, so its text is tokenized, parsed and
+    split only once. The cache lives in the process that runs the
+    extraction (like a long-lived process pool worker), and it is bounded
+    by the approximate memory used by its values.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.cache = TTLLRUCache("datasources", max_bytes, ttl)
+        self._roles = {}
+
+    def _get_roles(self, features) -> List[Tuple]:
+        """Returns the (text datasource, {name: datasource}) pairs of the
+        revision roles whose cached datasources are needed by a list of
+        features, computed once per list of features."""
+        key = tuple(features)
+        if key not in self._roles:
+            dependents = set(expand(key))
+            roles = []
+            for datasources in _ROLES:
+                cached = {
+                    name: getattr(datasources, name)
+                    for name in CACHED_DATASOURCES
+                    if getattr(datasources, name) in dependents
+                }
+                if cached and datasources.text in dependents:
+                    roles.append((datasources.text, cached))
+            self._roles[key] = roles
+        return self._roles[key]
+
+    def extract(
+        self, extractor, rev_id: int, features, cache: Dict, profile: Dict = None
+    ) -> List:
+        """Extract features with a revscoring extractor, injecting the
+        cached datasources of the revisions' texts into the solve cache
+        and caching the ones computed by the extraction.
+        """
+        roles = self._get_roles(features)
+        if not roles:
+            return list(
+                extractor.extract(rev_id, features, cache=cache, profile=profile)
+            )
+        # Solving the texts first (cheap, the MW API documents are already
+        # in the extractor's MWAPICache) gives the keys of the cache.
+        texts = extractor.extract(
+            rev_id, [text for text, _ in roles], cache=cache, profile=profile
+        )
+        entries = []
+        for (_, datasources), text in zip(roles, texts):
+            if not text:
+                continue
+            key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            values = self.cache.get(key) or {}
+            for name, datasource in datasources.items():
+                if name in values:
+                    cache[datasource] = values[name]
+            entries.append((key, len(text), datasources, values))
+
+        feature_values = list(
+            extractor.extract(rev_id, features, cache=cache, profile=profile)
+        )
+
+        for key, text_length, datasources, values in entries:
+            computed = {
+                name: cache[datasource]
+                for name, datasource in datasources.items()
+                if name not in values and datasource in cache
+            }
+            if computed:
+                values = {**values, **computed}
+                size = 100 + text_length * sum(
+                    CACHED_DATASOURCES[name] for name in values
+                )
+                self.cache.set(key, values, size=size)
+        return feature_values
+
+
+_datasource_cache = None
+
+
+def get_datasource_cache() -> Optional[DatasourceCache]:
+    """Returns the DatasourceCache of the current process, creating it on
+    the first call. The cache is configured via environment variables, and
+    it is disabled (None is returned) unless DATASOURCE_CACHE_MAX_BYTES is
+    set to a positive value.
+    """
+    global _datasource_cache
+    if _datasource_cache is None:
+        max_bytes = int(os.environ.get(DATASOURCE_CACHE_MAX_BYTES, 0))
+        if max_bytes <= 0:
+            return None
+        _datasource_cache = DatasourceCache(
+            max_bytes, ttl=float(os.environ.get(DATASOURCE_CACHE_TTL, 600))
+        )
+        logging.info(
+            f"Process {os.getpid()} created a datasources cache with a budget "
+            f"of {max_bytes} bytes."
+        )
+    return _datasource_cache
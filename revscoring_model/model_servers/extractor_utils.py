@@ -1,6 +1,7 @@
 import asyncio
 import logging
-from typing import Dict, Optional
+import os
+from typing import Dict, List, Optional, Tuple, Union
 
 import aiohttp
 import mwapi
@@ -15,25 +16,216 @@ from mwapi.errors import (
 from revscoring.errors import MissingResource, UnexpectedContentType
 from revscoring.extractors.api import Extractor, MWAPICache
 
+from common.constants import WIKI_HOST_ENV_VAR
+from common.response_store import wrap_session
+from cache_utils import MWAPIDocCache
+from coalescing_utils import SingleFlight
+from datasource_cache import get_datasource_cache
 from decorators import elapsed_time, elapsed_time_async
+from metrics_utils import EVENT_DOCS_REQUESTS
+from mwapi_utils import REVISION_PARAMS, USER_PARAMS, MWAPIBatcher, MWAPIClient
+
+
+class _MWAPIDocFetcher:
+    """Fetch the MW API documents needed by a single request, going through
+    (in order) the documents provided by the input event, the shared
+    MWAPIDocCache, the SingleFlight registry and the MWAPIBatcher (when
+    available) before calling the MW API directly.
+    """
+
+    def __init__(
+        self,
+        session: Union[mwapi.AsyncSession, MWAPIClient],
+        mwapi_batcher: MWAPIBatcher = None,
+        doc_cache: MWAPIDocCache = None,
+        single_flight: SingleFlight = None,
+        event_docs: Dict = None,
+    ):
+        self.session = session
+        self.mwapi_batcher = mwapi_batcher
+        self.doc_cache = doc_cache
+        self.single_flight = single_flight
+        self.event_docs = event_docs or {"revisions": {}, "users": {}}
+        # Where the documents of the request came from (see
+        # get_revscoring_extractor_docs).
+        self.docs_from_event = 0
+        self.docs_from_cache = 0
+        self.docs_from_api = 0
+
+    async def get_revision_doc(self, rev_id: int) -> Dict:
+        doc = self.event_docs["revisions"].get(rev_id)
+        if doc is not None:
+            self.docs_from_event += 1
+            return doc
+        if self.doc_cache:
+            doc = self.doc_cache.get_revision_doc(rev_id)
+            if doc is not None:
+                self.docs_from_cache += 1
+                return doc
+        self.docs_from_api += 1
+        if self.single_flight:
+            return await self.single_flight.do(
+                ("revision", rev_id), self._fetch_revision_doc, rev_id
+            )
+        return await self._fetch_revision_doc(rev_id)
+
+    async def _fetch_revision_doc(self, rev_id: int) -> Dict:
+        if self.mwapi_batcher:
+            doc = await self.mwapi_batcher.get_revision_doc(rev_id)
+        else:
+            doc = await self.session.get(
+                action="query",
+                prop="revisions",
+                revids=[rev_id],
+                rvslots="main",
+                **REVISION_PARAMS,
+            )
+        if self.doc_cache:
+            self.doc_cache.add_revision_doc(rev_id, doc)
+        return doc
+
+    async def get_user_doc(self, user: str) -> Dict:
+        doc = self.event_docs["users"].get(user)
+        if doc is not None:
+            self.docs_from_event += 1
+            return doc
+        if self.doc_cache:
+            doc = self.doc_cache.get_user_doc(user)
+            if doc is not None:
+                self.docs_from_cache += 1
+                return doc
+        self.docs_from_api += 1
+        if self.single_flight:
+            return await self.single_flight.do(
+                ("user", user), self._fetch_user_doc, user
+            )
+        return await self._fetch_user_doc(user)
+
+    async def _fetch_user_doc(self, user: str) -> Dict:
+        if self.mwapi_batcher:
+            doc = await self.mwapi_batcher.get_user_doc(user)
+        else:
+            doc = await self.session.get(
+                action="query", list="users", ususers=[user], **USER_PARAMS
+            )
+        if self.doc_cache:
+            self.doc_cache.add_user_doc(user, doc)
+        return doc
+
+
+def _page_change_revision_doc(page: Dict, revision: Dict) -> Optional[Dict]:
+    """Build the MW API document of a revision (as returned by
+    action=query&prop=revisions&rvslots=main) from the revision
+    fields of a page_change event, or None if the event doesn't carry
+    the revision's content and editor."""
+    try:
+        main_slot = revision["content_slots"]["main"]
+        editor = revision["editor"]
+        revision_doc = {
+            "revid": revision["rev_id"],
+            "parentid": revision.get("rev_parent_id", 0),
+            "user": editor["user_text"],
+            "userid": editor.get("user_id", 0),
+            "timestamp": revision["rev_dt"],
+            "size": revision["rev_size"],
+            "slots": {
+                "main": {
+                    "contentmodel": main_slot["content_model"],
+                    "contentformat": main_slot.get("content_format"),
+                    "*": main_slot["content_body"],
+                }
+            },
+        }
+    except (KeyError, TypeError):
+        return None
+    if revision_doc["userid"] == 0:
+        revision_doc["anon"] = ""
+    if revision.get("is_minor_edit"):
+        revision_doc["minor"] = ""
+    if revision.get("is_comment_visible", True) and "comment" in revision:
+        revision_doc["comment"] = revision["comment"]
+    else:
+        revision_doc["commenthidden"] = ""
+    page_doc = {
+        "pageid": page["page_id"],
+        "ns": page["namespace_id"],
+        "title": page["page_title"].replace("_", " "),
+        "revisions": [revision_doc],
+    }
+    return {"query": {"pages": {str(page["page_id"]): page_doc}}}
+
+
+def _page_change_user_doc(editor: Optional[Dict]) -> Optional[Dict]:
+    """Build the MW API document of a registered user (as returned by
+    action=query&list=users) from the editor fields of a page_change event,
+    or None if the event doesn't carry all the info needed."""
+    if not editor or not editor.get("user_id"):
+        return None
+    try:
+        user_doc = {
+            "userid": editor["user_id"],
+            "name": editor["user_text"],
+            "editcount": editor["edit_count"],
+            "registration": editor.get("registration_dt"),
+            "groups": editor["groups"],
+        }
+    except KeyError:
+        return None
+    return {"query": {"users": [user_doc]}}
+
+
+def get_mwapi_docs_from_event(event: Optional[Dict]) -> Dict:
+    """Extract the MW API documents needed to build a MWAPICache from
+    a page_change event, if it carries them. The page_content_change
+    streams enrich page_change events with the content of the current
+    revision and of the previous one (prior_state), together with the info
+    about their editors.
+
+        Parameters:
+            event: The event passed as input, if any.
+
+        Returns:
+            A dict like {"revisions": {rev_id: doc}, "users": {user: doc}}
+            containing only the documents that could be built from the event.
+    """
+    docs = {"revisions": {}, "users": {}}
+    if not event or not event.get("$schema", "").startswith("/mediawiki/page/change/1"):
+        return docs
+    page = event.get("page", {})
+    if not all(k in page for k in ("page_id", "namespace_id", "page_title")):
+        return docs
+    revision = event.get("revision", {})
+    revisions = [revision]
+    prior_state = event.get("prior_state") or {}
+    if "revision" in prior_state:
+        revisions.append(prior_state["revision"])
+    for rev in revisions:
+        revision_doc = _page_change_revision_doc(page, rev)
+        if revision_doc is not None:
+            docs["revisions"][rev["rev_id"]] = revision_doc
+    user_doc = _page_change_user_doc(revision.get("editor"))
+    if user_doc is not None:
+        docs["users"][revision["editor"]["user_text"]] = user_doc
+    return docs
 
 
 @elapsed_time_async
-async def get_revscoring_extractor_cache(
+async def get_revscoring_extractor_docs(
     rev_id: int,
     user_agent: str,
-    client_session: aiohttp.ClientSession,
+    client_session: Optional[aiohttp.ClientSession],
     wiki_url: str,
     wiki_host: str = None,
     fetch_extra_info: bool = False,
-    mwapi_session: mwapi.AsyncSession = None,
-) -> MWAPICache:
-    """Build a revscoring extractor HTTP cache using async HTTP calls.
-    The revscoring API extractor can automatically fetch data from
-    the MW API as well, but sadly only with blocking IO (namely, using Session
-    from the mwapi package). Since KServe works asyncio,
-    we prefer to use mwapi's AsyncSession and pass the data (as MWAPICache)
-    to revscoring.
+    mwapi_session: Union[mwapi.AsyncSession, MWAPIClient] = None,
+    mwapi_batcher: MWAPIBatcher = None,
+    doc_cache: MWAPIDocCache = None,
+    single_flight: SingleFlight = None,
+    event_docs: Dict = None,
+) -> Dict:
+    """Fetch the MW API documents needed by the revscoring extractor using
+    async HTTP calls (see get_revscoring_extractor_cache). The documents
+    are plain dicts, so they can be shipped to other processes as well.
     From tests in T309623, the API extractor fetches:
     - info related to the rev-id
     - user and parent-rev-id data as well
@@ -47,49 +239,50 @@ async def get_revscoring_extractor_cache(
             rev_id: The MediaWiki revision id to check.
             user_agent: HTTP User Agent to use in HTTP calls to the MW API.
             client_session: the aiohttp's ClientSession to use when calling
-                            the MWAPI.
+                            the MWAPI. Used only if mwapi_session is not
+                            specified.
             wiki_url: The URL of the MW API to use.
             wiki_host: The HTTP Host header to set in calls to the MW API.
+                       Used only if mwapi_session is not specified.
             fetch_extra_info: if True, a total of 3 async HTTP calls to the MW
-                              API will be made. By default (False) only one is
-                              made.
-            mwapi_session: A custom mwapi.AsyncSession to use in the code.
-                           If not specified one will be created instead.
+                              API will be made (2 for anonymous editors,
+                              whose user info isn't needed). By default
+                              (False) only one is made.
+            mwapi_session: A custom mwapi.AsyncSession (or a long-lived
+                           MWAPIClient) to use in the code. If not specified
+                           one will be created instead.
+            mwapi_batcher: An optional MWAPIBatcher, shared between requests,
+                           used to coalesce the rev-id and user lookups of
+                           concurrent requests into multi-value MW API queries.
+            doc_cache: An optional MWAPIDocCache, shared between requests,
+                       consulted before calling the MW API.
+            single_flight: An optional SingleFlight registry, shared between
+                           requests, so that concurrent requests needing
+                           the same rev-id or user share the same MW API call.
+            event_docs: Optional MW API documents already available in the
+                        input event (see get_mwapi_docs_from_event),
+                        used instead of calling the MW API.
 
         Returns:
-            The revscoring api extractor's MWAPICache fetched via async HTTP calls.
+            A dict like {"revisions": {rev_id: doc}, "users": {user: doc}}
+            with the documents fetched via async HTTP calls.
     """
-    if wiki_host:
-        client_session.headers.update({"Host": wiki_host})
-
     if mwapi_session:
         session = mwapi_session
     else:
+        if wiki_host:
+            client_session.headers.update({"Host": wiki_host})
         session = mwapi.AsyncSession(
             wiki_url, user_agent=user_agent, session=client_session
         )
 
-    # The parameters are always the same across revscoring models, so
-    # we kept it static. If there is the need to tune those in the future
-    # it should be easy to move them to a funtion's parameter.
-    params = {
-        "rvprop": {
-            "content",
-            "userid",
-            "size",
-            "contentmodel",
-            "ids",
-            "user",
-            "comment",
-            "timestamp",
-        }
-    }
+    fetcher = _MWAPIDocFetcher(
+        session, mwapi_batcher, doc_cache, single_flight, event_docs
+    )
     try:
         # This API call is needed by all model implementations so it is
         # done by default.
-        rev_id_doc = await session.get(
-            action="query", prop="revisions", revids=[rev_id], rvslots="main", **params
-        )
+        rev_id_doc = await fetcher.get_revision_doc(rev_id)
 
         # If 'badrevids' is returned by the MW API then there is something wrong
         # with the revision id provided. If the error message is changed in the InvalidInput exception
@@ -135,20 +328,16 @@ async def get_revscoring_extractor_cache(
         if fetch_extra_info:
             parent_rev_id = revision_info.get("parentid")
             user = revision_info.get("user")
-            user_params = {"usprop": {"groups", "registration", "editcount", "gender"}}
-
-            parent_rev_id_doc, user_doc = await asyncio.gather(
-                session.get(
-                    action="query",
-                    prop="revisions",
-                    revids=[parent_rev_id],
-                    rvslots="main",
-                    **params,
-                ),
-                session.get(
-                    action="query", list="users", ususers=[user], **user_params
-                ),
-            )
+            if "anon" in revision_info:
+                # The user info of anonymous editors is not used by revscoring
+                # (nor available in the events), so it isn't fetched.
+                parent_rev_id_doc = await fetcher.get_revision_doc(parent_rev_id)
+                user_doc = None
+            else:
+                parent_rev_id_doc, user_doc = await asyncio.gather(
+                    fetcher.get_revision_doc(parent_rev_id),
+                    fetcher.get_user_doc(user),
+                )
     except (
         APIError,
         ConnectionError,
@@ -168,19 +357,82 @@ async def get_revscoring_extractor_cache(
             ),
         )
 
-    # Populate the MWAPICache
-    http_cache = MWAPICache()
-    http_cache.add_revisions_batch_doc([rev_id], rev_id_doc)
+    if event_docs is not None:
+        if fetcher.docs_from_cache + fetcher.docs_from_api == 0:
+            coverage = "full"
+        elif fetcher.docs_from_event > 0:
+            coverage = "partial"
+        else:
+            coverage = "none"
+        EVENT_DOCS_REQUESTS.labels(coverage).inc()
+
+    docs = {"revisions": {rev_id: rev_id_doc}, "users": {}}
     if fetch_extra_info:
-        http_cache.add_revisions_batch_doc([parent_rev_id], parent_rev_id_doc)
-        http_cache.add_users_batch_doc([user], user_doc)
+        docs["revisions"][parent_rev_id] = parent_rev_id_doc
+        if user_doc is not None:
+            docs["users"][user] = user_doc
+    return docs
 
+
+def build_mwapi_cache(docs: Dict) -> MWAPICache:
+    """Populate a MWAPICache with the documents returned by
+    get_revscoring_extractor_docs.
+    """
+    http_cache = MWAPICache()
+    for rev_id, doc in docs["revisions"].items():
+        http_cache.add_revisions_batch_doc([rev_id], doc)
+    for user, doc in docs["users"].items():
+        http_cache.add_users_batch_doc([user], doc)
     return http_cache
 
 
+def get_revisions_size(docs: Dict) -> int:
+    """Returns the total size in bytes (as reported by the MW API) of the
+    revisions in the documents returned by get_revscoring_extractor_docs
+    (the rev-id and, if fetched, its parent). The cost of the feature
+    extraction grows with the size of the texts to tokenize and diff, so it
+    is a cheap estimate of it.
+    """
+    size = 0
+    for doc in docs["revisions"].values():
+        pages = ((doc or {}).get("query") or {}).get("pages") or {}
+        for page in pages.values():
+            for revision in page.get("revisions", []):
+                size += revision.get("size") or 0
+    return size
+
+
+async def get_revscoring_extractor_cache(
+    rev_id: int,
+    user_agent: str,
+    client_session: Optional[aiohttp.ClientSession],
+    wiki_url: str,
+    **kwargs,
+) -> MWAPICache:
+    """Build a revscoring extractor HTTP cache using async HTTP calls.
+    The revscoring API extractor can automatically fetch data from
+    the MW API as well, but sadly only with blocking IO (namely, using Session
+    from the mwapi package). Since KServe works asyncio,
+    we prefer to use mwapi's AsyncSession and pass the data (as MWAPICache)
+    to revscoring. The parameters are the same as
+    get_revscoring_extractor_docs's ones.
+
+        Returns:
+            The revscoring api extractor's MWAPICache fetched via async HTTP calls.
+    """
+    docs = await get_revscoring_extractor_docs(
+        rev_id, user_agent, client_session, wiki_url, **kwargs
+    )
+    return build_mwapi_cache(docs)
+
+
 @elapsed_time
 def fetch_features(
-    rev_id, model_features: tuple, extractor: Extractor, cache: Optional[Dict] = None
+    rev_id,
+    model_features: tuple,
+    extractor: Extractor,
+    cache: Optional[Dict] = None,
+    profile: Optional[Dict] = None,
 ) -> Dict:
     """Retrieve model features using a Revscoring extractor provided
     as input.
@@ -190,12 +442,26 @@ def fetch_features(
          extractor: The Revscoring extractor instance to use.
          cache: Optional revscoring cache to ease recomputation of features
                 for the same rev-id.
+         profile: Optional dict filled with the durations of every node of
+                  the dependency solve (see profiling_utils).
 
      Returns:
          The feature values computed by the Revscoring extractor.
     """
+    datasource_cache = get_datasource_cache()
     try:
-        feature_values = list(extractor.extract(rev_id, model_features, cache=cache))
+        if datasource_cache is not None:
+            feature_values = datasource_cache.extract(
+                extractor,
+                rev_id,
+                model_features,
+                {} if cache is None else cache,
+                profile,
+            )
+        else:
+            feature_values = list(
+                extractor.extract(rev_id, model_features, cache=cache, profile=profile)
+            )
     except MissingResource as e:
         raise InvalidInput(
             f"Missing resource for rev-id {rev_id}: {e}",
@@ -210,3 +476,99 @@ def fetch_features(
         )
 
     return feature_values
+
+
+@elapsed_time
+def fetch_features_with_base(
+    rev_id,
+    model_features: tuple,
+    base_features: list,
+    extractor: Extractor,
+    cache: Optional[Dict] = None,
+    profile: Optional[Dict] = None,
+) -> Tuple[List, List]:
+    """Retrieve both the model features and the base features (usually
+    the trimmed model features, returned by the extended_output) in a single
+    call to the Revscoring extractor. The two lists share the same dependency
+    solve pass, so every datasource (tokens, diffs, etc..) is computed once,
+    even when the extractor runs in a separate process and a cache can't be
+    shared between subsequent calls.
+     Parameters:
+         rev_id: The MediaWiki revision id to check.
+         model_features: The tuple representing the Revscoring model's features.
+         base_features: The list of base features to compute as well.
+         extractor: The Revscoring extractor instance to use.
+         cache: Optional revscoring cache to ease recomputation of features
+                for the same rev-id.
+         profile: Optional dict filled with the durations of every node of
+                  the dependency solve (see profiling_utils).
+
+     Returns:
+         The feature values of the model features and of the base features.
+    """
+    model_features = list(model_features)
+    feature_values = fetch_features(
+        rev_id, model_features + list(base_features), extractor, cache, profile
+    )
+    return (
+        feature_values[: len(model_features)],
+        feature_values[len(model_features) :],
+    )
+
+
+_worker_extractors = {}
+
+
+def get_worker_extractor(wiki_url: str, user_agent: str) -> Extractor:
+    """Returns the long-lived revscoring extractor of the current process
+    (usually a process pool worker) for a wiki, creating it on the first call.
+    The extractor's MWAPICache is replaced on every call (see
+    extract_features_from_docs), so its blocking MW API session is used only
+    as a fallback for documents that were not fetched in advance.
+    """
+    key = (wiki_url, user_agent)
+    if key not in _worker_extractors:
+        session = wrap_session(
+            mwapi.Session(wiki_url, user_agent=user_agent),
+            os.environ.get(WIKI_HOST_ENV_VAR) or wiki_url,
+        )
+        _worker_extractors[key] = Extractor(session)
+    return _worker_extractors[key]
+
+
+def extract_features_from_docs(
+    rev_id,
+    model_features: tuple,
+    base_features: Optional[list],
+    docs: Dict,
+    wiki_url: str,
+    user_agent: str,
+    profile: Optional[Dict] = None,
+) -> Tuple[List, Optional[List]]:
+    """Extract the features of a rev-id from the MW API documents returned
+    by get_revscoring_extractor_docs. Meant to be run in a process pool:
+    only the documents cross the IPC boundary (rather than a whole
+    Extractor, with its session and MWAPICache), and the extractor is
+    rebuilt on the worker side.
+     Parameters:
+         rev_id: The MediaWiki revision id to check.
+         model_features: The tuple representing the Revscoring model's features.
+         base_features: Optional list of base features to compute as well
+                        (see fetch_features_with_base).
+         docs: The MW API documents of the rev-id.
+         wiki_url: The URL of the MW API of the worker's extractor.
+         user_agent: HTTP User Agent of the worker's extractor.
+         profile: Optional dict filled with the durations of every node of
+                  the dependency solve (see profiling_utils).
+
+     Returns:
+         The feature values of the model features and of the base features
+         (None if base_features is None).
+    """
+    extractor = get_worker_extractor(wiki_url, user_agent)
+    extractor.http_cache = build_mwapi_cache(docs)
+    if base_features is None:
+        return fetch_features(rev_id, model_features, extractor, {}, profile), None
+    return fetch_features_with_base(
+        rev_id, model_features, base_features, extractor, {}, profile
+    )
@@ -0,0 +1,185 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# The metrics are registered in the default prometheus_client registry,
+# so that they are exported alongside the KServe ones.
+
+CACHE_REQUESTS = Counter(
+    "revscoring_cache_requests_total",
+    "Lookups made to the in-process caches, by cache and result (hit/miss).",
+    ["cache", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "revscoring_cache_evictions_total",
+    "Entries removed from the in-process caches, by cache and reason "
+    "(size/expired).",
+    ["cache", "reason"],
+)
+CACHE_BYTES = Gauge(
+    "revscoring_cache_bytes",
+    "Approximate size in bytes of the values stored in the in-process caches.",
+    ["cache"],
+)
+
+SINGLE_FLIGHT_WAITERS = Histogram(
+    "revscoring_single_flight_waiters",
+    "Number of callers that shared the same in-flight call, by registry.",
+    ["registry"],
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+SINGLE_FLIGHT_COLLAPSED = Counter(
+    "revscoring_single_flight_collapsed_total",
+    "Calls served by joining an identical in-flight call, by registry.",
+    ["registry"],
+)
+
+MICRO_BATCH_SIZE = Histogram(
+    "revscoring_micro_batch_size",
+    "Number of keys of the batches flushed by the micro-batchers, by batcher.",
+    ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+MICRO_BATCH_WAIT_SECONDS = Histogram(
+    "revscoring_micro_batch_wait_seconds",
+    "Time spent by the keys in the queue of the micro-batchers before their "
+    "batch was flushed, by batcher.",
+    ["batcher"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+MWAPI_REQUESTS = Counter(
+    "revscoring_mwapi_requests_total",
+    "HTTP requests made to the MW API, by wiki endpoint and outcome.",
+    ["endpoint", "outcome"],
+)
+MWAPI_POOL_CONNECTIONS = Gauge(
+    "revscoring_mwapi_pool_connections",
+    "Connections of the MW API client pools, by wiki endpoint and state "
+    "(in_use/idle).",
+    ["endpoint", "state"],
+)
+MWAPI_RESPONSE_BYTES = Histogram(
+    "revscoring_mwapi_response_bytes",
+    "Size of the (decompressed) MW API response bodies, by wiki endpoint.",
+    ["endpoint"],
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7),
+)
+MWAPI_LATENCY = Histogram(
+    "revscoring_mwapi_request_seconds",
+    "Latency of the successful MW API requests (single attempts), " "by wiki endpoint.",
+    ["endpoint"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+MWAPI_HEDGES = Counter(
+    "revscoring_mwapi_hedges_total",
+    "Hedged MW API requests, by wiki endpoint and event (sent/won), "
+    "where won means that the duplicate answered first.",
+    ["endpoint", "event"],
+)
+MWAPI_RETRIES = Counter(
+    "revscoring_mwapi_retries_total",
+    "MW API requests retried after a timeout, connection error or "
+    "5xx/429 status, by wiki endpoint.",
+    ["endpoint"],
+)
+
+PROCESS_POOL_PAYLOAD_BYTES = Histogram(
+    "revscoring_process_pool_payload_bytes",
+    "Size of the pickled calls (function and arguments) sent to the process "
+    "pool, by function.",
+    ["function"],
+    buckets=(1e2, 1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7),
+)
+PROCESS_POOL_SERIALIZATION_SECONDS = Histogram(
+    "revscoring_process_pool_serialization_seconds",
+    "Time spent pickling the calls sent to the process pool, by function.",
+    ["function"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+PROCESS_POOL_TIMEOUTS = Counter(
+    "revscoring_process_pool_timeouts_total",
+    "Process pool jobs cancelled since they exceeded their time budget, "
+    "by function.",
+    ["function"],
+)
+PROCESS_POOL_TIMEOUT_PAYLOAD_BYTES = Histogram(
+    "revscoring_process_pool_timeout_payload_bytes",
+    "Size of the pickled calls of the process pool jobs that exceeded their "
+    "time budget (mostly the revisions' content), by function.",
+    ["function"],
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7),
+)
+PROCESS_POOL_MEMORY_BYTES = Gauge(
+    "revscoring_process_pool_memory_bytes",
+    "Memory used by the process pool workers, summed by lane and kind "
+    "(rss/pss/uss, where pss counts the pages shared with other processes "
+    "for their share only).",
+    ["lane", "kind"],
+)
+PROCESS_POOL_WORKER_RESTARTS = Counter(
+    "revscoring_process_pool_worker_restarts_total",
+    "Process pool workers killed and replaced, by reason (timeout/died).",
+    ["reason"],
+)
+
+PREPROCESS_LANE_REQUESTS = Counter(
+    "revscoring_preprocess_lane_requests_total",
+    "Feature extractions by lane (inline/fast/large), chosen by the size of "
+    "the revision and of its parent.",
+    ["lane"],
+)
+
+EXTRACTION_NODE_SECONDS = Counter(
+    "revscoring_extraction_node_seconds_total",
+    "Time spent computing every node (feature, datasource) of the dependency "
+    "graph in the profiled feature extractions, by model and node.",
+    ["model", "node"],
+)
+EXTRACTION_NODE_CALLS = Counter(
+    "revscoring_extraction_node_calls_total",
+    "Profiled feature extractions that computed a node of the dependency "
+    "graph, by model and node.",
+    ["model", "node"],
+)
+
+MODEL_LOADS = Counter(
+    "revscoring_model_loads_total",
+    "Models loaded on demand by the model registry, by model and outcome "
+    "(ok/error).",
+    ["model", "outcome"],
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "revscoring_model_load_seconds",
+    "Time spent loading the models on demand by the model registry, by model " "type.",
+    ["model_type"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+MODEL_EVICTIONS = Counter(
+    "revscoring_model_evictions_total",
+    "Models evicted by the model registry to fit its memory budget, by model.",
+    ["model"],
+)
+LOADED_MODELS = Gauge(
+    "revscoring_loaded_models",
+    "Models currently loaded by the model registry.",
+)
+MODEL_RELOADS = Counter(
+    "revscoring_model_reloads_total",
+    "Hot reloads of a new version of a model binary, by model and outcome "
+    "(ok/error).",
+    ["model", "outcome"],
+)
+MODEL_RELOAD_SECONDS = Histogram(
+    "revscoring_model_reload_seconds",
+    "Time spent by the hot reloads of a model, from the start of the load to "
+    "the swap (including the restart of the process pool workers), by model.",
+    ["model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+EVENT_DOCS_REQUESTS = Counter(
+    "revscoring_event_docs_requests_total",
+    "Requests carrying an event, by how many of the MW API documents needed "
+    "were served from the event's content rather than from the MW API or "
+    "its cache (full/partial/none).",
+    ["coverage"],
+)
@@ -1,29 +1,75 @@
 import os
 from distutils.util import strtobool
 
-import enchant
 import kserve
-from pyenchant_utils import EnchantStr, UTF16EnchantStr
+import worker_utils
 
 from model_servers import (
     RevscoringModel,
     RevscoringModelType
 )
 from model_server_mp import RevscoringModelMP
+from model_registry import ModelRegistry, RevscoringModelRouter
+from model_reload import ModelReloadRepository
+from shared_features import share_feature_extraction
 
 
 # monkey patching enchant to support older binaries. There are some older models
 # which have been trained with older enchant binaries. By including additional classes from v2.0.0
 # of the pyenchant library (the pyenchant_utils.py file), we allow these models to be loaded and used.
-enchant.utils.UTF16EnchantStr = UTF16EnchantStr
-enchant.utils.EnchantStr = EnchantStr
+# The process pool workers (if any) apply the same patch, see worker_utils.init_worker.
+worker_utils.patch_enchant()
 
 if __name__ == "__main__":
-    inference_name = os.environ.get("INFERENCE_NAME")
-    model_type = RevscoringModelType.get_model_type(inference_name)
+    models_dir = os.environ.get("MODELS_DIR")
+    inference_names = os.environ.get("INFERENCE_NAMES")
     mp = strtobool(os.environ.get("ASYNCIO_USE_PROCESS_POOL", "False"))
-    if mp:
-        model = RevscoringModelMP(inference_name, model_type)
+    if models_dir:
+        # All the models found in MODELS_DIR (<type>/<wiki>/<version>/model.bin),
+        # loaded on their first request and evicted in LRU order to fit
+        # MODELS_MAX_RSS_BYTES. Every model type is served by its own endpoint,
+        # routed by wiki (see model_registry). MODELS_WIKI_HOSTS sets the
+        # domains of the wikis that are not a Wikipedia, like
+        # "votewiki=vote.wikimedia.org,loginwiki=login.wikimedia.org".
+        wiki_hosts = dict(
+            item.split("=", 1)
+            for item in os.environ.get("MODELS_WIKI_HOSTS", "").split(",")
+            if item
+        )
+        registry = ModelRegistry(
+            models_dir, int(os.environ.get("MODELS_MAX_RSS_BYTES", 0)), wiki_hosts
+        )
+        routers = [
+            RevscoringModelRouter(model_type, registry)
+            for model_type in registry.model_types()
+        ]
+        kserve.ModelServer(workers=1).start(routers)
+    elif inference_names:
+        # Several models of the same wiki (like enwiki-damaging,enwiki-goodfaith),
+        # sharing the feature extraction. The model paths are set via
+        # MODEL_PATH_<MODEL KIND> (see common.utils.get_model_path).
+        if mp:
+            raise ValueError(
+                "ASYNCIO_USE_PROCESS_POOL is not supported with INFERENCE_NAMES, "
+                "the shared feature extraction runs in a thread of the server."
+            )
+        models = [
+            RevscoringModel(name, RevscoringModelType.get_model_type(name))
+            for name in inference_names.split(",")
+        ]
+        share_feature_extraction(models)
+        # POST /v2/repository/models/<name>/load hot reloads the binary of
+        # a model (see model_reload).
+        kserve.ModelServer(
+            workers=1, registered_models=ModelReloadRepository()
+        ).start(models)
     else:
-        model = RevscoringModel(inference_name, model_type)
-    kserve.ModelServer(workers=1).start([model])
+        inference_name = os.environ.get("INFERENCE_NAME")
+        model_type = RevscoringModelType.get_model_type(inference_name)
+        if mp:
+            model = RevscoringModelMP(inference_name, model_type)
+        else:
+            model = RevscoringModel(inference_name, model_type)
+        kserve.ModelServer(
+            workers=1, registered_models=ModelReloadRepository()
+        ).start([model])
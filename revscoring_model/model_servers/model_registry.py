@@ -0,0 +1,250 @@
+import asyncio
+import ctypes
+import gc
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import kserve
+import psutil
+from kserve.errors import InferenceError, InvalidInput
+
+from coalescing_utils import SingleFlight
+from common.constants import EVENT_KEY, WIKI_URL_ENV_VAR
+from common.enums import RevscoringModelType
+from metrics_utils import (
+    LOADED_MODELS,
+    MODEL_EVICTIONS,
+    MODEL_LOAD_SECONDS,
+    MODEL_LOADS,
+)
+from model_servers import RevscoringModel
+from preprocess_utils import get_lang, validate_json_input
+
+# Set by RevscoringModelRouter.preprocess to the model that serves the request.
+ROUTED_MODEL_KEY = "routed_model"
+
+# The domains of the wikis whose database name ends with "wiki" but that are
+# not a Wikipedia (more can be passed to ModelRegistry).
+WIKI_HOSTS = {
+    "commonswiki": "commons.wikimedia.org",
+    "foundationwiki": "foundation.wikimedia.org",
+    "incubatorwiki": "incubator.wikimedia.org",
+    "mediawikiwiki": "www.mediawiki.org",
+    "metawiki": "meta.wikimedia.org",
+    "outreachwiki": "outreach.wikimedia.org",
+    "sourceswiki": "wikisource.org",
+    "specieswiki": "species.wikimedia.org",
+    "testwikidatawiki": "test.wikidata.org",
+    "wikidatawiki": "www.wikidata.org",
+}
+
+
+def discover_models(models_dir: str) -> Dict[Tuple[str, str], str]:
+    """Find the model binaries of a models directory laid out like
+    <model type>/<wiki>/<version>/model.bin (for example
+    goodfaith/enwiki/20220214192144/model.bin, model.bz2 for the draftquality
+    models, see common.utils.load), keeping the latest version (the greatest
+    version name) of every model type and wiki.
+
+    Returns:
+        A dict (model type, wiki) -> model path.
+    """
+    models = {}
+    for model_type in sorted(os.listdir(models_dir)):
+        type_dir = os.path.join(models_dir, model_type)
+        if not os.path.isdir(type_dir):
+            continue
+        try:
+            model_kind = RevscoringModelType(model_type)
+        except ValueError:
+            logging.warning(f"Skipping {type_dir}, not a revscoring model type.")
+            continue
+        if model_kind == RevscoringModelType.DRAFTQUALITY:
+            file_name = "model.bz2"
+        else:
+            file_name = "model.bin"
+        for wiki in sorted(os.listdir(type_dir)):
+            wiki_dir = os.path.join(type_dir, wiki)
+            if not os.path.isdir(wiki_dir):
+                continue
+            for version in sorted(os.listdir(wiki_dir), reverse=True):
+                path = os.path.join(wiki_dir, version, file_name)
+                if os.path.isfile(path):
+                    models[(model_type, wiki)] = path
+                    break
+    return models
+
+
+def get_wiki_host(wiki: str, wiki_hosts: Dict[str, str] = None) -> str:
+    """Returns the domain of a wiki from its database name (like enwiki ->
+    en.wikipedia.org, or commonswiki -> commons.wikimedia.org, see
+    WIKI_HOSTS). Only the Wikipedias are named after a language code (like
+    zh_min_nanwiki), a ValueError is raised for the other wikis, unless their
+    domain is in wiki_hosts (database name -> domain, overriding WIKI_HOSTS)."""
+    wiki_hosts = {**WIKI_HOSTS, **(wiki_hosts or {})}
+    if wiki in wiki_hosts:
+        return wiki_hosts[wiki]
+    match = re.fullmatch(r"([a-z]{2,3}(?:_[a-z0-9]+)*|simple|test2?)wiki", wiki)
+    if match is None:
+        raise ValueError(f"The domain of the wiki {wiki} cannot be determined.")
+    return f"{match.group(1).replace('_', '-')}.wikipedia.org"
+
+
+def release_memory() -> None:
+    """Collect the garbage of an evicted model and give the freed heap back
+    to the OS (with glibc), so that it's reflected in the RSS."""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class ModelRegistry:
+    """Models of several types and wikis hosted by the same process, loaded
+    on their first request (see discover_models).
+
+    The loaded models are kept in LRU order. After every load, if the RSS of
+    the process exceeds max_rss_bytes (no budget if 0), the least recently
+    used model is evicted; the model just loaded is never evicted. At most
+    one model is evicted per load, since the memory freed by an eviction is
+    rarely given back to the OS right away (so the RSS wouldn't drop, and
+    every other model would be evicted): the RSS is checked again by the
+    next load.
+    A request already served by an evicted model completes normally, since
+    it holds a reference to it. The MW API clients (and connection pools) of
+    every wiki are process-wide (see mwapi_utils.get_mwapi_client), so they
+    are kept when the models of a wiki are evicted.
+
+    The domain of every wiki found is determined at startup (see
+    get_wiki_host, with wiki_hosts for the wikis that are not a Wikipedia),
+    and a ValueError is raised if it cannot be.
+    """
+
+    def __init__(
+        self,
+        models_dir: str,
+        max_rss_bytes: int = 0,
+        wiki_hosts: Dict[str, str] = None,
+    ):
+        self.paths = discover_models(models_dir)
+        self.max_rss_bytes = max_rss_bytes
+        self.wiki_hosts = {
+            wiki: get_wiki_host(wiki, wiki_hosts) for _, wiki in self.paths
+        }
+        self._models = OrderedDict()
+        # Concurrent requests for a model that is not loaded yet wait for
+        # the same load.
+        self._single_flight = SingleFlight("models")
+        self._process = psutil.Process()
+        logging.info(
+            f"Found {len(self.paths)} models in {models_dir}: "
+            f"{sorted(f'{wiki}-{model_type}' for model_type, wiki in self.paths)}."
+        )
+
+    def model_types(self) -> List[str]:
+        return sorted({model_type for model_type, _ in self.paths})
+
+    def loaded(self) -> List[str]:
+        """Returns the names of the loaded models, least recently used first."""
+        return [model.name for model in self._models.values()]
+
+    async def get_model(self, model_type: str, wiki: str) -> RevscoringModel:
+        key = (model_type, wiki)
+        if key not in self.paths:
+            raise InvalidInput(f"No {model_type} model is available for {wiki}.")
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            return model
+        return await self._single_flight.do(key, self._load, key)
+
+    async def _load(self, key: Tuple[str, str]) -> RevscoringModel:
+        model_type, wiki = key
+        name = f"{wiki}-{model_type}"
+        start = time.perf_counter()
+        try:
+            # Loading a model takes up to seconds, so it runs in a thread
+            # rather than in the event loop.
+            model = await asyncio.get_running_loop().run_in_executor(
+                None, self._create_model, model_type, wiki
+            )
+        except Exception:
+            MODEL_LOADS.labels(name, "error").inc()
+            logging.exception(f"Error loading the model {name}.")
+            raise InferenceError(
+                f"An error happened while loading the {model_type} model of "
+                f"{wiki}, please contact the ML-Team if the issue persists."
+            )
+        MODEL_LOADS.labels(name, "ok").inc()
+        MODEL_LOAD_SECONDS.labels(model_type).observe(time.perf_counter() - start)
+        self._models[key] = model
+        self._evict(keep=key)
+        LOADED_MODELS.set(len(self._models))
+        logging.info(
+            f"Loaded the model {name} in {time.perf_counter() - start:.1f} "
+            f"seconds, loaded models: {self.loaded()}."
+        )
+        return model
+
+    def _create_model(self, model_type: str, wiki: str) -> RevscoringModel:
+        wiki_host = self.wiki_hosts[wiki]
+        if WIKI_URL_ENV_VAR in os.environ:
+            # All the wikis are reached via the same URL (like an API
+            # gateway), with their own Host header.
+            wiki_url = os.environ[WIKI_URL_ENV_VAR]
+        else:
+            wiki_url, wiki_host = f"https://{wiki_host}", None
+        return RevscoringModel(
+            f"{wiki}-{model_type}",
+            RevscoringModelType(model_type),
+            model_path=self.paths[(model_type, wiki)],
+            wiki_url=wiki_url,
+            wiki_host=wiki_host,
+        )
+
+    def _evict(self, keep: Tuple[str, str]) -> None:
+        if self.max_rss_bytes <= 0:
+            return
+        if (
+            len(self._models) > 1
+            and self._process.memory_info().rss > self.max_rss_bytes
+        ):
+            key = next(key for key in self._models if key != keep)
+            model = self._models.pop(key)
+            MODEL_EVICTIONS.labels(model.name).inc()
+            logging.info(f"Evicted the model {model.name} to fit the memory budget.")
+            # The task polling the model binary holds a reference to the model.
+            model.model_reloader.stop()
+            del model
+            release_memory()
+
+
+class RevscoringModelRouter(kserve.Model):
+    """Serves a model type for all the wikis of a ModelRegistry (for example
+    /v1/models/goodfaith:predict), routing every request to the model of its
+    wiki, given by the "lang" input or by the event (see
+    preprocess_utils.get_lang). Both single and batch requests are supported,
+    with the inputs and the output of the wiki's RevscoringModel."""
+
+    def __init__(self, model_type: str, registry: ModelRegistry):
+        super().__init__(model_type)
+        self.name = model_type
+        self.registry = registry
+        self.ready = True
+
+    async def preprocess(self, inputs: Dict, headers: Dict[str, str] = None) -> Dict:
+        inputs = validate_json_input(inputs)
+        wiki = f"{get_lang(inputs, EVENT_KEY)}wiki"
+        model = await self.registry.get_model(self.name, wiki)
+        inputs = await model.preprocess(inputs, headers)
+        inputs[ROUTED_MODEL_KEY] = model
+        return inputs
+
+    async def predict(self, request: Dict, headers: Dict[str, str] = None) -> Dict:
+        model = request.pop(ROUTED_MODEL_KEY)
+        return await model.predict(request, headers)
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Optional, Tuple
+
+from kserve.model_repository import ModelRepository
+
+from common.enums import RevscoringModelType
+from common.model_cache import verify_checksum
+from common.utils import load
+from metrics_utils import MODEL_RELOAD_SECONDS, MODEL_RELOADS
+
+
+def get_model_signature(model_path: str) -> Tuple[Optional[Tuple[int, int]], ...]:
+    """Returns the size and modification time of a model binary and of its
+    .sha512 file (None for a missing file), that change when a new version
+    of the model is rolled out."""
+    signature = []
+    for path in (model_path, f"{model_path}.sha512"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+        else:
+            signature.append((stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def load_verified(model_kind: RevscoringModelType, model_path: str) -> Tuple[Any, str]:
+    """Load a model binary after verifying it against its .sha512 file (see
+    common.model_cache.verify_checksum), and return it with its sha512 digest.
+    The binary is verified even with MODEL_CACHE_DIR, since a cache hit only
+    depends on the .sha512 file, that can be stale."""
+    checksum = verify_checksum(model_path)
+    return load(model_kind, model_path), checksum
+
+
+class ModelReloader:
+    """Hot reload of a new version of the model binary of a RevscoringModel,
+    without restarting the server (and losing its warm connections and
+    caches).
+
+    The new binary is loaded and verified in a thread, while the old model
+    keeps serving the requests, and it is swapped with the old model only if
+    it is valid (see RevscoringModel.swap_model). The swap happens between
+    two steps of the event loop, so every request is preprocessed and scored
+    by the same model, and the requests in flight complete with the old one.
+
+    If interval is positive, the model binary is polled every interval
+    seconds, and a new binary is reloaded once it has been left unchanged
+    for a whole interval (so that a binary being copied isn't loaded).
+    A binary that fails to load is not retried until it changes again.
+    """
+
+    def __init__(self, model, interval: float = 0):
+        self.model = model
+        self.interval = interval
+        self.signature = get_model_signature(model.model_path)
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self) -> None:
+        """Start polling the model binary, if an interval is set. Called by
+        every request, since the event loop is started by KServe."""
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+            logging.info(
+                f"Watching {self.model.model_path} for new versions of "
+                f"{self.model.name} every {self.interval}s."
+            )
+
+    def stop(self) -> None:
+        """Stop polling the model binary (like for a model that is not served
+        anymore, so that the polling task doesn't keep it alive)."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self) -> None:
+        pending = None
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = get_model_signature(self.model.model_path)
+            if signature == self.signature:
+                pending = None
+            elif signature != pending:
+                pending = signature
+            else:
+                pending = None
+                try:
+                    await self.reload()
+                except Exception:
+                    # Logged by reload(), the old model is still in use.
+                    pass
+
+    async def reload(self) -> None:
+        """Load and verify the model binary, and swap it with the model in
+        use. If it fails, the error is raised and the old model is kept."""
+        async with self._lock:
+            name = self.model.name
+            signature = get_model_signature(self.model.model_path)
+            old_version = self.model.model.version
+            start = time.perf_counter()
+            try:
+                model, checksum = await asyncio.get_running_loop().run_in_executor(
+                    None, load_verified, self.model.model_kind, self.model.model_path
+                )
+                await self.model.swap_model(model, checksum)
+            except Exception:
+                MODEL_RELOADS.labels(name, "error").inc()
+                logging.exception(
+                    f"Error reloading the model {name} from {self.model.model_path}, "
+                    f"the version {old_version} is still in use."
+                )
+                raise
+            finally:
+                self.signature = signature
+            MODEL_RELOADS.labels(name, "ok").inc()
+            MODEL_RELOAD_SECONDS.labels(name).observe(time.perf_counter() - start)
+            logging.info(
+                f"Reloaded the model {name} from {self.model.model_path} in "
+                f"{time.perf_counter() - start:.1f} seconds, version "
+                f"{old_version} -> {model.version}."
+            )
+
+
+class ModelReloadRepository(ModelRepository):
+    """KServe model repository whose load endpoint (POST
+    /v2/repository/models/<name>/load) hot reloads the model binary of
+    a registered RevscoringModel (see ModelReloader)."""
+
+    async def load(self, name: str) -> bool:
+        model = self.get_model(name)
+        reloader = getattr(model, "model_reloader", None)
+        if reloader is None:
+            raise ValueError(f"The model {name} can't be reloaded.")
+        await reloader.reload()
+        return True
@@ -1,16 +1,24 @@
+import asyncio
 import logging
 import os
 from concurrent.futures.process import BrokenProcessPool
 from distutils.util import strtobool
-from typing import Dict
+from typing import Dict, Optional
 
 from kserve.errors import InferenceError
 from model_servers import RevscoringModel
-from revscoring.features import trim
 from common.enums import RevscoringModelType
+from common.utils import score, score_many
+import extractor_utils
 import process_utils
+import worker_utils
+import profiling_utils
+from metrics_utils import PREPROCESS_LANE_REQUESTS, PROCESS_POOL_MEMORY_BYTES
 from preprocess_utils import validate_json_input
-# from revscoring_model.model_servers import extractor_utils
+
+INLINE_LANE = "inline"
+FAST_LANE = "fast"
+LARGE_LANE = "large"
 
 
 class RevscoringModelMP(RevscoringModel):
@@ -19,73 +27,355 @@ class RevscoringModelMP(RevscoringModel):
         self.asyncio_aux_workers = int(os.environ.get("ASYNCIO_AUX_WORKERS"))
         self.preprocess_mp = strtobool(os.environ.get("PREPROCESS_MP", "True"))
         self.inference_mp = strtobool(os.environ.get("INFERENCE_MP", "True"))
-        self.process_pool = process_utils.create_process_pool(self.asyncio_aux_workers)
+        # With both preprocess and inference in the process pool, extract and
+        # score in the same worker call (one pool round trip per request).
+        self.fused_mp = (
+            self.preprocess_mp
+            and self.inference_mp
+            and strtobool(os.environ.get("FUSED_MP", "False"))
+        )
+        # Every worker loads the model once when it starts, so that the calls
+        # sent to the pool don't need to carry the model (or its features).
+        self.process_pool_initializer = (
+            worker_utils.init_worker,
+            (self.model_kind, self.model_path),
+        )
+        # How the workers are started (see process_utils.START_METHODS). With
+        # preload_fork they are forked from this process, sharing (copy on
+        # write) the model it already loaded instead of loading their own.
+        self.process_pool_start_method = os.environ.get("PROCESS_POOL_START_METHOD")
+        if self.process_pool_start_method not in (None, *process_utils.START_METHODS):
+            raise ValueError(
+                f"Unsupported PROCESS_POOL_START_METHOD "
+                f"{self.process_pool_start_method}, expected one of "
+                f"{process_utils.START_METHODS}."
+            )
+        if self.process_pool_start_method == process_utils.PRELOAD_FORK:
+            worker_utils.set_worker_model(self.model_path, self.model)
+        # Optional time budget (in seconds) of every process pool job: the
+        # worker running a job that exceeds it (like the extraction of a huge
+        # revision) is killed and replaced, without affecting the other ones.
+        self.process_pool_timeout = float(os.environ.get("PROCESS_POOL_JOB_TIMEOUT", 0))
+        # Size-aware lanes, chosen per request by the size of the rev-id and
+        # of its parent: the extraction of small revisions runs inline, since
+        # the process pool round trip would cost more than the extraction
+        # itself, and the one of large revisions runs in a separate pool, so
+        # that they don't queue in front of the others. The large lane's
+        # workers are taken from ASYNCIO_AUX_WORKERS.
+        self.inline_max_bytes = int(os.environ.get("PREPROCESS_INLINE_MAX_BYTES", 0))
+        self.large_min_bytes = int(os.environ.get("PREPROCESS_LARGE_MIN_BYTES", 0))
+        self.large_workers = 0
+        if self.large_min_bytes > 0:
+            self.large_workers = int(os.environ.get("PROCESS_POOL_LARGE_WORKERS", 1))
+            self.asyncio_aux_workers = max(
+                1, self.asyncio_aux_workers - self.large_workers
+            )
+        self.process_pool = self.create_process_pool(self.asyncio_aux_workers)
+        self.large_process_pool = None
+        if self.large_workers > 0:
+            self.large_process_pool = self.create_process_pool(self.large_workers)
+        # The memory of the workers (summed by pool) is computed when the
+        # metrics are scraped, and logged per worker once they are started.
+        for lane in (FAST_LANE, LARGE_LANE):
+            for kind in ("rss", "pss", "uss"):
+                PROCESS_POOL_MEMORY_BYTES.labels(lane, kind).set_function(
+                    lambda lane=lane, kind=kind: self.get_workers_memory(lane, kind)
+                )
+        process_utils.log_workers_memory(self.process_pool, FAST_LANE)
+        if self.large_process_pool is not None:
+            process_utils.log_workers_memory(self.large_process_pool, LARGE_LANE)
 
-    async def _run_in_process_pool(self, *args):
+    def get_workers_memory(self, lane: str, kind: str) -> int:
+        """Returns the memory (rss, pss or uss) in bytes used by the workers
+        of the process pool of a lane."""
+        if lane == LARGE_LANE:
+            process_pool = self.large_process_pool
+        else:
+            process_pool = self.process_pool
+        if process_pool is None:
+            return 0
+        return sum(
+            worker[kind] for worker in process_utils.workers_memory(process_pool)
+        )
+
+    def get_lane(self, size: int) -> str:
+        """Choose the lane of a feature extraction (inline, fast or large)
+        by the size of the revisions in its MW API documents (see
+        extractor_utils.get_revisions_size)."""
+        if self.inline_max_bytes > 0 and size <= self.inline_max_bytes:
+            return INLINE_LANE
+        if self.large_process_pool is not None and size >= self.large_min_bytes:
+            return LARGE_LANE
+        return FAST_LANE
+
+    async def _run_in_process_pool(
+        self,
+        *args,
+        rev_id: int = None,
+        revisions_size: int = None,
+        lane: str = FAST_LANE,
+    ):
+        if lane == LARGE_LANE:
+            process_pool = self.large_process_pool
+        else:
+            process_pool = self.process_pool
         try:
-            return await process_utils.run_in_process_pool(self.process_pool, *args)
+            return await process_utils.run_in_process_pool(process_pool, *args)
+        except process_utils.JobTimeoutError as e:
+            logging.warning(
+                f"Cancelled the processing of rev-id {rev_id} (revisions size "
+                f"of {revisions_size} bytes, {lane} lane): {e}"
+            )
+            raise InferenceError(
+                f"The processing of the revision-id {rev_id} (revisions size of "
+                f"{revisions_size} bytes) took longer than {e.budget} seconds "
+                "and was cancelled."
+            )
+        except process_utils.WorkerDiedError:
+            logging.exception(f"Error while processing rev-id {rev_id}.")
+            raise InferenceError(
+                "An error happened while scoring the revision-id, please "
+                "contact the ML-Team if the issue persists."
+            )
         except BrokenProcessPool:
             logging.exception("Re-creation of a newer process pool before proceeding.")
-            self.process_pool = process_utils.refresh_process_pool(
-                self.process_pool, self.asyncio_aux_workers
-            )
+            if lane == LARGE_LANE:
+                self.large_process_pool = process_utils.refresh_process_pool(
+                    self.large_process_pool,
+                    self.large_workers,
+                    *self.process_pool_initializer,
+                    timeout=self.process_pool_timeout,
+                    start_method=self.process_pool_start_method,
+                )
+            else:
+                self.process_pool = process_utils.refresh_process_pool(
+                    self.process_pool,
+                    self.asyncio_aux_workers,
+                    *self.process_pool_initializer,
+                    timeout=self.process_pool_timeout,
+                    start_method=self.process_pool_start_method,
+                )
             raise InferenceError(
                 "An error happened while scoring the revision-id, please "
                 "contact the ML-Team if the issue persists."
             )
 
-    async def score(self, feature_values):
-        if self.inference_mp:
-            return await self._run_in_process_pool(self.model.score, feature_values)
-        else:
-            return super().score(feature_values)
+    async def swap_model(self, model, checksum: Optional[str] = None) -> None:
+        """Replace the model in use with a new version of it, together with
+        the process pools: new pools are started with the new model, and the
+        old ones are retired once the jobs already sent to them are completed
+        (see process_utils.retire_process_pool).
 
-    async def fetch_features(self, rev_id, features, extractor, cache):
-        if self.preprocess_mp:
+        The workers are started (forked) by the event loop's thread, since
+        forking while another thread of this process runs could copy its
+        locks in a locked state. Only the wait for their initializer (like
+        loading the model, with the spawn start method) runs in a thread.
+
+        The workers that load the model binary themselves check that it is
+        still the one verified by the reload (see worker_utils.init_worker),
+        and the swap is aborted if any of them fails to start."""
+        old_model = self.model
+        old_initializer = self.process_pool_initializer
+        self.process_pool_initializer = (
+            worker_utils.init_worker,
+            (self.model_kind, self.model_path, checksum),
+        )
+        if self.process_pool_start_method == process_utils.PRELOAD_FORK:
+            # The objects frozen before forking the old workers (like the old
+            # model) can be collected once released, see process_utils.get_context.
+            process_utils.unfreeze()
+            worker_utils.set_worker_model(self.model_path, model)
+        loop = asyncio.get_running_loop()
+        new_pools = []
+        try:
+            new_pools.append(self.create_process_pool(self.asyncio_aux_workers, False))
+            if self.large_workers > 0:
+                new_pools.append(self.create_process_pool(self.large_workers, False))
+            for new_pool in new_pools:
+                await loop.run_in_executor(
+                    None, process_utils.wait_process_pool, new_pool
+                )
+        except Exception:
+            for new_pool in new_pools:
+                new_pool.shutdown()
+            self.process_pool_initializer = old_initializer
+            if self.process_pool_start_method == process_utils.PRELOAD_FORK:
+                worker_utils.set_worker_model(self.model_path, old_model)
+            raise
+        process_pool = new_pools[0]
+        large_process_pool = new_pools[1] if len(new_pools) > 1 else None
+        old_pools = (self.process_pool, self.large_process_pool)
+        # No await from here, so that no request sees the new model with the
+        # old pools (or vice versa).
+        self.process_pool, self.large_process_pool = process_pool, large_process_pool
+        await super().swap_model(model, checksum)
+        for old_pool in old_pools:
+            if old_pool is not None:
+                process_utils.retire_process_pool(old_pool)
+        process_utils.log_workers_memory(self.process_pool, FAST_LANE)
+        if self.large_process_pool is not None:
+            process_utils.log_workers_memory(self.large_process_pool, LARGE_LANE)
+
+    def create_process_pool(self, workers: int, wait: bool = True):
+        return process_utils.create_process_pool(
+            workers,
+            *self.process_pool_initializer,
+            timeout=self.process_pool_timeout,
+            start_method=self.process_pool_start_method,
+            wait=wait,
+        )
+
+    async def score_batch(self, feature_values_list, model=None):
+        # The requests preprocessed by a replaced model are scored by it in
+        # this process, since the workers have the new one (see swap_model).
+        if self.inference_mp and (model is None or model is self.model):
             return await self._run_in_process_pool(
-                extractor_utils.fetch_features,
-                rev_id,
-                features,
-                extractor,
-                cache,
+                worker_utils.score_many_features, feature_values_list
             )
-        else:
-            return super().fetch_features(rev_id, features, extractor, cache)
+        return await super().score_batch(feature_values_list, model)
+
+    async def score(self, feature_values, model=None):
+        if (
+            self.inference_mp
+            and self.score_batcher is None
+            and (model is None or model is self.model)
+        ):
+            return await self._run_in_process_pool(
+                worker_utils.score_features, feature_values
+            )
+        # With PREDICT_BATCHING, a batch of concurrent requests is scored by
+        # a single score_batch() call (a single process pool job).
+        return await super().score(feature_values, model)
 
     async def preprocess(self, inputs: Dict, headers: Dict[str, str] = None) -> Dict:
         """Use MW API session and Revscoring API to extract feature values
         of edit text based on its revision id"""
+        if not self.preprocess_mp:
+            return await super().preprocess(inputs, headers)
+        self.model_reloader.start()
         inputs = validate_json_input(inputs)
+        if self.REV_IDS_KEY in inputs:
+            # Every rev-id is preprocessed by this method (see
+            # RevscoringModel.preprocess_batch).
+            return await self.preprocess_batch(inputs)
         rev_id = self.get_rev_id(inputs, self.EVENT_KEY)
         extended_output = inputs.get("extended_output", False)
-        extractor = await self.get_extractor(inputs, rev_id)
+        # See RevscoringModel.preprocess.
+        profile_requested = inputs.get(self.PROFILE_KEY, False) is True
+        profile = profiling_utils.should_profile(
+            profile_requested, self.EXTRACTION_PROFILE_SAMPLE_RATE
+        )
+        stored_features = None
+        if not profile_requested:
+            stored_features = self.get_stored_features(rev_id, extended_output)
+        # See RevscoringModel.preprocess, the model is set again right before
+        # the extraction.
+        inputs[self.SERVING_MODEL_KEY] = self.model
+        if stored_features is not None:
+            self.set_revision_event(inputs, rev_id)
+            inputs[self.FEATURE_VAL_KEY], base_feature_values = stored_features
+            if self.fused_mp:
+                # predict() expects the score to be computed by preprocess().
+                inputs[self.PREDICTION_RESULTS_KEY] = await self.score(
+                    inputs[self.FEATURE_VAL_KEY], inputs[self.SERVING_MODEL_KEY]
+                )
+            self.set_extended_output(inputs, base_feature_values)
+            self.set_profile(inputs, None, profile_requested)
+            return inputs
 
-        cache = {}
+        docs = await self.get_extractor_docs(inputs, rev_id)
 
-        # The fetch_features function can be heavily cpu-bound, it depends
+        # The feature extraction can be heavily cpu-bound, it depends
         # on the complexity of the rev-id to process. Running cpu-bound
         # code inside the asyncio eventloop will block the thread
         # and cause processing delays, so we use a process pool instead
         # (still enabled/disabled as opt-in).
         # See: https://docs.python.org/3/library/asyncio-eventloop.html#executing-code-in-thread-or-process-pools
-        inputs[self.FEATURE_VAL_KEY] = await self.fetch_features(
-            rev_id, self.model.features, extractor, cache
-        )
-
-        if extended_output:
-            bare_model_features = list(trim(self.model.features))
-            base_feature_values = await self.fetch_features(
-                rev_id, bare_model_features, extractor, cache
+        # Only the MW API documents are sent to the worker, that keeps its own
+        # long-lived extractor and model. With extended_output, the model
+        # features and the base features are computed by the same call (see
+        # RevscoringModel.preprocess).
+        revisions_size = extractor_utils.get_revisions_size(docs)
+        lane = self.get_lane(revisions_size)
+        PREPROCESS_LANE_REQUESTS.labels(lane).inc()
+        # The process pools are swapped together with the model, and a pool
+        # is chosen (with no await in between), so the extraction is made by
+        # this model even if it's replaced while it runs.
+        inputs[self.SERVING_MODEL_KEY] = self.model
+        if lane == INLINE_LANE:
+            solve_profile = {} if profile else None
+            (
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+            ) = self.fetch_model_features(
+                rev_id, self.build_extractor(docs), extended_output, solve_profile
+            )
+            breakdown = profiling_utils.summarize_profile(solve_profile)
+            if self.fused_mp:
+                inputs[self.PREDICTION_RESULTS_KEY] = score(
+                    self.model, inputs[self.FEATURE_VAL_KEY]
+                )
+        elif self.fused_mp:
+            # The score is kept aside for predict(), that won't call the pool.
+            (
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+                breakdown,
+                inputs[self.PREDICTION_RESULTS_KEY],
+            ) = await self._run_in_process_pool(
+                worker_utils.extract_and_score,
+                rev_id,
+                extended_output,
+                docs,
+                self.wiki_url,
+                self.CUSTOM_UA,
+                profile,
+                rev_id=rev_id,
+                revisions_size=revisions_size,
+                lane=lane,
+            )
+        else:
+            (
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+                breakdown,
+            ) = await self._run_in_process_pool(
+                worker_utils.extract_features,
+                rev_id,
+                extended_output,
+                docs,
+                self.wiki_url,
+                self.CUSTOM_UA,
+                profile,
+                rev_id=rev_id,
+                revisions_size=revisions_size,
+                lane=lane,
             )
-            inputs[self.EXTENDED_OUTPUT_KEY] = {
-                str(f): v for f, v in zip(bare_model_features, base_feature_values)
-            }
+        self.store_features(
+            rev_id,
+            inputs[self.FEATURE_VAL_KEY],
+            base_feature_values,
+            inputs[self.SERVING_MODEL_KEY],
+        )
+        self.set_extended_output(inputs, base_feature_values)
+        self.set_profile(inputs, breakdown, profile_requested)
         return inputs
 
     async def predict(self, request: Dict, headers: Dict[str, str] = None) -> Dict:
+        if self.REV_IDS_KEY in request:
+            # In fused mode the rev-ids are already scored by preprocess().
+            return await self.predict_batch(request)
         feature_values = request.get(self.FEATURE_VAL_KEY)
         extended_output = request.get(self.EXTENDED_OUTPUT_KEY)
-        self.prediction_results = await self.score(feature_values)
-        output = self.get_output(request, extended_output)
-        await self.send_event()
+        model = self.get_request_model(request)
+        if self.fused_mp:
+            # Always set by preprocess() in fused mode, overriding any value
+            # passed by the client.
+            prediction_results = request.pop(self.PREDICTION_RESULTS_KEY)
+        else:
+            prediction_results = await self.score(feature_values, model)
+        output = self.get_output(request, extended_output, prediction_results)
+        await self.send_event(
+            self.get_revision_event(request, self.EVENT_KEY), prediction_results, model
+        )
         return output
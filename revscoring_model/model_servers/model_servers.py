@@ -1,6 +1,10 @@
+import asyncio
+import functools
 import logging
 import os
-from typing import Any, Dict, Optional
+import sqlite3
+from distutils.util import strtobool
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 import kserve
@@ -10,25 +14,59 @@ from revscoring.extractors import api
 from revscoring.features import trim
 
 import events, logging_utils
-from common.constants import FEATURE_VAL_KEY, EXTENDED_OUTPUT_KEY, EVENT_KEY, EVENTGATE_URL, EVENTGATE_STREAM, \
-    AIOHTTP_CLIENT_TIMEOUT, TLS_CERT_BUNDLE_PATH, WIKI_HOST_ENV_VAR, MISSING_REV_ID_ERR, INVALID_REV_ID_ERR
-from common.utils import _get_wiki_url, get_model_path, score, load
+from common.constants import FEATURE_VAL_KEY, EXTENDED_OUTPUT_KEY, EVENT_KEY, PREDICTION_RESULTS_KEY, PROFILE_KEY, EVENTGATE_URL, EVENTGATE_STREAM, \
+    AIOHTTP_CLIENT_TIMEOUT, TLS_CERT_BUNDLE_PATH, WIKI_HOST_ENV_VAR, MISSING_REV_ID_ERR, INVALID_REV_ID_ERR, \
+    REV_IDS_KEY, BATCH_RESULTS_KEY, SERVING_MODEL_KEY, MODEL_RELOAD_INTERVAL, INVALID_REV_IDS_ERR, BATCH_MAX_SIZE, BATCH_CONCURRENCY, \
+    PREDICT_BATCHING, PREDICT_BATCH_WINDOW_MS, PREDICT_BATCH_MAX_SIZE, EXTRACTION_PROFILE_SAMPLE_RATE, \
+    MWAPI_BATCHING, MWAPI_BATCH_WINDOW_MS, MWAPI_BATCH_MAX_SIZE, MWAPI_POOL_LIMIT, MWAPI_POOL_LIMIT_PER_HOST, \
+    MWAPI_KEEPALIVE_TIMEOUT, MWAPI_DNS_CACHE_TTL, USE_EVENT_CONTENT, MWAPI_COMPRESSION, MWAPI_FAST_JSON, \
+    MWAPI_HEDGING, MWAPI_HEDGE_PERCENTILE, MWAPI_HEDGE_MIN_DELAY_MS, MWAPI_MAX_RETRIES, MWAPI_RETRY_BACKOFF_MS
+from common.utils import _get_wiki_url, get_model_path, score, score_many, load
+from common.response_store import get_response_store, wrap_session
+from common.feature_store import feature_fingerprint, get_feature_store
 from preprocess_utils import validate_json_input
 import extractor_utils
+import profiling_utils
+from cache_utils import get_mwapi_doc_cache
+from metrics_utils import CACHE_REQUESTS
+from coalescing_utils import ScoreBatcher, SingleFlight
+from model_reload import ModelReloader
+from mwapi_utils import MWAPI_MAX_BATCH_SIZE, MWAPIBatcher, get_mwapi_client
 from common.enums import RevscoringModelType
 logging.basicConfig(level=kserve.constants.KSERVE_LOGLEVEL)
 
 
 class RevscoringModel(kserve.Model):
-    def __init__(self, name: str, model_kind: RevscoringModelType):
+    def __init__(
+        self,
+        name: str,
+        model_kind: RevscoringModelType,
+        model_path: str = None,
+        wiki_url: str = None,
+        wiki_host: str = None,
+    ):
+        """The model path, the wiki URL and the wiki Host header are read from
+        the environment (see common.utils.get_model_path, WIKI_URL and
+        WIKI_HOST) unless they are passed, like when a process hosts the models
+        of several wikis (see model_registry)."""
         super().__init__(name)
         self.name = name
         self.model_kind = model_kind
         self.ready = False
-        self.wiki_url = _get_wiki_url()
+        self.wiki_url = wiki_url or _get_wiki_url()
+        self.wiki_host = wiki_host or os.environ.get(WIKI_HOST_ENV_VAR)
         self.FEATURE_VAL_KEY = FEATURE_VAL_KEY
         self.EXTENDED_OUTPUT_KEY = EXTENDED_OUTPUT_KEY
         self.EVENT_KEY = EVENT_KEY
+        self.PREDICTION_RESULTS_KEY = PREDICTION_RESULTS_KEY
+        self.PROFILE_KEY = PROFILE_KEY
+        self.REV_IDS_KEY = REV_IDS_KEY
+        self.BATCH_RESULTS_KEY = BATCH_RESULTS_KEY
+        self.SERVING_MODEL_KEY = SERVING_MODEL_KEY
+        # Batch requests ({"rev_ids": [...]}) are limited in size, and the
+        # preprocessing of their rev-ids runs with a bounded concurrency.
+        self.BATCH_MAX_SIZE = int(os.environ.get(BATCH_MAX_SIZE, 100))
+        self.BATCH_CONCURRENCY = int(os.environ.get(BATCH_CONCURRENCY, 16))
         self.EVENTGATE_URL = os.environ.get(EVENTGATE_URL)
         self.EVENTGATE_STREAM = os.environ.get(EVENTGATE_STREAM)
         self.AIOHTTP_CLIENT_TIMEOUT = os.environ.get(AIOHTTP_CLIENT_TIMEOUT, 5)
@@ -36,6 +74,62 @@ class RevscoringModel(kserve.Model):
         # Deployed via the wmf-certificates package
         self.TLS_CERT_BUNDLE_PATH = TLS_CERT_BUNDLE_PATH
         self._http_client_session = {}
+        # A single MW API client (and connection pool) is used for all
+        # the requests, the Host header (if any) is set per request.
+        self.mwapi_client = get_mwapi_client(
+            self.wiki_url,
+            self.CUSTOM_UA,
+            wiki_host=self.wiki_host,
+            timeout=self.AIOHTTP_CLIENT_TIMEOUT,
+            pool_limit=int(os.environ.get(MWAPI_POOL_LIMIT, 100)),
+            pool_limit_per_host=int(os.environ.get(MWAPI_POOL_LIMIT_PER_HOST, 0)),
+            keepalive_timeout=float(os.environ.get(MWAPI_KEEPALIVE_TIMEOUT, 30)),
+            dns_cache_ttl=int(os.environ.get(MWAPI_DNS_CACHE_TTL, 300)),
+            compression=strtobool(os.environ.get(MWAPI_COMPRESSION, "True")),
+            fast_json=strtobool(os.environ.get(MWAPI_FAST_JSON, "True")),
+            # Opt-in hedging and retries of the MW API requests, to cut the tail latency.
+            hedging=strtobool(os.environ.get(MWAPI_HEDGING, "False")),
+            hedge_percentile=float(os.environ.get(MWAPI_HEDGE_PERCENTILE, 95)),
+            hedge_min_delay=float(os.environ.get(MWAPI_HEDGE_MIN_DELAY_MS, 50)) / 1000,
+            max_retries=int(os.environ.get(MWAPI_MAX_RETRIES, 0)),
+            retry_backoff=float(os.environ.get(MWAPI_RETRY_BACKOFF_MS, 100)) / 1000,
+        )
+        # In record/replay mode (see common.response_store) the MW API responses
+        # are written to/served from a local store.
+        store_endpoint = self.wiki_host or self.wiki_url
+        self.mwapi_client = wrap_session(self.mwapi_client, store_endpoint)
+        # The blocking session is needed only to create revscoring's extractor,
+        # since all the MW API data is fetched beforehand via mwapi_client.
+        self.mwapi_session = wrap_session(
+            mwapi.Session(self.wiki_url, user_agent=self.CUSTOM_UA), store_endpoint
+        )
+        # Opt-in micro-batching of the MW API lookups made by concurrent requests.
+        self.MWAPI_BATCHING = strtobool(os.environ.get(MWAPI_BATCHING, "False"))
+        self.MWAPI_BATCH_WINDOW_MS = float(os.environ.get(MWAPI_BATCH_WINDOW_MS, 5))
+        self.MWAPI_BATCH_MAX_SIZE = int(
+            os.environ.get(MWAPI_BATCH_MAX_SIZE, MWAPI_MAX_BATCH_SIZE)
+        )
+        if self.MWAPI_BATCHING and get_response_store() is not None:
+            # The composition of a batch depends on the traffic, so batched
+            # responses couldn't be replayed.
+            logging.warning("MW API batching is disabled in record/replay mode.")
+            self.MWAPI_BATCHING = False
+        if self.MWAPI_BATCHING:
+            self.mwapi_batcher = MWAPIBatcher(
+                self.mwapi_client,
+                max_wait=self.MWAPI_BATCH_WINDOW_MS / 1000,
+                max_size=self.MWAPI_BATCH_MAX_SIZE,
+            )
+        else:
+            self.mwapi_batcher = None
+        # Process-wide cache of MW API documents (disabled by default),
+        # with the keys of every wiki kept apart.
+        self.mwapi_doc_cache = get_mwapi_doc_cache(store_endpoint)
+        # Concurrent requests for the same rev-id/user share the same MW API call.
+        self.mwapi_single_flight = SingleFlight("mwapi")
+        # Use the revision content carried by page_change events (if any)
+        # instead of fetching it from the MW API.
+        self.USE_EVENT_CONTENT = strtobool(os.environ.get(USE_EVENT_CONTENT, "True"))
         if model_kind in [
             RevscoringModelType.EDITQUALITY_DAMAGING,
             RevscoringModelType.EDITQUALITY_GOODFAITH,
@@ -45,18 +139,132 @@ class RevscoringModel(kserve.Model):
             self.extra_mw_api_calls = True
         else:
             self.extra_mw_api_calls = False
-        self.model_path = get_model_path(model_kind=self.model_kind)
+        # Set by shared_features.share_feature_extraction when the process
+        # hosts several models of the same wiki.
+        self.shared_extractor = None
+        self.model_path = model_path or get_model_path(model_kind=self.model_kind)
         self.model = load(self.model_kind, self.model_path)
+        # Feature values already extracted for a rev-id (by this server or
+        # by src/revscore.py) are read from an on-disk store, if
+        # FEATURE_STORE_PATH is set. Entries are keyed by the fingerprint
+        # of the feature list, so a new model version with the same
+        # features reuses them.
+        self.feature_store = get_feature_store()
+        self.features_fingerprint = feature_fingerprint(self.model.features)
+        self.base_features_fingerprint = feature_fingerprint(trim(self.model.features))
+        if self.feature_store is not None:
+            logging.info(
+                f"Feature store fingerprints of {name}: {self.features_fingerprint} "
+                f"(base features {self.base_features_fingerprint})."
+            )
+        # Opt-in micro-batching of the scoring of concurrent requests: their
+        # feature values are queued for a few milliseconds (or until the batch
+        # is full) and scored with a single call to the model (see score_batch).
+        self.PREDICT_BATCHING = strtobool(os.environ.get(PREDICT_BATCHING, "False"))
+        self.PREDICT_BATCH_WINDOW_MS = float(os.environ.get(PREDICT_BATCH_WINDOW_MS, 5))
+        self.PREDICT_BATCH_MAX_SIZE = int(os.environ.get(PREDICT_BATCH_MAX_SIZE, 32))
+        if self.PREDICT_BATCHING:
+            self.score_batcher = self.create_score_batcher()
+        else:
+            self.score_batcher = None
+        # Fraction of the requests whose feature extraction is profiled in the
+        # background (see profiling_utils.should_profile).
+        self.EXTRACTION_PROFILE_SAMPLE_RATE = float(
+            os.environ.get(EXTRACTION_PROFILE_SAMPLE_RATE, 0)
+        )
+        # A new version of the model binary is loaded in the background and
+        # swapped with the model in use (see model_reload), when the binary
+        # changes (polled every MODEL_RELOAD_INTERVAL seconds, if set) or
+        # when the KServe load endpoint of the model is called.
+        self.model_reloader = ModelReloader(
+            self, float(os.environ.get(MODEL_RELOAD_INTERVAL, 0))
+        )
         self.ready = True
-        self.prediction_results = None
         # FIXME: this may not be needed, in theory we could simply rely on
         # kserve.constants.KSERVE_LOGLEVEL (passing KSERVE_LOGLEVEL as env var)
         # but it doesn't seem to work.
         logging_utils.set_log_level()
 
     @staticmethod
-    def fetch_features(rev_id, features, extractor, cache):
-        return extractor_utils.fetch_features(rev_id, features, extractor, cache)
+    def fetch_features(rev_id, features, extractor, cache, profile=None):
+        return extractor_utils.fetch_features(
+            rev_id, features, extractor, cache, profile
+        )
+
+    @staticmethod
+    def fetch_features_with_base(
+        rev_id, features, base_features, extractor, cache, profile=None
+    ):
+        return extractor_utils.fetch_features_with_base(
+            rev_id, features, base_features, extractor, cache, profile
+        )
+
+    def get_stored_features(
+        self, rev_id: int, extended_output: bool
+    ) -> Optional[Tuple[List, Optional[List]]]:
+        """Returns the feature values (and the base feature values, if
+        extended_output is True) of a rev-id from the feature store, or None
+        if the store is disabled or doesn't have all of them."""
+        if self.feature_store is None:
+            return None
+        try:
+            feature_values = self.feature_store.get(rev_id, self.features_fingerprint)
+            base_feature_values = None
+            if feature_values is not None and extended_output:
+                base_feature_values = self.feature_store.get(
+                    rev_id, self.base_features_fingerprint
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"Error reading rev-id {rev_id} from the feature store: {e}")
+            return None
+        if feature_values is None or (extended_output and base_feature_values is None):
+            CACHE_REQUESTS.labels("feature_store", "miss").inc()
+            return None
+        CACHE_REQUESTS.labels("feature_store", "hit").inc()
+        return feature_values, base_feature_values
+
+    def store_features(
+        self,
+        rev_id: int,
+        feature_values: List,
+        base_feature_values: Optional[List],
+        model=None,
+    ) -> None:
+        """Save the feature values of a rev-id (and the base feature values,
+        if any) to the feature store, if enabled. Errors are logged, since the
+        store is only an optimization. The values extracted for a model that
+        was replaced meanwhile (see swap_model) are not saved, since they are
+        keyed by the fingerprint of the model in use."""
+        if self.feature_store is None or (model is not None and model is not self.model):
+            return
+        try:
+            self.feature_store.put(rev_id, self.features_fingerprint, feature_values)
+            if base_feature_values is not None:
+                self.feature_store.put(
+                    rev_id, self.base_features_fingerprint, base_feature_values
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"Error saving rev-id {rev_id} to the feature store: {e}")
+
+    def set_extended_output(self, inputs: Dict, base_feature_values: Optional[List]):
+        if base_feature_values is not None:
+            bare_model_features = list(trim(self.get_request_model(inputs).features))
+            inputs[self.EXTENDED_OUTPUT_KEY] = {
+                str(f): v for f, v in zip(bare_model_features, base_feature_values)
+            }
+
+    def set_profile(
+        self, inputs: Dict, breakdown: Optional[Dict], requested: bool
+    ) -> None:
+        """Aggregate the profile breakdown of a feature extraction (if it was
+        profiled) in the metrics, and return it in the response if the client
+        asked for it (see profiling_utils)."""
+        if breakdown is not None:
+            profiling_utils.record_profile(self.name, breakdown)
+        if requested:
+            inputs[self.PROFILE_KEY] = breakdown or {}
+        else:
+            inputs.pop(self.PROFILE_KEY, None)
 
     def get_http_client_session(self, endpoint):
         """Returns a aiohttp session for the specific endpoint passed as input.
@@ -73,106 +281,292 @@ class RevscoringModel(kserve.Model):
             )
         return self._http_client_session[endpoint]
 
-
-
-
-    async def get_extractor(self, inputs, rev_id):
-        # The postprocess() function needs to parse the revision_create_event
-        # given as input (if any).
-        self.revision_create_event = self.get_revision_event(inputs, self.EVENT_KEY)
-        if self.revision_create_event:
+    def set_revision_event(self, inputs, rev_id) -> Optional[Dict]:
+        """Returns the revision-create event given as input (if any), whose
+        rev-id is set in the inputs. The event is read again from the request
+        by predict() (see send_event), since the model serves concurrent
+        requests."""
+        revision_create_event = self.get_revision_event(inputs, self.EVENT_KEY)
+        if revision_create_event:
             inputs["rev_id"] = rev_id
-        wiki_host = os.environ.get(WIKI_HOST_ENV_VAR)
+        return revision_create_event
+
+    async def get_extractor_docs(self, inputs, rev_id) -> Dict:
+        """Fetch the MW API documents needed by the revscoring extractor
+        (see extractor_utils.get_revscoring_extractor_docs)."""
+        revision_create_event = self.set_revision_event(inputs, rev_id)
+        if revision_create_event and self.USE_EVENT_CONTENT:
+            event_docs = extractor_utils.get_mwapi_docs_from_event(
+                revision_create_event
+            )
+        else:
+            event_docs = None
 
         # This is a workaround to allow the revscoring's extractor to leverage
         # aiohttp/asyncio HTTP calls. We inject a MW API cache later on in
         # the extractor, that in turn will not make any (blocking, old style)
         # HTTP calls via libs like requests.
-        mw_http_cache = await extractor_utils.get_revscoring_extractor_cache(
+        return await extractor_utils.get_revscoring_extractor_docs(
             rev_id,
             self.CUSTOM_UA,
-            self.get_http_client_session("mwapi"),
+            None,
             wiki_url=self.wiki_url,
-            wiki_host=wiki_host,
             fetch_extra_info=self.extra_mw_api_calls,
+            mwapi_session=self.mwapi_client,
+            mwapi_batcher=self.mwapi_batcher,
+            doc_cache=self.mwapi_doc_cache,
+            single_flight=self.mwapi_single_flight,
+            event_docs=event_docs,
         )
 
+    async def get_extractor(self, inputs, rev_id):
+        docs = await self.get_extractor_docs(inputs, rev_id)
+        return self.build_extractor(docs)
+
+    def build_extractor(self, docs: Dict):
+        mw_http_cache = extractor_utils.build_mwapi_cache(docs)
         # Create the revscoring's extractor with the MWAPICache built above.
-        return api.Extractor(
-            mwapi.Session(self.wiki_url, user_agent=self.CUSTOM_UA),
-            http_cache=mw_http_cache,
-        )
+        return api.Extractor(self.mwapi_session, http_cache=mw_http_cache)
 
     async def preprocess(self, inputs: Dict, headers: Dict[str, str] = None) -> Dict:
         """Use MW API session and Revscoring API to extract feature values
         of edit text based on its revision id"""
         inputs = validate_json_input(inputs)
+        self.model_reloader.start()
+        if self.REV_IDS_KEY in inputs:
+            return await self.preprocess_batch(inputs)
 
         rev_id = self.get_rev_id(inputs, self.EVENT_KEY)
         extended_output = inputs.get("extended_output", False)
+        # The extraction of a request is profiled if the client asks for it
+        # (and then it is not served from the feature store or the shared
+        # extraction), or if it is sampled.
+        profile_requested = inputs.get(self.PROFILE_KEY, False) is True
+        profile = None
+        if profiling_utils.should_profile(profile_requested, self.EXTRACTION_PROFILE_SAMPLE_RATE):
+            profile = {}
+
+        stored_features = None
+        if not profile_requested:
+            stored_features = self.get_stored_features(rev_id, extended_output)
+        # The request is scored by the model that its features are extracted
+        # for, even if a new version of it is swapped in meanwhile (see
+        # swap_model), overriding any value passed by the client.
+        inputs[self.SERVING_MODEL_KEY] = self.model
+        if stored_features is not None:
+            self.set_revision_event(inputs, rev_id)
+            inputs[self.FEATURE_VAL_KEY], base_feature_values = stored_features
+            profile = None
+        elif self.shared_extractor is not None and not profile_requested:
+            # The features are extracted once per rev-id for all the models
+            # hosted by the process (see shared_features).
+            self.set_revision_event(inputs, rev_id)
+            (
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+            ) = await self.shared_extractor.fetch_features(
+                self, inputs, rev_id, extended_output
+            )
+            self.store_features(
+                rev_id,
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+                inputs[self.SERVING_MODEL_KEY],
+            )
+            profile = None
+        else:
+            (
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+            ) = await self.extract_features(inputs, rev_id, extended_output, profile)
+            self.store_features(
+                rev_id,
+                inputs[self.FEATURE_VAL_KEY],
+                base_feature_values,
+                inputs[self.SERVING_MODEL_KEY],
+            )
+        self.set_extended_output(inputs, base_feature_values)
+        self.set_profile(
+            inputs, profiling_utils.summarize_profile(profile), profile_requested
+        )
+        return inputs
+
+    async def preprocess_batch(self, inputs: Dict) -> Dict:
+        """Extract the feature values of all the rev-ids of a batch request,
+        running the preprocess() of up to BATCH_CONCURRENCY rev-ids at the same
+        time: their MW API documents are fetched concurrently and, with
+        RevscoringModelMP, their features are extracted in parallel by the
+        process pool. A rev-id that fails gets an error in the results instead
+        of failing the whole batch."""
+        rev_ids = self.get_rev_ids(inputs)
+        extended_output = inputs.get("extended_output", False)
+        semaphore = asyncio.Semaphore(self.BATCH_CONCURRENCY)
+
+        async def preprocess_rev_id(rev_id: int) -> Dict:
+            async with semaphore:
+                return await self.preprocess(
+                    {"rev_id": rev_id, "extended_output": extended_output}
+                )
+
+        results = {}
+        while rev_ids:
+            batch_results = await asyncio.gather(
+                *(preprocess_rev_id(rev_id) for rev_id in rev_ids), return_exceptions=True
+            )
+            for rev_id, result in zip(rev_ids, batch_results):
+                if isinstance(result, BaseException):
+                    if not isinstance(result, Exception):
+                        raise result
+                    logging.info(f"Error while preprocessing rev-id {rev_id} of a batch: {result}")
+                    result = self.get_batch_error(result)
+                results[rev_id] = result
+            # The whole batch is scored by the same model, so the rev-ids
+            # preprocessed by a model that was replaced meanwhile (see
+            # swap_model) are preprocessed again.
+            rev_ids = [
+                rev_id
+                for rev_id, result in results.items()
+                if "error" not in result and result[self.SERVING_MODEL_KEY] is not self.model
+            ]
+        inputs[self.SERVING_MODEL_KEY] = self.model
+        inputs[self.BATCH_RESULTS_KEY] = results
+        return inputs
+
+    async def extract_features(
+        self, inputs: Dict, rev_id: int, extended_output: bool, profile: Dict = None
+    ) -> Tuple[List, Optional[List]]:
+        """Returns the feature values of a rev-id, and its base feature
+        values if extended_output is True (None otherwise)."""
         extractor = await self.get_extractor(inputs, rev_id)
+        # The features are extracted for the model in use after the last
+        # await, that scores the request.
+        model = self.model
+        inputs[self.SERVING_MODEL_KEY] = model
+        if self.shared_extractor is not None:
+            # See SharedFeatureExtractor.run.
+            return await self.shared_extractor.run(
+                self.fetch_model_features, rev_id, extractor, extended_output, profile, model
+            )
+        return self.fetch_model_features(rev_id, extractor, extended_output, profile, model)
 
-        # The idea of this cache variable is to avoid extra cpu-bound
-        # computations when executing fetch_features in the extended_output
-        # branch. Revscoring allows to pass a cache parameter to save
-        # info about { rev-id -> features } for subsequent calls.
-        # We pass 'cache' for reference, so that fetch_features can populate/use
-        # it if needed. This sadly doesn't work with a process pool, since
-        # behind the scenes the work is done in another Python process
-        # (and input/output is pickled/unpickled). The reference doesn't work
-        # of course, and any attempt to return it from fetch_features led to
-        # pickling errors. For the moment, until we solve the pickling errors
-        # in revscoring (not sure if we want to do it), enabling extended_output
-        # and using a process pool will mean recomputing fetch_features.
+    def fetch_model_features(
+        self, rev_id: int, extractor, extended_output: bool, profile: Dict = None, model=None
+    ) -> Tuple[List, Optional[List]]:
+        """Extract the model features of a rev-id (and its base features, if
+        extended_output is True) with a revscoring extractor. If a profile dict
+        is passed, it is filled with the durations of every node of the
+        dependency solve. The features are the ones of model (the model in
+        use if None)."""
+        if model is None:
+            model = self.model
+        # Revscoring allows to pass a cache parameter to save info about
+        # { dependent -> value } for subsequent calls, but a cache can't be
+        # shared across calls made in a process pool (the work is done in
+        # another Python process, and input/output is pickled/unpickled).
+        # When extended_output is requested the model features and the base
+        # (trimmed) features are extracted in a single call instead, so that
+        # they share the same dependency solve pass wherever it runs.
         cache = {}
 
-        inputs[self.FEATURE_VAL_KEY] = self.fetch_features(
-            rev_id, self.model.features, extractor, cache
-        )
-
         if extended_output:
-            bare_model_features = list(trim(self.model.features))
-            base_feature_values = self.fetch_features(
-                rev_id, bare_model_features, extractor, cache
+            bare_model_features = list(trim(model.features))
+            return self.fetch_features_with_base(
+                rev_id,
+                model.features,
+                bare_model_features,
+                extractor,
+                cache,
+                profile,
             )
-            inputs[self.EXTENDED_OUTPUT_KEY] = {
-                str(f): v for f, v in zip(bare_model_features, base_feature_values)
-            }
-        return inputs
+        return (
+            self.fetch_features(rev_id, model.features, extractor, cache, profile),
+            None,
+        )
 
-    def get_revision_score_event(self, rev_create_event: Dict[str, Any]) -> Dict:
+    def get_revision_score_event(
+        self, rev_create_event: Dict[str, Any], prediction_results: Dict, model=None
+    ) -> Dict:
+        if model is None:
+            model = self.model
         return events.generate_revision_score_event(
             rev_create_event,
             self.EVENTGATE_STREAM,
-            self.model.version,
-            self.prediction_results,
+            model.version,
+            prediction_results,
             self.model_kind.value,
         )
 
-    def get_output(self, request: Dict, extended_output: bool):
+    def get_output(self, request: Dict, extended_output: bool, prediction_results: Dict):
         wiki_db, model_name = self.name.split("-")
         rev_id = request.get("rev_id")
+        model = self.get_request_model(request)
         output = {
             wiki_db: {
-                "models": {model_name: {"version": self.model.version}},
-                "scores": {rev_id: {model_name: {"score": self.prediction_results}}},
+                "models": {model_name: {"version": model.version}},
+                "scores": {
+                    rev_id: {
+                        model_name: self.get_score_output(
+                            request, extended_output, prediction_results
+                        )
+                    }
+                },
             }
         }
+        return output
+
+    def get_score_output(
+        self, request: Dict, extended_output: bool, prediction_results: Dict
+    ) -> Dict:
+        """Returns the output of the model for a single rev-id."""
+        output = {"score": prediction_results}
         if extended_output:
             # add extended output to reach feature parity with ORES, like:
             # https://ores.wikimedia.org/v3/scores/enwiki/186357639/goodfaith?features
             # If only rev_id is given in input.json, only the prediction results
             # will be present in the response. If the extended_output flag is true,
             # features output will be included in the response.
-            output[wiki_db]["scores"][rev_id][model_name]["features"] = extended_output
+            output["features"] = extended_output
+        profile = request.get(self.PROFILE_KEY)
+        if isinstance(profile, dict):
+            # Seconds spent computing every feature and datasource, if the
+            # extraction was profiled at the client's request.
+            output["profile"] = profile
         return output
 
-    async def send_event(self) -> None:
+    def get_batch_output(self, request: Dict) -> Dict:
+        """Returns the output of a batch request, in the same format of the
+        single rev-id requests (with one entry per rev-id under "scores").
+        A rev-id that failed gets an "error" in place of its score."""
+        wiki_db, model_name = self.name.split("-")
+        scores = {}
+        for rev_id, result in request[self.BATCH_RESULTS_KEY].items():
+            if "error" in result:
+                scores[rev_id] = {model_name: {"error": result["error"]}}
+            else:
+                scores[rev_id] = {
+                    model_name: self.get_score_output(
+                        result,
+                        result.get(self.EXTENDED_OUTPUT_KEY),
+                        result[self.PREDICTION_RESULTS_KEY],
+                    )
+                }
+        return {
+            wiki_db: {
+                "models": {
+                    model_name: {"version": self.get_request_model(request).version}
+                },
+                "scores": scores,
+            }
+        }
+
+    async def send_event(
+        self, revision_create_event: Optional[Dict], prediction_results: Dict, model=None
+    ) -> None:
         # Send a revision-score event to EventGate, generated from
         # the revision-create event passed as input.
-        if self.revision_create_event:
+        if revision_create_event:
             revision_score_event = self.get_revision_score_event(
-                self.revision_create_event
+                revision_create_event, prediction_results, model
             )
             await events.send_event(
                 revision_score_event,
@@ -223,10 +617,136 @@ class RevscoringModel(kserve.Model):
             raise InvalidInput(INVALID_REV_ID_ERR)
         return rev_id
 
+    def get_rev_ids(self, inputs: Dict) -> List[int]:
+        """Get the revision ids of a batch request, without duplicates
+        (in the order of the request)."""
+        if self.EVENT_KEY in inputs:
+            raise InvalidInput(
+                f"A batch request ('{self.REV_IDS_KEY}') can't contain an event."
+            )
+        rev_ids = inputs[self.REV_IDS_KEY]
+        if (
+            not isinstance(rev_ids, list)
+            or not rev_ids
+            or not all(
+                isinstance(rev_id, int) and not isinstance(rev_id, bool)
+                for rev_id in rev_ids
+            )
+        ):
+            logging.error(INVALID_REV_IDS_ERR)
+            raise InvalidInput(INVALID_REV_IDS_ERR)
+        rev_ids = list(dict.fromkeys(rev_ids))
+        if len(rev_ids) > self.BATCH_MAX_SIZE:
+            raise InvalidInput(
+                f"Expected at most {self.BATCH_MAX_SIZE} rev-ids in "
+                f"'{self.REV_IDS_KEY}', got {len(rev_ids)}."
+            )
+        return rev_ids
+
+    def get_request_model(self, request: Dict):
+        """Returns the model that a request was preprocessed by (the model in
+        use if it wasn't), that is the one scoring it."""
+        return request.get(self.SERVING_MODEL_KEY, self.model)
+
+    async def swap_model(self, model, checksum: Optional[str] = None) -> None:
+        """Replace the model in use with a new version of it (see
+        model_reload), whose binary has the sha512 digest checksum. The
+        requests already preprocessed by the old model are still scored by it
+        (see get_request_model)."""
+        features_fingerprint = feature_fingerprint(model.features)
+        if self.shared_extractor is not None and features_fingerprint != self.features_fingerprint:
+            # The shared extraction is set up for the features of the old model.
+            logging.warning(
+                f"The new version of {self.name} has different features, they "
+                "are not extracted together with the other models anymore."
+            )
+            self.shared_extractor = None
+        self.model = model
+        self.features_fingerprint = features_fingerprint
+        self.base_features_fingerprint = feature_fingerprint(trim(model.features))
+        if self.score_batcher is not None:
+            self.score_batcher = self.create_score_batcher()
+
+    def create_score_batcher(self) -> ScoreBatcher:
+        """Returns the ScoreBatcher of the model in use. A batch that is
+        still pending when the model is replaced (see swap_model) is scored
+        by the old model, like its requests."""
+        return ScoreBatcher(
+            functools.partial(self.score_batch, model=self.model),
+            max_wait=self.PREDICT_BATCH_WINDOW_MS / 1000,
+            max_size=self.PREDICT_BATCH_MAX_SIZE,
+        )
+
+    async def score(self, feature_values: List, model=None) -> Dict:
+        """Score feature values with a model (the one in use if None),
+        together with the ones of concurrent requests if PREDICT_BATCHING is
+        enabled."""
+        if model is None:
+            model = self.model
+        if self.score_batcher is not None and model is self.model:
+            return await self.score_batcher.score(feature_values)
+        return score(model, feature_values)
+
+    async def score_batch(self, feature_values_list: List[List], model=None) -> List[Dict]:
+        """Score many feature value lists with a single call to a model (the
+        one in use if None, see common.utils.score_many)."""
+        if model is None:
+            model = self.model
+        return score_many(model, feature_values_list)
+
+    @staticmethod
+    def get_batch_error(error: Exception) -> Dict:
+        """Returns the entry of a rev-id of a batch request that failed."""
+        return {"error": {"type": type(error).__name__, "message": str(error)}}
+
+    async def predict_batch(self, request: Dict) -> Dict:
+        """Score all the rev-ids of a batch request whose features were
+        extracted (and not already scored by preprocess) together, with
+        a single call to the model. If the call fails (like for a single
+        invalid feature vector), the rev-ids are scored one by one, and only
+        the ones that fail get an error."""
+        results = [
+            result
+            for result in request[self.BATCH_RESULTS_KEY].values()
+            if "error" not in result and self.PREDICTION_RESULTS_KEY not in result
+        ]
+        if not results:
+            return self.get_batch_output(request)
+        model = self.get_request_model(request)
+        feature_values_list = [result[self.FEATURE_VAL_KEY] for result in results]
+        try:
+            prediction_results = await self.score_batch(feature_values_list, model)
+        except Exception as e:
+            logging.info(f"Error while scoring a batch of {len(results)} rev-ids, scoring them one by one: {e}")
+            prediction_results = await asyncio.gather(
+                *(self.score_batch([feature_values], model) for feature_values in feature_values_list),
+                return_exceptions=True,
+            )
+            for i, prediction in enumerate(prediction_results):
+                if isinstance(prediction, BaseException):
+                    if not isinstance(prediction, Exception):
+                        raise prediction
+                    results[i].update(self.get_batch_error(prediction))
+                else:
+                    prediction_results[i] = prediction[0]
+        for result, prediction in zip(results, prediction_results):
+            if "error" not in result:
+                result[self.PREDICTION_RESULTS_KEY] = prediction
+        return self.get_batch_output(request)
+
     async def predict(self, request: Dict, headers: Dict[str, str] = None) -> Dict:
+        if self.REV_IDS_KEY in request:
+            # No revision-score events are sent for batch requests, since
+            # they can't carry a revision-create event.
+            return await self.predict_batch(request)
         feature_values = request.get(self.FEATURE_VAL_KEY)
         extended_output = request.get(self.EXTENDED_OUTPUT_KEY)
-        self.prediction_results = score(self.model, feature_values)
-        output = self.get_output(request, extended_output)
-        await self.send_event()
+        model = self.get_request_model(request)
+        # The state of the request is kept in local variables, since the
+        # model serves concurrent requests.
+        prediction_results = await self.score(feature_values, model)
+        output = self.get_output(request, extended_output, prediction_results)
+        await self.send_event(
+            self.get_revision_event(request, self.EVENT_KEY), prediction_results, model
+        )
         return output
@@ -0,0 +1,490 @@
+import asyncio
+import collections
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional, Union
+
+import aiohttp
+import mwapi
+from mwapi.errors import (
+    APIError,
+    ConnectionError,
+    RequestError,
+    TimeoutError,
+    TooManyRedirectsError,
+)
+from mwapi.util import _normalize_params
+
+from coalescing_utils import MicroBatcher
+from metrics_utils import (
+    MWAPI_HEDGES,
+    MWAPI_LATENCY,
+    MWAPI_POOL_CONNECTIONS,
+    MWAPI_REQUESTS,
+    MWAPI_RESPONSE_BYTES,
+    MWAPI_RETRIES,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # noqa: F401 (aiohttp decodes br responses only if available)
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+
+# The parameters are always the same across revscoring models, so
+# we kept them static. If there is the need to tune those in the future
+# it should be easy to move them to a function's parameter.
+REVISION_PARAMS = {
+    "rvprop": {
+        "content",
+        "userid",
+        "size",
+        "contentmodel",
+        "ids",
+        "user",
+        "comment",
+        "timestamp",
+    }
+}
+USER_PARAMS = {"usprop": {"groups", "registration", "editcount", "gender"}}
+
+# Maximum number of revids/ususers values accepted by the MW API
+# in a single query (for clients without the apihighlimits right).
+MWAPI_MAX_BATCH_SIZE = 50
+
+
+def decode_json(body: bytes) -> Any:
+    """Decode a JSON document from the raw bytes of a response body.
+    orjson (if installed) parses bytes directly and it is several times
+    faster than the json module on big documents like the ones containing
+    the wikitext of revisions. The stdlib json module is used otherwise.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class _RetryableRequestError(RequestError):
+    """A RequestError caused by a response status that is worth
+    retrying (5xx, 429)."""
+
+
+# Errors after which an idempotent read can safely be sent again.
+RETRYABLE_ERRORS = (TimeoutError, ConnectionError, _RetryableRequestError)
+
+
+class LatencyTracker:
+    """Keep the latencies of the last (window) successful requests to
+    an endpoint and compute percentiles over them.
+    Percentiles are recomputed (sorting the window) only after
+    refresh_every new samples, to keep the per-request cost low.
+    """
+
+    def __init__(self, window: int = 1000, refresh_every: int = 50):
+        self.window = window
+        self.refresh_every = max(1, refresh_every)
+        self._samples = collections.deque(maxlen=window)
+        self._sorted = []
+        self._new_samples = 0
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+        self._new_samples += 1
+        if (
+            self._new_samples >= self.refresh_every
+            or len(self._sorted) < self.refresh_every
+        ):
+            self._sorted = sorted(self._samples)
+            self._new_samples = 0
+
+    def percentile(self, percentile: float) -> float:
+        """Returns the given percentile (0-100) of the recent latencies,
+        or None if no latency has been recorded yet."""
+        if not self._sorted:
+            return None
+        index = int(percentile / 100 * len(self._sorted))
+        return self._sorted[min(index, len(self._sorted) - 1)]
+
+
+class MWAPIClient:
+    """Long-lived asynchronous client for the MW API of a wiki endpoint.
+    It owns its aiohttp session and connection pool (a TCPConnector
+    tuned via config), so that connections and TLS sessions are reused
+    across requests instead of being re-created every time.
+    The Host header is set per request, rather than on the session.
+    The get() coroutine mirrors mwapi.AsyncSession's one and raises
+    the same mwapi errors, so the client can be used wherever
+    a mwapi.AsyncSession is expected.
+    Responses are requested compressed (if compression is True) and
+    decoded with decode_json (if fast_json is True), since the revision
+    documents carry the whole wikitext of the current and parent revisions.
+
+    To cut the tail latency, requests can be hedged: if an attempt has not
+    answered after the hedge_percentile of the recent latencies of the
+    endpoint, a duplicate is sent and the first successful response wins.
+    Attempts that fail with a timeout, a connection error or a 5xx/429
+    status are retried (up to max_retries times) after a backoff with
+    full jitter. Both are safe since the client only sends reads.
+    """
+
+    def __init__(
+        self,
+        wiki_url: str,
+        user_agent: str,
+        wiki_host: str = None,
+        timeout: float = 5,
+        pool_limit: int = 100,
+        pool_limit_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        compression: bool = True,
+        fast_json: bool = True,
+        api_path: str = "/w/api.php",
+        hedging: bool = False,
+        hedge_percentile: float = 95,
+        hedge_min_delay: float = 0.05,
+        hedge_min_samples: int = 20,
+        max_retries: int = 0,
+        retry_backoff: float = 0.1,
+    ):
+        self.wiki_url = wiki_url
+        self.api_url = wiki_url + api_path
+        # The metrics are labeled by wiki, the Host header (if any) when
+        # several wikis are reached via the same URL (like an API gateway).
+        self.endpoint = wiki_host or wiki_url
+        self.headers = {"User-Agent": user_agent}
+        if wiki_host:
+            self.headers["Host"] = wiki_host
+        self.headers["Accept-Encoding"] = ACCEPT_ENCODING if compression else "identity"
+        self.fast_json = fast_json
+        self.timeout = float(timeout)
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.latency = LatencyTracker()
+        self._session = None
+        self.register_metrics()
+
+    def register_metrics(self) -> None:
+        """Report the connection pool of this client in the metrics of its
+        endpoint (replacing the client that reported it before, if any)."""
+        MWAPI_POOL_CONNECTIONS.labels(self.endpoint, "in_use").set_function(
+            lambda: self.pool_stats()["in_use"]
+        )
+        MWAPI_POOL_CONNECTIONS.labels(self.endpoint, "idle").set_function(
+            lambda: self.pool_stats()["idle"]
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Returns the aiohttp session of the client, opening a new one
+        (with a new connection pool) if it was never opened or closed."""
+        if self._session is None or self._session.closed:
+            logging.info(f"Opening a new MW API connection pool for {self.api_url}.")
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=self.dns_cache_ttl > 0,
+                ttl_dns_cache=self.dns_cache_ttl if self.dns_cache_ttl > 0 else None,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                raise_for_status=True,
+            )
+        return self._session
+
+    def hedge_delay(self) -> Optional[float]:
+        """Returns how long to wait for an attempt before hedging it,
+        or None if the request shouldn't be hedged (hedging disabled or
+        not enough latency samples yet)."""
+        if not self.hedging or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    async def get(self, **params) -> Dict:
+        """Makes a GET request to the MW API and returns the JSON document."""
+        params = _normalize_params(params)
+        params["format"] = "json"
+        retries = 0
+        while True:
+            try:
+                doc = await self._hedged_request(params)
+                break
+            except RETRYABLE_ERRORS as e:
+                if retries >= self.max_retries:
+                    raise
+                retries += 1
+                # Exponential backoff with full jitter, so that the retries
+                # of concurrent requests don't hit the MW API all together.
+                backoff = random.uniform(0, self.retry_backoff * 2 ** (retries - 1))
+                logging.warning(
+                    f"MW API request to {self.api_url} failed ({e}), "
+                    f"retry {retries}/{self.max_retries} in {backoff:.3f}s."
+                )
+                MWAPI_RETRIES.labels(self.endpoint).inc()
+                await asyncio.sleep(backoff)
+        if "error" in doc:
+            raise APIError.from_doc(doc["error"])
+        return doc
+
+    async def _hedged_request(self, params: Dict) -> Dict:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._request(params)
+        first = asyncio.ensure_future(self._request(params))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            MWAPI_HEDGES.labels(self.endpoint, "sent").inc()
+            hedge = asyncio.ensure_future(self._request(params))
+            pending.add(hedge)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is hedge:
+                            MWAPI_HEDGES.labels(self.endpoint, "won").inc()
+                        return attempt.result()
+            # Both attempts failed, the error of the first one is raised.
+            return first.result()
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+    async def _request(self, params: Dict) -> Dict:
+        start = time.monotonic()
+        try:
+            async with self.session.get(
+                self.api_url, params=params, headers=self.headers
+            ) as response:
+                if self.fast_json:
+                    body = await response.read()
+                    MWAPI_RESPONSE_BYTES.labels(self.endpoint).observe(len(body))
+                    doc = decode_json(body)
+                else:
+                    doc = await response.json()
+        except (aiohttp.ServerTimeoutError, asyncio.TimeoutError) as e:
+            MWAPI_REQUESTS.labels(self.endpoint, "timeout").inc()
+            raise TimeoutError(str(e)) from e
+        except aiohttp.TooManyRedirects as e:
+            MWAPI_REQUESTS.labels(self.endpoint, "error").inc()
+            raise TooManyRedirectsError(str(e)) from e
+        except aiohttp.ClientConnectionError as e:
+            MWAPI_REQUESTS.labels(self.endpoint, "error").inc()
+            raise ConnectionError(str(e)) from e
+        except aiohttp.ClientResponseError as e:
+            MWAPI_REQUESTS.labels(self.endpoint, "error").inc()
+            if e.status >= 500 or e.status == 429:
+                raise _RetryableRequestError(str(e)) from e
+            raise RequestError(str(e)) from e
+        except (aiohttp.ClientError, ValueError) as e:
+            MWAPI_REQUESTS.labels(self.endpoint, "error").inc()
+            raise RequestError(str(e)) from e
+        latency = time.monotonic() - start
+        self.latency.add(latency)
+        MWAPI_LATENCY.labels(self.endpoint).observe(latency)
+        MWAPI_REQUESTS.labels(self.endpoint, "ok").inc()
+        return doc
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Returns the usage of the client's connection pool."""
+        stats = {
+            "limit": self.pool_limit,
+            "limit_per_host": self.pool_limit_per_host,
+            "in_use": 0,
+            "idle": 0,
+        }
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            # aiohttp doesn't offer a public API to inspect the pool.
+            stats["in_use"] = len(getattr(connector, "_acquired", ()))
+            stats["idle"] = sum(
+                len(conns) for conns in getattr(connector, "_conns", {}).values()
+            )
+        return stats
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+_mwapi_clients = {}
+
+
+def get_mwapi_client(
+    wiki_url: str, user_agent: str, wiki_host: str = None, **client_params
+) -> MWAPIClient:
+    """Returns the MWAPIClient of a wiki endpoint, creating it on the first
+    call, so that a single client (and connection pool) is used for every
+    wiki endpoint in the process."""
+    key = (wiki_url, wiki_host, user_agent)
+    if key not in _mwapi_clients:
+        _mwapi_clients[key] = MWAPIClient(
+            wiki_url, user_agent, wiki_host=wiki_host, **client_params
+        )
+    return _mwapi_clients[key]
+
+
+def split_revisions_batch_doc(rev_ids: List[int], doc: Dict) -> Dict[int, Dict]:
+    """Split a MW API response related to a batch of rev-ids into
+    one document per rev-id, shaped like the response that the MW API
+    would have returned for a query containing only that rev-id.
+    The documents can be added as they are to a MWAPICache via
+    add_revisions_batch_doc([rev_id], doc).
+
+        Parameters:
+            rev_ids: The rev-ids requested to the MW API.
+            doc: The MW API response for the whole batch.
+
+        Returns:
+            A dict rev-id -> document. Rev-ids not present in the batch
+            response (for example, due to a truncated result) are left out.
+    """
+    query = doc.get("query", {})
+    docs = {}
+    for page_id, page_doc in query.get("pages", {}).items():
+        page_meta = {k: v for k, v in page_doc.items() if k != "revisions"}
+        for revision in page_doc.get("revisions", []):
+            docs[revision.get("revid")] = {
+                "query": {"pages": {page_id: dict(page_meta, revisions=[revision])}}
+            }
+    for bad_rev_id, bad_rev_doc in query.get("badrevids", {}).items():
+        docs[int(bad_rev_id)] = {"query": {"badrevids": {bad_rev_id: bad_rev_doc}}}
+    return {rev_id: docs[rev_id] for rev_id in rev_ids if rev_id in docs}
+
+
+def split_users_batch_doc(users: List[str], doc: Dict) -> Dict[str, Dict]:
+    """Split a MW API response related to a batch of users into
+    one document per user, shaped like the response that the MW API
+    would have returned for a query containing only that user.
+    The documents can be added as they are to a MWAPICache via
+    add_users_batch_doc([user], doc).
+
+        Parameters:
+            users: The user names requested to the MW API.
+            doc: The MW API response for the whole batch.
+
+        Returns:
+            A dict user name -> document. Users whose name is not returned
+            as-is by the MW API (for example, due to normalization)
+            are left out.
+    """
+    user_docs = {
+        user_doc.get("name"): user_doc
+        for user_doc in doc.get("query", {}).get("users", [])
+    }
+    return {
+        user: {"query": {"users": [user_docs[user]]}}
+        for user in users
+        if user in user_docs
+    }
+
+
+class MWAPIBatcher:
+    """Coalesce the revision and user lookups issued by concurrent requests
+    into multi-value MW API queries (revids=a|b|c, ususers=a|b|c).
+    Lookups are collected for a short time window (or until the batch
+    reaches its maximum size) and the response is split into per rev-id
+    and per user documents, so that every request can build its own
+    MWAPICache as if it had queried the MW API alone.
+    Rev-ids and parent rev-ids share the same batches.
+
+    The batcher only needs an object exposing mwapi.AsyncSession's
+    get(**params) coroutine (like MWAPIClient), so it can be pointed
+    at a local stand-in API as well.
+    """
+
+    def __init__(
+        self,
+        session: Union[MWAPIClient, mwapi.AsyncSession],
+        max_wait: float,
+        max_size: int = MWAPI_MAX_BATCH_SIZE,
+    ):
+        self.session = session
+        self._revisions = MicroBatcher(
+            self._fetch_revisions, max_wait, max_size, name="mwapi_revisions"
+        )
+        self._users = MicroBatcher(
+            self._fetch_users, max_wait, max_size, name="mwapi_users"
+        )
+
+    async def get_revision_doc(self, rev_id: int) -> Dict:
+        return await self._revisions.submit(rev_id)
+
+    async def get_user_doc(self, user: str) -> Dict:
+        return await self._users.submit(user)
+
+    async def _fetch_revisions(self, rev_ids: List[int]) -> Dict[int, Dict]:
+        doc = await self.session.get(
+            action="query",
+            prop="revisions",
+            revids=rev_ids,
+            rvslots="main",
+            **REVISION_PARAMS,
+        )
+        docs = split_revisions_batch_doc(rev_ids, doc)
+        missing = [rev_id for rev_id in rev_ids if rev_id not in docs]
+        if missing:
+            # The MW API truncates responses bigger than its max result size,
+            # and big revisions' content may hit that limit. The leftovers
+            # are fetched one by one.
+            logging.warning(
+                f"The batch response from the MW API did not include rev-ids "
+                f"{missing}, fetching them separately."
+            )
+            missing_docs = await asyncio.gather(
+                *(
+                    self.session.get(
+                        action="query",
+                        prop="revisions",
+                        revids=[rev_id],
+                        rvslots="main",
+                        **REVISION_PARAMS,
+                    )
+                    for rev_id in missing
+                )
+            )
+            docs.update(zip(missing, missing_docs))
+        return docs
+
+    async def _fetch_users(self, users: List[str]) -> Dict[str, Dict]:
+        doc = await self.session.get(
+            action="query", list="users", ususers=users, **USER_PARAMS
+        )
+        docs = split_users_batch_doc(users, doc)
+        missing = [user for user in users if user not in docs]
+        if missing:
+            missing_docs = await asyncio.gather(
+                *(
+                    self.session.get(
+                        action="query", list="users", ususers=[user], **USER_PARAMS
+                    )
+                    for user in missing
+                )
+            )
+            docs.update(zip(missing, missing_docs))
+        return docs
@@ -1,14 +1,412 @@
 import asyncio
+import gc
 import logging
+import multiprocessing
+import os
+import pickle
+import time
+import weakref
+from collections import deque
 from concurrent.futures import ProcessPoolExecutor
-from typing import Any
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+import psutil
 from kserve import utils as kserve_utils
 
 from decorators import elapsed_time_async
+from metrics_utils import (
+    PROCESS_POOL_PAYLOAD_BYTES,
+    PROCESS_POOL_SERIALIZATION_SECONDS,
+    PROCESS_POOL_TIMEOUT_PAYLOAD_BYTES,
+    PROCESS_POOL_TIMEOUTS,
+    PROCESS_POOL_WORKER_RESTARTS,
+)
 
+# Sent by a BudgetedProcessPool worker once its initializer has run.
+_WORKER_READY = b"ready"
+# Payloads up to this size are written to an idle worker's pipe without
+# blocking (the capacity of a Linux pipe), larger ones are written by a thread.
+_PIPE_BUFFER_BYTES = 2**16 - 8
 
-def create_process_pool(asyncio_aux_workers: int = None) -> ProcessPoolExecutor:
+# Start method that runs the initializer (like loading the model) once in
+# the parent process and forks the workers afterwards, see get_context.
+PRELOAD_FORK = "preload_fork"
+START_METHODS = ("fork", "spawn", "forkserver", PRELOAD_FORK)
+
+# Whether the objects of this process are frozen against the cyclic GC, see
+# get_context.
+_frozen = False
+# The no-op jobs that start the workers of the ProcessPoolExecutors created
+# with wait=False, see wait_process_pool.
+_warmup_jobs = weakref.WeakKeyDictionary()
+
+
+class JobTimeoutError(Exception):
+    """Raised when a BudgetedProcessPool job exceeds its time budget (its
+    worker is killed and replaced)."""
+
+    def __init__(self, function_name: str, budget: float, payload_bytes: int):
+        super().__init__(
+            f"The {function_name} job exceeded its time budget of {budget}s "
+            f"(payload of {payload_bytes} bytes) and was cancelled."
+        )
+        self.function_name = function_name
+        self.budget = budget
+        self.payload_bytes = payload_bytes
+
+
+class WorkerDiedError(Exception):
+    """Raised when a BudgetedProcessPool worker dies while running a job
+    (for example, killed by the OOM killer). The worker is replaced."""
+
+
+def _budgeted_worker(connection, initializer: Callable, initargs: Tuple) -> None:
+    """Main loop of a BudgetedProcessPool worker: run the pickled calls
+    received from the pipe, one at a time, and send back their pickled
+    (success, result or exception) outcome."""
+    if initializer is not None:
+        initializer(*initargs)
+    connection.send_bytes(_WORKER_READY)
+    while True:
+        try:
+            payload = connection.recv_bytes()
+        except EOFError:
+            return
+        try:
+            outcome = (True, _run_serialized_call(payload))
+        except Exception as e:
+            outcome = (False, e)
+        try:
+            data = pickle.dumps(outcome, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            data = pickle.dumps((False, RuntimeError(f"Unpicklable outcome: {e!r}")))
+        connection.send_bytes(data)
+
+
+def _recv_outcome(connection) -> Tuple[bool, Any]:
+    return pickle.loads(connection.recv_bytes())
+
+
+class _BudgetedWorker:
+    def __init__(self, context, initializer: Callable, initargs: Tuple):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_budgeted_worker,
+            args=(child_connection, initializer, initargs),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+    def kill(self) -> None:
+        self.connection.close()
+        self.process.kill()
+        self.process.join(timeout=1)
+
+
+class BudgetedProcessPool:
+    """A process pool whose jobs have a wall-clock time budget.
+
+    A ProcessPoolExecutor can't cancel a job that is already running, and
+    killing one of its workers breaks the whole pool. Every worker of this
+    pool has its own pipe instead, so the worker of a job that exceeds its
+    budget (for example, the feature extraction of a pathological revision)
+    is killed and replaced on its own, while the other workers keep serving
+    requests. Since the jobs are cpu-bound, the wall-clock budget of a job
+    bounds its cpu time as well. A job whose caller is cancelled (like on
+    a client disconnect) still runs to completion (within its budget), and
+    its worker is then reused.
+
+    Only the calls serialized by serialize_call are supported, see
+    run_in_process_pool.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        timeout: float,
+        initializer: Callable = None,
+        initargs: Tuple = (),
+        context=None,
+        wait: bool = True,
+    ):
+        self.timeout = timeout
+        self._initializer = initializer
+        self._initargs = initargs
+        self._context = context or multiprocessing.get_context()
+        self._idle = deque()
+        self._waiters = deque()
+        self._workers = set()
+        self._shutdown = False
+        self._draining = False
+        # The workers are started eagerly, blocking until they are all
+        # initialized unless wait is False (see wait_ready).
+        self._starting = [self._new_worker() for _ in range(workers)]
+        if wait:
+            self.wait_ready()
+
+    def wait_ready(self) -> None:
+        """Block until the workers started by the constructor have run their
+        initializer. If a worker fails to, the pool is shut down and
+        a RuntimeError is raised."""
+        starting, self._starting = self._starting, []
+        for worker in starting:
+            try:
+                worker.connection.recv_bytes()
+            except (EOFError, OSError):
+                self.shutdown()
+                raise RuntimeError(
+                    f"Process pool worker {worker.process.pid} failed to start."
+                )
+            self._idle.append(worker)
+
+    def _new_worker(self) -> _BudgetedWorker:
+        worker = _BudgetedWorker(self._context, self._initializer, self._initargs)
+        self._workers.add(worker)
+        return worker
+
+    def _release(self, worker: _BudgetedWorker) -> None:
+        self._idle.append(worker)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        if self._draining:
+            # No job is waiting for a worker anymore, see drain.
+            self._idle.remove(worker)
+            self._workers.discard(worker)
+            worker.kill()
+
+    async def _acquire(self) -> _BudgetedWorker:
+        while not self._idle:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass the turn to the next waiter, if a worker was released
+                # for this one.
+                if waiter.done() and not waiter.cancelled() and self._idle:
+                    self._release(self._idle.pop())
+                raise
+        return self._idle.popleft()
+
+    def _replace(self, worker: _BudgetedWorker, reason: str) -> None:
+        """Kill a worker and start a new one, that is added to the idle
+        workers as soon as its initializer has run."""
+        PROCESS_POOL_WORKER_RESTARTS.labels(reason).inc()
+        worker.kill()
+        self._workers.discard(worker)
+        if self._shutdown:
+            return
+        new_worker = self._new_worker()
+        loop = asyncio.get_running_loop()
+        fd = new_worker.connection.fileno()
+
+        def on_ready():
+            loop.remove_reader(fd)
+            try:
+                new_worker.connection.recv_bytes()
+            except (EOFError, OSError):
+                logging.error(
+                    f"Process pool worker {new_worker.process.pid} failed to "
+                    "start, retrying in a second."
+                )
+                loop.call_later(1, self._replace, new_worker, "died")
+                return
+            self._release(new_worker)
+
+        loop.add_reader(fd, on_ready)
+
+    async def run(self, payload: bytes, function_name: str) -> Any:
+        """Run a call serialized by serialize_call in one of the workers.
+
+        Raises:
+            JobTimeoutError: if the job didn't complete within the budget.
+            WorkerDiedError: if the worker died while running the job.
+        """
+        worker = await self._acquire()
+        # Once sent, the job is run to completion even if the caller is
+        # cancelled, so that its outcome is read from the pipe before the
+        # worker takes another job (rather than killing the worker).
+        job = asyncio.ensure_future(self._run_job(worker, payload, function_name))
+        job.add_done_callback(_retrieve_exception)
+        success, result = await asyncio.shield(job)
+        if not success:
+            raise result
+        return result
+
+    async def _run_job(
+        self, worker: _BudgetedWorker, payload: bytes, function_name: str
+    ) -> Tuple[bool, Any]:
+        """Send a job to a worker and read its outcome, then release the
+        worker (or replace it, if the job exceeded its budget or the worker
+        died). The large payloads and the outcomes are written and read by
+        a thread, so that they don't block the event loop."""
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        fd = worker.connection.fileno()
+
+        def on_readable():
+            loop.remove_reader(fd)
+            if not readable.done():
+                readable.set_result(None)
+
+        loop.add_reader(fd, on_readable)
+        try:
+            if len(payload) > _PIPE_BUFFER_BYTES:
+                await loop.run_in_executor(None, worker.connection.send_bytes, payload)
+            else:
+                worker.connection.send_bytes(payload)
+            await asyncio.wait_for(readable, self.timeout)
+            outcome = await loop.run_in_executor(None, _recv_outcome, worker.connection)
+        except asyncio.TimeoutError:
+            loop.remove_reader(fd)
+            PROCESS_POOL_TIMEOUTS.labels(function_name).inc()
+            PROCESS_POOL_TIMEOUT_PAYLOAD_BYTES.labels(function_name).observe(
+                len(payload)
+            )
+            self._replace(worker, "timeout")
+            raise JobTimeoutError(function_name, self.timeout, len(payload))
+        except (EOFError, OSError) as e:
+            loop.remove_reader(fd)
+            self._replace(worker, "died")
+            raise WorkerDiedError(
+                f"The process pool worker {worker.process.pid} died while "
+                f"running the {function_name} job: {e!r}"
+            )
+        self._release(worker)
+        return outcome
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._shutdown = True
+        self._idle.clear()
+        while self._workers:
+            self._workers.pop().kill()
+
+    def drain(self) -> None:
+        """Stop the workers once the jobs already submitted (running, or
+        waiting for a worker) are completed, without blocking: the idle
+        workers are stopped right away, the busy ones when they are released
+        and no job is waiting for them."""
+        self._draining = True
+        while len(self._idle) > len(self._waiters):
+            worker = self._idle.pop()
+            self._workers.discard(worker)
+            worker.kill()
+
+    def worker_pids(self) -> List[int]:
+        return [worker.process.pid for worker in self._workers]
+
+
+def _retrieve_exception(job: asyncio.Future) -> None:
+    # The error of a job whose caller was cancelled is awaited by no one, so it
+    # is marked as retrieved (rather than logged as never retrieved).
+    if not job.cancelled():
+        job.exception()
+
+
+def get_context(
+    start_method: Optional[str] = None,
+    initializer: Callable = None,
+    initargs: Tuple = (),
+):
+    """Returns the multiprocessing context used to start the workers of
+    a process pool.
+
+    With PRELOAD_FORK, the initializer runs in the parent process before the
+    workers are forked, so that they inherit its state (like the model and
+    its language assets) instead of loading their own copy: the initializer
+    must then be a no-op when the state is already there (see
+    worker_utils.init_worker). The objects of the parent are frozen against
+    the cyclic GC (gc.freeze), since GC passes in the workers would write to
+    their headers and un-share (copy) the pages inherited from the fork.
+    Reference count updates still copy the pages of the objects that a worker
+    touches, but not the buffers of the numpy arrays (like the estimators'
+    trees). They are frozen once, before the first fork, so that the garbage
+    of later pool (or worker) restarts isn't moved to the permanent
+    generation, until unfreeze() is called (like for a new model).
+
+    Parameters:
+        start_method: one of START_METHODS, or None for the default
+                      multiprocessing start method of the platform.
+        initializer: the initializer of the workers.
+        initargs: the initializer's arguments.
+    """
+    if start_method != PRELOAD_FORK:
+        return multiprocessing.get_context(start_method)
+    global _frozen
+    if initializer is not None:
+        initializer(*initargs)
+    if not _frozen:
+        gc.collect()
+        gc.freeze()
+        _frozen = True
+        logging.info(
+            f"Froze {gc.get_freeze_count()} objects of the parent process before "
+            "forking the process pool workers."
+        )
+    return multiprocessing.get_context("fork")
+
+
+def unfreeze() -> None:
+    """Move the objects frozen by get_context back to the cyclic GC (so that
+    the ones released since, like a replaced model, can be collected), the
+    next PRELOAD_FORK pool freezes the objects of the process again."""
+    global _frozen
+    gc.unfreeze()
+    _frozen = False
+
+
+def worker_pids(
+    process_pool: Union[ProcessPoolExecutor, BudgetedProcessPool],
+) -> List[int]:
+    """Returns the pids of the live workers of a process pool."""
+    if isinstance(process_pool, BudgetedProcessPool):
+        return process_pool.worker_pids()
+    # ProcessPoolExecutor doesn't expose its workers.
+    return list(getattr(process_pool, "_processes", None) or {})
+
+
+def workers_memory(
+    process_pool: Union[ProcessPoolExecutor, BudgetedProcessPool],
+) -> List[Dict[str, int]]:
+    """Returns the memory used by every worker of a process pool, in bytes:
+    its RSS, its PSS (where the pages shared with other processes, like the
+    ones inherited from the parent, count for their share only) and its USS
+    (the pages of the worker alone)."""
+    report = []
+    for pid in worker_pids(process_pool):
+        try:
+            memory = psutil.Process(pid).memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        report.append(
+            {"pid": pid, "rss": memory.rss, "pss": memory.pss, "uss": memory.uss}
+        )
+    return report
+
+
+def log_workers_memory(
+    process_pool: Union[ProcessPoolExecutor, BudgetedProcessPool], name: str
+) -> None:
+    for worker in workers_memory(process_pool):
+        logging.info(
+            f"Process pool {name} worker {worker['pid']}: "
+            f"RSS {worker['rss'] / 2**20:.1f}MB, PSS {worker['pss'] / 2**20:.1f}MB, "
+            f"USS {worker['uss'] / 2**20:.1f}MB."
+        )
+
+
+def create_process_pool(
+    asyncio_aux_workers: int = None,
+    initializer: Callable = None,
+    initargs: Tuple = (),
+    timeout: Optional[float] = None,
+    start_method: Optional[str] = None,
+    wait: bool = True,
+) -> Union[ProcessPoolExecutor, BudgetedProcessPool]:
     """Create a Python Process pool to offload blocking/long cpu-bound code
     that can potentially block/stall the main asyncio loop thread.
     The default thread pool executor set by Kserve in [1] is meant
@@ -20,6 +418,19 @@ def create_process_pool(asyncio_aux_workers: int = None) -> ProcessPoolExecutor:
 
     Parameters:
         asyncio_aux_workers: the process pool's maximum number of workers.
+        initializer: optional callable run once by every worker when it
+                     starts (for example, to load the model, see
+                     worker_utils.init_worker).
+        initargs: the initializer's arguments.
+        timeout: optional time budget in seconds of every job, if set a
+                 BudgetedProcessPool is created instead of a
+                 ProcessPoolExecutor.
+        start_method: how the workers are started, one of START_METHODS
+                      (see get_context), or None for the default
+                      multiprocessing start method.
+        wait: if False, the workers are started (forked or spawned by the
+              calling thread) without waiting for their initializer, see
+              wait_process_pool.
 
     Returns:
         The instance of the Process Pool.
@@ -31,22 +442,96 @@ def create_process_pool(asyncio_aux_workers: int = None) -> ProcessPoolExecutor:
         "Create a process pool of {} workers to support "
         "model scoring blocking code.".format(asyncio_aux_workers)
     )
-    return ProcessPoolExecutor(max_workers=asyncio_aux_workers)
+    context = get_context(start_method, initializer, initargs)
+    if timeout:
+        logging.info(f"Every process pool job has a time budget of {timeout}s.")
+        return BudgetedProcessPool(
+            asyncio_aux_workers, timeout, initializer, initargs, context, wait
+        )
+    process_pool = ProcessPoolExecutor(
+        max_workers=asyncio_aux_workers,
+        mp_context=context,
+        initializer=initializer,
+        initargs=initargs,
+    )
+    if initializer is not None:
+        # Workers are started lazily, so the initializer would run
+        # while serving the first requests. Submitting a no-op job per
+        # worker starts them (and runs the initializer) right away.
+        jobs = [process_pool.submit(os.getpid) for _ in range(asyncio_aux_workers)]
+        if not wait:
+            _warmup_jobs[process_pool] = jobs
+    return process_pool
+
 
+def wait_process_pool(
+    process_pool: Union[ProcessPoolExecutor, BudgetedProcessPool],
+) -> None:
+    """Block until the workers of a process pool created with wait=False
+    have run their initializer, raising an error if it failed. Only the start
+    of the workers has to run in the event loop's thread (like forking them
+    from the parent's state), so this can run in another thread."""
+    if isinstance(process_pool, BudgetedProcessPool):
+        process_pool.wait_ready()
+        return
+    for job in _warmup_jobs.pop(process_pool, ()):
+        job.result()
 
-def refresh_process_pool(process_pool: ProcessPoolExecutor, asyncio_aux_workers: int):
+
+def refresh_process_pool(
+    process_pool: ProcessPoolExecutor,
+    asyncio_aux_workers: int,
+    initializer: Callable = None,
+    initargs: Tuple = (),
+    timeout: Optional[float] = None,
+    start_method: Optional[str] = None,
+):
     """Shutdown and re-create a process pool. Useful when exeptions like
     BrokenProcessPool are raised (the pool is unusable after that).
     """
     process_pool.shutdown()
-    return create_process_pool(asyncio_aux_workers)
+    return create_process_pool(
+        asyncio_aux_workers, initializer, initargs, timeout, start_method
+    )
+
+
+def retire_process_pool(
+    process_pool: Union[ProcessPoolExecutor, BudgetedProcessPool],
+) -> None:
+    """Shutdown a process pool that was replaced by a new one (like when
+    the model is reloaded), once the jobs already sent to it are completed,
+    without blocking."""
+    if isinstance(process_pool, BudgetedProcessPool):
+        process_pool.drain()
+    else:
+        process_pool.shutdown(wait=False)
+
+
+def serialize_call(function: Callable, function_args: Tuple) -> bytes:
+    """Pickle a function and its arguments, exporting the size of the
+    payload and the time spent to serialize it (by function name), since
+    this is what crosses the IPC boundary on every process pool call.
+    """
+    start = time.perf_counter()
+    payload = pickle.dumps((function, function_args), protocol=pickle.HIGHEST_PROTOCOL)
+    name = getattr(function, "__name__", str(function))
+    PROCESS_POOL_SERIALIZATION_SECONDS.labels(name).observe(time.perf_counter() - start)
+    PROCESS_POOL_PAYLOAD_BYTES.labels(name).observe(len(payload))
+    return payload
+
+
+def _run_serialized_call(payload: bytes) -> Any:
+    function, function_args = pickle.loads(payload)
+    return function(*function_args)
 
 
 @elapsed_time_async
 async def run_in_process_pool(
-    process_pool: ProcessPoolExecutor, function, *function_args
+    process_pool: Union[ProcessPoolExecutor, BudgetedProcessPool],
+    function,
+    *function_args,
 ) -> Any:
-    """Run a function in a ProcessPoolExecutor instance.
+    """Run a function in a ProcessPoolExecutor (or BudgetedProcessPool) instance.
     Parameters:
         function: the function to run in the process pool. Please note:
                   There is some overhead in passing a function to another
@@ -59,6 +544,12 @@ async def run_in_process_pool(
         Any, since the code is executed inside the process pool, and
         the return data is passed as-is.
     """
+    # The call is pickled beforehand (instead of letting the executor do it)
+    # to measure the payload, pickling bytes again is a cheap copy.
+    payload = serialize_call(function, function_args)
+    if isinstance(process_pool, BudgetedProcessPool):
+        name = getattr(function, "__name__", str(function))
+        return await process_pool.run(payload, name)
     return await asyncio.get_event_loop().run_in_executor(
-        process_pool, function, *function_args
+        process_pool, _run_serialized_call, payload
     )
@@ -0,0 +1,34 @@
+import random
+from typing import Dict, Optional
+
+from metrics_utils import EXTRACTION_NODE_CALLS, EXTRACTION_NODE_SECONDS
+
+def should_profile(requested: bool, sample_rate: float = 0) -> bool:
+    """Whether to profile the feature extraction of a request, either since
+    the client asked for it or since the request was sampled (sample_rate is
+    the fraction of the requests profiled in the background, aggregated in
+    the metrics but not returned to the client)."""
+    return requested or (sample_rate > 0 and random.random() < sample_rate)
+
+
+def summarize_profile(profile: Optional[Dict]) -> Optional[Dict[str, float]]:
+    """Turn the profile filled by revscoring's dependency solver (dependent ->
+    list of durations of its own processing, excluding its dependencies) into
+    a {node name: seconds} breakdown, sorted by descending time. The names
+    are plain strings, so the breakdown can cross the process pool's IPC
+    boundary and be returned in the response."""
+    if profile is None:
+        return None
+    seconds = {
+        str(dependent): sum(durations) for dependent, durations in profile.items()
+    }
+    return dict(sorted(seconds.items(), key=lambda item: item[1], reverse=True))
+
+
+def record_profile(model_name: str, breakdown: Dict[str, float]) -> None:
+    """Aggregate a profile breakdown across traffic, in the metrics (for
+    example, topk(20, rate(revscoring_extraction_node_seconds_total[1h]))
+    gives the hot nodes of the last hour)."""
+    for node, seconds in breakdown.items():
+        EXTRACTION_NODE_SECONDS.labels(model_name, node).inc(seconds)
+        EXTRACTION_NODE_CALLS.labels(model_name, node).inc()
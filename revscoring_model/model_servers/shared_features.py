@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from revscoring.features import trim
+
+import extractor_utils
+from cache_utils import TTLLRUCache
+from coalescing_utils import SingleFlight
+from common.constants import SHARED_FEATURES_CACHE_MAX_BYTES, SHARED_FEATURES_TTL
+
+
+class SharedFeatureExtractor:
+    """Extract once per rev-id the features needed by several models of the
+    same wiki (like damaging, goodfaith and reverted) hosted by the same
+    process, and score every model from the shared values.
+
+    The union of the models' features (and of their trimmed base features,
+    for extended_output) is extracted with a single call to the revscoring
+    extractor, so the MW API documents are fetched once and every datasource
+    is computed once. Concurrent requests for the same rev-id (for example
+    the same edit sent to every model) share the same extraction via
+    a SingleFlight registry, and the values are kept for a short time in
+    a TTLLRUCache for the requests that arrive later.
+
+    The extractions run in a dedicated thread (see run), so that a slow
+    revision doesn't block the event loop, and the models share the MW API
+    client (and connection pool) of the first one, since they differ only by
+    their user agent.
+    """
+
+    def __init__(self, models: List, max_bytes: int, ttl: float):
+        self.models = models
+        self.features = []
+        self._index = {}
+        self._model_features = {}
+        self._base_features = {}
+        for model in models:
+            base_features = list(trim(model.model.features))
+            self._model_features[model.name] = self._add(model.model.features)
+            self._base_features[model.name] = self._add(base_features)
+        self.single_flight = SingleFlight("features")
+        self.cache = TTLLRUCache("features", max_bytes, ttl) if max_bytes > 0 else None
+        # The MW API documents are fetched by the model that leads the
+        # extraction, so every model fetches all the documents needed by any
+        # of them.
+        fetch_extra_info = any(model.extra_mw_api_calls for model in models)
+        for model in models:
+            model.extra_mw_api_calls = fetch_extra_info
+            model.shared_extractor = self
+        # The MW API lookups of all the models are batched and coalesced
+        # together.
+        lead = models[0]
+        for model in models[1:]:
+            model.mwapi_client = lead.mwapi_client
+            model.mwapi_batcher = lead.mwapi_batcher
+            model.mwapi_single_flight = lead.mwapi_single_flight
+        lead.mwapi_client.register_metrics()
+        # revscoring's language utilities (like the enchant dictionaries)
+        # are not thread-safe, so the extractions run one at a time.
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="shared-features"
+        )
+
+    def _add(self, features) -> List[int]:
+        """Add features to the union (once per feature) and return their
+        positions in it."""
+        positions = []
+        for feature in features:
+            if feature not in self._index:
+                self._index[feature] = len(self.features)
+                self.features.append(feature)
+            positions.append(self._index[feature])
+        return positions
+
+    async def fetch_features(
+        self, model, inputs: Dict, rev_id: int, extended_output: bool
+    ) -> Tuple[List, Optional[List]]:
+        """Returns the feature values of a model for a rev-id, and its base
+        feature values if extended_output is True (None otherwise)."""
+        values = self.cache.get(rev_id) if self.cache is not None else None
+        if values is None:
+            values = await self.single_flight.do(
+                rev_id, self._extract, model, inputs, rev_id
+            )
+        feature_values = [values[i] for i in self._model_features[model.name]]
+        if not extended_output:
+            return feature_values, None
+        return feature_values, [values[i] for i in self._base_features[model.name]]
+
+    async def _extract(self, model, inputs: Dict, rev_id: int) -> List:
+        extractor = await model.get_extractor(inputs, rev_id)
+        values = await self.run(
+            extractor_utils.fetch_features, rev_id, self.features, extractor, {}
+        )
+        if self.cache is not None:
+            self.cache.set(rev_id, values)
+        return values
+
+    async def run(self, function: Callable, *args) -> Any:
+        """Run a feature extraction in the thread of the shared extractions,
+        used by the other extractions of the models too (like the profiled
+        ones, see RevscoringModel.extract_features)."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+
+def share_feature_extraction(models: List) -> SharedFeatureExtractor:
+    """Make a group of models of the same wiki share their feature
+    extraction. The cache of the shared feature values is configured via
+    environment variables (a small budget by default, disabled if
+    SHARED_FEATURES_CACHE_MAX_BYTES is 0).
+    """
+    wikis = {model.name.split("-")[0] for model in models}
+    if len(wikis) > 1:
+        raise ValueError(
+            "Only models of the same wiki can share their feature extraction, "
+            f"got {sorted(wikis)}."
+        )
+    shared_extractor = SharedFeatureExtractor(
+        models,
+        max_bytes=int(os.environ.get(SHARED_FEATURES_CACHE_MAX_BYTES, 16 * 2**20)),
+        ttl=float(os.environ.get(SHARED_FEATURES_TTL, 60)),
+    )
+    logging.info(
+        f"Models {[model.name for model in models]} share the extraction of "
+        f"{len(shared_extractor.features)} features."
+    )
+    return shared_extractor
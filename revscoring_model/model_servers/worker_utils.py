@@ -0,0 +1,149 @@
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from revscoring.features import trim
+
+import extractor_utils
+import profiling_utils
+from common.enums import RevscoringModelType
+from common.model_cache import file_sha512
+from common.utils import load, score, score_many
+
+# State of the current process pool worker, set by init_worker (or
+# inherited from the parent process, see set_worker_model).
+_model = None
+_model_path = None
+_base_features = None
+
+
+def patch_enchant():
+    """Monkey patch enchant with the classes of pyenchant v2.0.0
+    (pyenchant_utils.py), needed to load models trained with older
+    enchant binaries."""
+    import enchant
+    from pyenchant_utils import EnchantStr, UTF16EnchantStr
+
+    enchant.utils.UTF16EnchantStr = UTF16EnchantStr
+    enchant.utils.EnchantStr = EnchantStr
+
+
+def init_worker(
+    model_kind: RevscoringModelType, model_path: str, checksum: Optional[str] = None
+) -> None:
+    """Process pool initializer: load the model once per worker, so that
+    the calls sent to the pool carry only the request's data (feature values,
+    MW API documents) rather than the model or its features.
+
+    Parameters:
+        model_kind: The kind of the model to load.
+        model_path: The path of the model binary (see common.utils.get_model_path).
+        checksum: The sha512 digest of the model binary verified by the
+                  parent process (see model_reload.load_verified), if any.
+                  A ValueError is raised if the binary doesn't match it
+                  (like a newer binary, not verified yet).
+    """
+    global _model, _model_path, _base_features
+    if _model is not None and _model_path == model_path:
+        # Inherited from the parent process (see process_utils.PRELOAD_FORK).
+        return
+    if checksum is not None and file_sha512(model_path) != checksum:
+        raise ValueError(
+            f"The model binary {model_path} changed since it was verified, "
+            "it is not loaded by the process pool worker."
+        )
+    patch_enchant()
+    set_worker_model(model_path, load(model_kind, model_path))
+    logging.info(f"Process pool worker {os.getpid()} loaded the model {model_path}.")
+
+
+def set_worker_model(model_path: str, model) -> None:
+    """Set the model of the current process. When called by the parent
+    process with the model it already loaded, the workers forked afterwards
+    inherit it (see process_utils.PRELOAD_FORK) rather than loading a copy."""
+    global _model, _model_path, _base_features
+    _model = model
+    _model_path = model_path
+    _base_features = list(trim(model.features))
+
+
+def get_worker_model():
+    if _model is None:
+        raise RuntimeError(
+            "The model is not loaded, the process pool was created without "
+            "the init_worker initializer."
+        )
+    return _model
+
+
+def score_features(feature_values: List) -> Dict:
+    """Score feature values with the worker's model."""
+    return score(get_worker_model(), feature_values)
+
+
+def score_many_features(feature_values_list: List[List]) -> List[Dict]:
+    """Score many feature value lists with a single call to the worker's
+    model (see common.utils.score_many)."""
+    return score_many(get_worker_model(), feature_values_list)
+
+
+def extract_features(
+    rev_id: int,
+    extended_output: bool,
+    docs: Dict,
+    wiki_url: str,
+    user_agent: str,
+    profile: bool = False,
+) -> Tuple[List, Optional[List], Optional[Dict]]:
+    """Extract the features of the worker's model (and the base features, if
+    extended_output is True) from the MW API documents of a rev-id
+    (see extractor_utils.extract_features_from_docs).
+
+    Returns:
+        The feature values, the base feature values (None if extended_output
+        is False) and the profile breakdown of the extraction (None if profile
+        is False, see profiling_utils.summarize_profile).
+    """
+    model = get_worker_model()
+    solve_profile = {} if profile else None
+    feature_values, base_feature_values = extractor_utils.extract_features_from_docs(
+        rev_id,
+        model.features,
+        _base_features if extended_output else None,
+        docs,
+        wiki_url,
+        user_agent,
+        solve_profile,
+    )
+    return (
+        feature_values,
+        base_feature_values,
+        profiling_utils.summarize_profile(solve_profile),
+    )
+
+
+def extract_and_score(
+    rev_id: int,
+    extended_output: bool,
+    docs: Dict,
+    wiki_url: str,
+    user_agent: str,
+    profile: bool = False,
+) -> Tuple[List, Optional[List], Optional[Dict], Dict]:
+    """Extract the features of a rev-id (see extract_features) and score them
+    in the same call, so that a request needs a single process pool round trip.
+
+    Returns:
+        The feature values, the base feature values (None if extended_output
+        is False), the profile breakdown of the extraction (None if profile
+        is False) and the model's score.
+    """
+    feature_values, base_feature_values, breakdown = extract_features(
+        rev_id, extended_output, docs, wiki_url, user_agent, profile
+    )
+    return (
+        feature_values,
+        base_feature_values,
+        breakdown,
+        score_features(feature_values),
+    )
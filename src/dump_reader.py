@@ -0,0 +1,226 @@
+import bz2
+import gzip
+import json
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import mwxml
+from revscoring.extractors.api.extractor import MWAPICache
+
+USER_PARAMS = {"usprop": {"groups", "registration", "editcount", "gender"}}
+
+
+def _open(path: str):
+    """
+    Opens a (possibly bz2/gzip compressed) dump file for reading in text mode.
+    """
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "rt", encoding="utf-8")
+
+
+def iter_xml_revisions(path: str) -> Iterator[Dict]:
+    """
+    Streams the revisions of a MediaWiki XML dump (pages-meta-history or pages-articles),
+    in page order, as flat dicts (see iter_jsonl_revisions for the fields).
+    mwxml parses the dump lazily, so only the current revision is kept in memory.
+    Revisions whose text or user were suppressed have a None text or user_text (they are
+    not scored, but they are the parent of the next revision, see iter_http_caches).
+
+    Parameters:
+    - path (str): Path to the XML dump, optionally compressed with bz2 or gzip.
+
+    Returns:
+    - Iterator[dict]: The revisions of the dump.
+    """
+    with _open(path) as f:
+        dump = mwxml.Dump.from_file(f)
+        for page in dump:
+            for revision in page:
+                yield {
+                    "page_id": page.id,
+                    "page_title": page.title,
+                    "page_namespace": page.namespace,
+                    "rev_id": revision.id,
+                    "rev_parent_id": revision.parent_id,
+                    "rev_timestamp": revision.timestamp.long_format(),
+                    "user_text": revision.user.text if revision.user is not None else None,
+                    "user_id": (revision.user.id or 0) if revision.user is not None else 0,
+                    "comment": revision.comment,
+                    "minor": revision.minor,
+                    "content_model": revision.model or "wikitext",
+                    "text": revision.text,
+                }
+
+
+def iter_jsonl_revisions(path: str) -> Iterator[Dict]:
+    """
+    Streams the revisions of a JSONL export (one revision per line, in page order).
+
+    Every line is a JSON object with the following fields:
+    - page_id, page_title, page_namespace: The page of the revision.
+    - rev_id, rev_parent_id (optional), rev_timestamp (ISO 8601): The revision.
+    - user_text, user_id (0 or missing for anonymous users): The editor (user_text is null
+      if suppressed).
+    - comment, minor, content_model (optional): Other revision metadata.
+    - text: The wikitext of the revision (null if suppressed).
+
+    Parameters:
+    - path (str): Path to the JSONL file, optionally compressed with bz2 or gzip.
+
+    Returns:
+    - Iterator[dict]: The revisions of the export.
+    """
+    with _open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_dump_revisions(path: str, dump_format: str) -> Iterator[Dict]:
+    """
+    Streams the revisions of a dump, either in the MediaWiki XML format ("xml")
+    or in the JSONL one ("jsonl").
+    """
+    if dump_format == "xml":
+        return iter_xml_revisions(path)
+    if dump_format == "jsonl":
+        return iter_jsonl_revisions(path)
+    raise ValueError(f"Unsupported dump format '{dump_format}', expected 'xml' or 'jsonl'.")
+
+
+def revision_doc(revision: Dict, parent_id: int) -> Dict:
+    """
+    Builds the MW API document of a revision (as returned by
+    action=query&prop=revisions&rvslots=main) from a dump revision.
+
+    Parameters:
+    - revision (dict): A revision returned by iter_dump_revisions.
+    - parent_id (int): The rev-id of the parent revision (0 if none).
+
+    Returns:
+    - dict: The MW API document, ready to be added to a MWAPICache.
+    """
+    user_id = revision.get("user_id") or 0
+    rev_doc = {
+        "revid": revision["rev_id"],
+        "parentid": parent_id,
+        "timestamp": revision["rev_timestamp"],
+        "comment": revision.get("comment") or "",
+        "slots": {
+            "main": {
+                "contentmodel": revision.get("content_model") or "wikitext",
+            }
+        },
+    }
+    # Suppressed fields are flagged like the MW API does, so that the extractor
+    # reports them as deleted.
+    if revision.get("text") is None:
+        rev_doc["texthidden"] = ""
+    else:
+        rev_doc["size"] = len(revision["text"].encode("utf-8"))
+        rev_doc["slots"]["main"]["*"] = revision["text"]
+    if revision.get("user_text") is None:
+        rev_doc["userhidden"] = ""
+    else:
+        rev_doc["user"] = revision["user_text"]
+        rev_doc["userid"] = user_id
+        if user_id == 0:
+            rev_doc["anon"] = ""
+    if revision.get("minor"):
+        rev_doc["minor"] = ""
+    page_doc = {
+        "pageid": revision["page_id"],
+        "ns": revision["page_namespace"],
+        "title": revision["page_title"],
+        "revisions": [rev_doc],
+    }
+    return {"query": {"pages": {str(revision["page_id"]): page_doc}}}
+
+
+class UserDocFetcher:
+    """
+    Fetches (via the MW API) the info about registered users, that dumps don't carry,
+    keeping the most recently used user docs in a bounded LRU cache so that the editors
+    of many revisions cost a single MW API call.
+    """
+
+    def __init__(self, session, max_size: int = 100000):
+        self.session = session
+        self.max_size = max_size
+        self._docs = OrderedDict()
+
+    def get(self, user: str) -> Dict:
+        doc = self._docs.get(user)
+        if doc is not None:
+            self._docs.move_to_end(user)
+            return doc
+        doc = self.session.get(action="query", list="users", ususers=[user], **USER_PARAMS)
+        self._docs[user] = doc
+        if len(self._docs) > self.max_size:
+            self._docs.popitem(last=False)
+        return doc
+
+
+def iter_http_caches(revisions: Iterator[Dict],
+                     user_doc_fetcher: Optional[UserDocFetcher] = None,
+                     rev_ids: Optional[Set[int]] = None) -> Iterator[Tuple[int, MWAPICache]]:
+    """
+    Builds, for every revision of a stream in page order, the MWAPICache that revscoring's
+    api.Extractor needs to extract features without HTTP calls.
+
+    The parent content comes from the previous revision in the stream: only the current and
+    the previous revision are kept in memory, whatever the number of revisions of a page.
+    If the dump doesn't carry the parent rev-id, the previous revision of the same page is
+    assumed to be the parent. If the parent is not the previous revision in the stream
+    (for example, since it was deleted), the cache won't contain it and the extractor
+    will fall back to the MW API.
+
+    Revisions whose text or user were suppressed, and the ones not in rev_ids (if given),
+    get no MWAPICache (and their editors are not fetched), but they are still kept as the
+    parent of the next revision.
+
+    Parameters:
+    - revisions (Iterator[dict]): The revisions returned by iter_dump_revisions.
+    - user_doc_fetcher (UserDocFetcher): Optional fetcher of the info about registered
+                                         editors, added to the caches as well.
+    - rev_ids (set): Optional rev-ids to build the caches for, all the revisions if None.
+
+    Returns:
+    - Iterator[Tuple[int, MWAPICache]]: The rev-id and the MWAPICache of every revision.
+    """
+    previous, previous_parent_id = None, 0
+    for revision in revisions:
+        rev_id = revision["rev_id"]
+        same_page = previous is not None and previous["page_id"] == revision["page_id"]
+        parent_id = revision.get("rev_parent_id")
+        if parent_id is None:
+            parent_id = previous["rev_id"] if same_page else 0
+        if revision.get("text") is None or revision.get("user_text") is None:
+            logging.debug(f"Skipping rev-id {rev_id}, its text or user was suppressed.")
+            previous, previous_parent_id = revision, parent_id
+            continue
+        if rev_ids is not None and rev_id not in rev_ids:
+            previous, previous_parent_id = revision, parent_id
+            continue
+        http_cache = MWAPICache()
+        http_cache.add_revisions_batch_doc([rev_id], revision_doc(revision, parent_id))
+        if parent_id and same_page and previous["rev_id"] == parent_id:
+            http_cache.add_revisions_batch_doc(
+                [parent_id], revision_doc(previous, previous_parent_id)
+            )
+        elif parent_id:
+            logging.debug(f"The parent of rev-id {rev_id} ({parent_id}) is not in the dump stream.")
+        user_id = revision.get("user_id") or 0
+        if user_doc_fetcher is not None and user_id > 0:
+            user = revision["user_text"]
+            try:
+                http_cache.add_users_batch_doc([user], user_doc_fetcher.get(user))
+            except Exception as e:
+                # The extractor will try again (and report the error) for this revision only.
+                logging.warning(f"Error fetching the info about user {user}: {e}")
+        yield rev_id, http_cache
+        previous, previous_parent_id = revision, parent_id
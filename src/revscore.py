@@ -1,7 +1,8 @@
 import argparse
 import logging
 from common.enums import RevscoringModelType
-from script_revscoring_model import ScriptRevscoringModel
+from script_revscoring_model import ScriptRevscoringModel, get_extractor
+from dump_reader import UserDocFetcher, iter_dump_revisions, iter_http_caches
 
 import asyncio
 import pandas as pd
@@ -12,7 +13,7 @@ import json
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
 
 
-async def fetch_revision_data(rev_id: int, data_dir: str) -> None:
+async def fetch_revision_data(rev_id: int, data_dir: str, http_cache=None) -> None:
     """
     Asynchronously fetches and saves revision data for a given revision ID.
 
@@ -27,6 +28,8 @@ async def fetch_revision_data(rev_id: int, data_dir: str) -> None:
     - data_dir (str): The directory path where the data files are stored. This
                       path is used to construct the paths for saving the inference
                       data and the features data.
+    - http_cache (MWAPICache): Optional MW API documents of the revision (for example,
+                               built from a dump), used instead of calling the MediaWiki API.
 
     Returns:
     - None: This function does not return anything. It saves the prediction data
@@ -43,7 +46,8 @@ async def fetch_revision_data(rev_id: int, data_dir: str) -> None:
     if not os.path.exists(file_path):
         try:
             await model.fetch_features(rev_id=rev_id, features=model.model.features,
-                                 path_to_save=os.path.join(path_to_features, f"{rev_id}.csv")
+                                 path_to_save=os.path.join(path_to_features, f"{rev_id}.csv"),
+                                 http_cache=http_cache
                                  )
             data = await model.predict(rev_id=rev_id, path_to_features=path_to_features)
             with open(file_path, 'w') as f:
@@ -53,6 +57,21 @@ async def fetch_revision_data(rev_id: int, data_dir: str) -> None:
             logging.error(f"Error fetching data for revision ID {rev_id}: {str(e)}")
 
 
+def create_data_dirs(data_dir: str) -> None:
+    """
+    Creates the data directory and its 'inferences' and 'features' subdirectories,
+    if they do not exist.
+    """
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+        logging.info(f"Created directory {data_dir}")
+
+    for dir in [os.path.join(data_dir, "inferences"), os.path.join(data_dir, "features")]:
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+            logging.info(f"Created directory {dir}")
+
+
 async def main(csv_path: str, data_dir: str) -> None:
     """
     Asynchronously processes revision IDs from a CSV file to fetch and save their data.
@@ -91,36 +110,79 @@ async def main(csv_path: str, data_dir: str) -> None:
         return
 
     df = pd.read_csv(csv_path)
-
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-        logging.info(f"Created directory {data_dir}")
-
-    for dir in [os.path.join(data_dir, "inferences"), os.path.join(data_dir, "features")]:
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-            logging.info(f"Created directory {dir}")
+    create_data_dirs(data_dir)
 
     tasks = [fetch_revision_data(rev_id, data_dir) for rev_id in df['rev_id']]
     await asyncio.gather(*tasks)
 
+
+async def main_dump(dump_path: str, dump_format: str, data_dir: str, csv_path: str = None) -> None:
+    """
+    Processes the revisions of a local dump, instead of fetching them from the MediaWiki API.
+
+    Revisions are streamed in page order from a MediaWiki XML dump or a JSONL export
+    (see dump_reader), and the current and parent content of every revision is fed to the
+    revscoring extractor via a MWAPICache, so that no HTTP call is made for the revisions.
+    Only the info about registered editors (which dumps don't carry) is fetched from the
+    MediaWiki API, once per user. Revisions are processed one at a time, so the throughput
+    is bound by the CPU time of the feature extraction and memory stays bounded
+    whatever the size of the dump or of its pages.
+
+    Parameters:
+    - dump_path (str): The path to the dump, optionally compressed with bz2 or gzip.
+    - dump_format (str): The format of the dump, 'xml' or 'jsonl'.
+    - data_dir (str): The base directory path where the inferences and features are stored.
+    - csv_path (str): Optional path to a CSV file with the revision IDs (column 'rev_id')
+                      to score. All the revisions of the dump are scored if not specified.
+
+    Returns:
+    - None
+    """
+    rev_ids = None
+    if csv_path:
+        if not os.path.isfile(csv_path):
+            logging.error(f"CSV file not found at {csv_path}")
+            return
+        rev_ids = set(pd.read_csv(csv_path)['rev_id'])
+    create_data_dirs(data_dir)
+
+    user_doc_fetcher = UserDocFetcher(get_extractor().session)
+    revisions = iter_dump_revisions(dump_path, dump_format)
+    processed = 0
+    for rev_id, http_cache in iter_http_caches(revisions, user_doc_fetcher, rev_ids):
+        await fetch_revision_data(rev_id, data_dir, http_cache=http_cache)
+        processed += 1
+        if processed % 1000 == 0:
+            logging.info(f"Processed {processed} revisions from {dump_path}")
+    logging.info(f"Processed {processed} revisions from {dump_path}")
+
 # This script is a Revscoring Data Fetcher. It reads revision IDs from a CSV file,
 # fetches and saves data for each revision ID using a specified model. The script
 # allows customization of the CSV file path, data directory, model name, and model type
 # through command-line arguments.
+# With --dump_path the revisions are read from a local XML/JSONL dump instead of the
+# MediaWiki API, and the CSV file (if passed explicitly) restricts the revisions to score.
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Revscoring Data Fetcher")
-    parser.add_argument('--csv_path', type=str, default='revision_ids.csv',
-                        help='Path to the CSV file with revision IDs')
+    parser.add_argument('--csv_path', type=str, default=None,
+                        help='Path to the CSV file with revision IDs (default revision_ids.csv, '
+                             'or all the revisions of the dump with --dump_path)')
     parser.add_argument('--data_dir', type=str, default='data', help='Directory to store the fetched data')
     parser.add_argument('--model_name', type=str, required=True, help='Name of the model')
     parser.add_argument('--model_type', type=str, required=True, choices=[e.value for e in RevscoringModelType],
                         help='Type of the model')
+    parser.add_argument('--dump_path', type=str, default=None,
+                        help='Path to a local XML/JSONL dump to read the revisions from')
+    parser.add_argument('--dump_format', type=str, default='xml', choices=['xml', 'jsonl'],
+                        help='Format of the dump passed via --dump_path')
     # Parse the command-line arguments.
     args = parser.parse_args()
 
     # Initialize the model and start the main asynchronous operation.
-    model_kind = args.model_type
+    model_kind = RevscoringModelType(args.model_type)
     model = ScriptRevscoringModel(args.model_name, model_kind)
-    asyncio.run(main(args.csv_path, args.data_dir))
\ No newline at end of file
+    if args.dump_path:
+        asyncio.run(main_dump(args.dump_path, args.dump_format, args.data_dir, args.csv_path))
+    else:
+        asyncio.run(main(args.csv_path or 'revision_ids.csv', args.data_dir))
\ No newline at end of file
@@ -1,10 +1,26 @@
+from functools import lru_cache
 from typing import Dict
 import mwapi
 import pandas as pd
 from revscoring.extractors.api import Extractor
+from revscoring.extractors.api.extractor import MWAPICache
 from common.enums import RevscoringModelType
 from common.constants import API_USER_AGENT
 from common.utils import get_model_path, _get_wiki_url, convert, score, load
+from common.response_store import wrap_session
+from common.feature_store import feature_fingerprint, get_feature_store
+
+
+@lru_cache(maxsize=None)
+def get_extractor() -> Extractor:
+    """
+    Returns the api.Extractor shared by all the revisions processed by the script,
+    so that the HTTP session (and its connections) is created only once.
+    """
+    wiki_url = _get_wiki_url()
+    # Responses are recorded to/replayed from a local store if RESPONSE_STORE_MODE is set.
+    session = wrap_session(mwapi.Session(host=wiki_url, user_agent=API_USER_AGENT), wiki_url)
+    return Extractor(session)
 
 
 class ScriptRevscoringModel:
@@ -15,7 +31,7 @@ class ScriptRevscoringModel:
         self.model = load(self.model_kind, self.model_path)
 
     @staticmethod
-    async def fetch_features(rev_id, features, path_to_save: str) -> None:
+    async def fetch_features(rev_id, features, path_to_save: str, http_cache: MWAPICache = None) -> None:
         """
         Asynchronously fetches specified features for a given revision ID and saves them to a CSV file.
 
@@ -32,6 +48,8 @@ class ScriptRevscoringModel:
                     typically a list or similar iterable of feature identifiers.
         - path_to_save (str): The file path where the extracted features should be saved as a CSV.
                               The method will overwrite any existing file at this path.
+        - http_cache (MWAPICache): Optional MW API documents of the revision (for example, built
+                                   from a dump), used instead of calling the MediaWiki API.
 
         Returns:
         - None: This method does not return a value. Its primary effect is the side effect of
@@ -44,11 +62,19 @@ class ScriptRevscoringModel:
           target wiki URL and a user agent string.
         - The caller is responsible for ensuring that the `path_to_save` directory exists
           and is writable.
+        - If FEATURE_STORE_PATH is set, the feature values are read from the feature store
+          (see common.feature_store) when available, and saved to it after the extraction.
         """
-        extractor = Extractor(mwapi.Session(host=_get_wiki_url(),
-                                            user_agent=API_USER_AGENT))
-
-        values = extractor.extract(rev_id, features)
+        feature_store = get_feature_store()
+        fingerprint = feature_fingerprint(features)
+        values = feature_store.get(rev_id, fingerprint) if feature_store is not None else None
+        if values is None:
+            extractor = get_extractor()
+            # Passing an empty MWAPICache resets the one of the previous revision (if any).
+            # extract() returns a generator, that the feature store can't serialize.
+            values = list(extractor.extract(rev_id, features, http_cache=http_cache or MWAPICache()))
+            if feature_store is not None:
+                feature_store.put(rev_id, fingerprint, values)
         df = pd.DataFrame([values], columns=[str(f) for f in features])
         df.to_csv(path_to_save, index=False)
 
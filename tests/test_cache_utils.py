@@ -0,0 +1,142 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "revscoring_model", "model_servers"))
+
+import cache_utils  # noqa: E402
+from cache_utils import MWAPIDocCache, TTLLRUCache  # noqa: E402
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake monotonic clock for the caches, advanced by the tests."""
+    now = [1000.0]
+    monkeypatch.setattr(cache_utils.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hits_and_misses_are_counted():
+    cache = TTLLRUCache("test", max_bytes=100, default_ttl=60)
+    cache.set("a", 1, size=10)
+
+    assert cache.get("a") == 1
+    assert cache.get("b", "default") == "default"
+    assert cache.stats() == {
+        "entries": 1,
+        "bytes": 10,
+        "max_bytes": 100,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "expirations": 0,
+    }
+
+
+def test_least_recently_used_entries_are_evicted_over_budget():
+    cache = TTLLRUCache("test", max_bytes=30, default_ttl=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, key, size=10)
+    # Reading "a" makes "b" the least recently used entry.
+    cache.get("a")
+    cache.set("d", "d", size=10)
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in ("a", "c", "d")] == ["a", "c", "d"]
+    assert cache.current_bytes == 30
+    assert cache.evictions == 1
+
+    # An entry bigger than a single eviction makes room for itself.
+    cache.set("e", "e", size=25)
+    assert len(cache) == 1
+    assert cache.get("e") == "e"
+    assert cache.evictions == 4
+
+
+def test_entries_bigger_than_the_budget_are_not_cached():
+    cache = TTLLRUCache("test", max_bytes=30, default_ttl=60)
+    cache.set("a", "a", size=10)
+    cache.set("big", "big", size=31)
+
+    assert cache.get("big") is None
+    assert cache.get("a") == "a"
+    assert cache.evictions == 0
+
+
+def test_replacing_an_entry_updates_its_size():
+    cache = TTLLRUCache("test", max_bytes=100, default_ttl=60)
+    cache.set("a", 1, size=10)
+    cache.set("a", 2, size=40)
+
+    assert len(cache) == 1
+    assert cache.current_bytes == 40
+    assert cache.get("a") == 2
+
+
+def test_size_is_estimated_when_not_passed():
+    cache = TTLLRUCache("test", max_bytes=10_000, default_ttl=60)
+    cache.set("small", {"text": "x"})
+    small_bytes = cache.current_bytes
+    cache.set("large", {"text": "x" * 1000})
+
+    # The estimate grows with the length of the strings in the documents.
+    assert cache.current_bytes - small_bytes == small_bytes + 999
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = TTLLRUCache("test", max_bytes=100, default_ttl=60)
+    cache.set("default", 1, size=10)
+    cache.set("short", 2, ttl=5, size=10)
+
+    clock[0] += 5
+    assert cache.get("short") == 2
+    clock[0] += 1
+    assert cache.get("short") is None
+    assert cache.get("default") == 1
+    clock[0] += 60
+    assert cache.get("default") is None
+
+    assert len(cache) == 0
+    assert cache.current_bytes == 0
+    assert cache.expirations == 2
+    assert cache.misses == 2
+
+
+def test_doc_cache_ttls_depend_on_the_kind_of_document(clock):
+    cache = MWAPIDocCache(10_000, revision_ttl=100, user_ttl=10, badrevid_ttl=50)
+    revision_doc = {"query": {"pages": {"1": {"revisions": [{"revid": 1}]}}}}
+    badrevid_doc = {"query": {"badrevids": {"2": {"revid": 2}}}}
+    user_doc = {"query": {"users": [{"name": "Alice"}]}}
+    cache.add_revision_doc(1, revision_doc)
+    cache.add_revision_doc(2, badrevid_doc)
+    cache.add_user_doc("Alice", user_doc)
+
+    clock[0] += 11
+    assert cache.get_user_doc("Alice") is None
+    assert cache.get_revision_doc(2) == badrevid_doc
+    clock[0] += 40
+    assert cache.get_revision_doc(2) is None
+    assert cache.get_revision_doc(1) == revision_doc
+
+
+def test_doc_cache_skips_incomplete_documents():
+    cache = MWAPIDocCache(10_000, revision_ttl=100, user_ttl=10, badrevid_ttl=50)
+    cache.add_revision_doc(1, {"query": {"pages": {}}})
+    cache.add_user_doc("Alice", {"query": {"users": []}})
+
+    assert cache.stats()["entries"] == 0
+
+
+def test_doc_cache_wiki_views_share_the_budget_but_not_the_keys():
+    cache = MWAPIDocCache(10_000, revision_ttl=100, user_ttl=10, badrevid_ttl=50)
+    enwiki, itwiki = cache.for_wiki("enwiki"), cache.for_wiki("itwiki")
+    doc = {"query": {"pages": {"1": {"revisions": [{"revid": 1}]}}}}
+    enwiki.add_revision_doc(1, doc)
+
+    assert enwiki.get_revision_doc(1) == doc
+    assert itwiki.get_revision_doc(1) is None
+    assert cache.stats()["entries"] == 1
+    assert itwiki.stats() == enwiki.stats()
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "revscoring_model", "model_servers"))
+
+from coalescing_utils import ScoreBatcher, SingleFlight  # noqa: E402
+
+
+class Fetcher:
+    """A coroutine function counting its calls, that completes (or fails)
+    only when the test releases it."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = None
+
+    async def __call__(self, key):
+        self.calls.append(key)
+        await self.release.wait()
+        if isinstance(key, Exception):
+            raise key
+        return f"doc {key}"
+
+
+def test_concurrent_callers_share_the_same_flight():
+    async def run():
+        fetch = Fetcher()
+        fetch.release = asyncio.Event()
+        flights = SingleFlight("test")
+        callers = [
+            asyncio.ensure_future(flights.do(key, fetch, key)) for key in (1, 1, 2, 1)
+        ]
+        await asyncio.sleep(0)
+        waiters = flights.waiters(1), flights.waiters(2)
+        fetch.release.set()
+        return await asyncio.gather(*callers), fetch.calls, waiters, flights
+
+    results, calls, waiters, flights = asyncio.run(run())
+
+    assert results == ["doc 1", "doc 1", "doc 2", "doc 1"]
+    assert calls == [1, 2]
+    assert waiters == (3, 1)
+    # The flights land as soon as they complete.
+    assert flights.waiters(1) == 0
+
+
+def test_landed_flights_are_not_reused():
+    async def run():
+        fetch = Fetcher()
+        fetch.release = asyncio.Event()
+        fetch.release.set()
+        flights = SingleFlight("test")
+        first = await flights.do(1, fetch, 1)
+        second = await flights.do(1, fetch, 1)
+        return first, second, fetch.calls
+
+    first, second, calls = asyncio.run(run())
+
+    assert first == second == "doc 1"
+    assert calls == [1, 1]
+
+
+def test_failures_reach_only_the_waiting_callers():
+    error = ValueError("MW API down")
+
+    async def run():
+        fetch = Fetcher()
+        fetch.release = asyncio.Event()
+        flights = SingleFlight("test")
+        callers = [
+            asyncio.ensure_future(flights.do("key", fetch, error)) for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        # The next caller runs the work again, instead of getting the error.
+        retry = await flights.do("key", fetch, "key")
+        return results, retry, fetch.calls
+
+    results, retry, calls = asyncio.run(run())
+
+    assert results == [error, error]
+    assert retry == "doc key"
+    assert calls == [error, "key"]
+
+
+def test_cancelling_a_caller_does_not_cancel_the_flight():
+    async def run():
+        fetch = Fetcher()
+        fetch.release = asyncio.Event()
+        flights = SingleFlight("test")
+        cancelled = asyncio.ensure_future(flights.do(1, fetch, 1))
+        waiting = asyncio.ensure_future(flights.do(1, fetch, 1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        fetch.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        return await waiting, fetch.calls
+
+    result, calls = asyncio.run(run())
+
+    assert result == "doc 1"
+    assert calls == [1]
+
+
+class ScoreMany:
+    """A batch scoring coroutine recording the batches it gets, that fails
+    the batches containing negative feature values."""
+
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, feature_values_list):
+        self.batches.append(feature_values_list)
+        if any(value < 0 for values in feature_values_list for value in values):
+            raise ValueError("Invalid feature values")
+        return [{"score": sum(values)} for values in feature_values_list]
+
+
+def score_concurrently(feature_values_list, max_size=10):
+    score_many = ScoreMany()
+
+    async def run():
+        batcher = ScoreBatcher(score_many, max_wait=0.05, max_size=max_size)
+        return await asyncio.gather(
+            *(batcher.score(values) for values in feature_values_list),
+            return_exceptions=True,
+        )
+
+    return asyncio.run(run()), score_many.batches
+
+
+def test_concurrent_scores_are_batched():
+    scores, batches = score_concurrently([[1, 2], [3, 4], [1, 2], [5]])
+
+    # Feature values are not deduplicated, every caller gets its own score.
+    assert batches == [[[1, 2], [3, 4], [1, 2], [5]]]
+    assert scores == [{"score": 3}, {"score": 7}, {"score": 3}, {"score": 5}]
+
+
+def test_score_batches_are_capped_at_max_size():
+    scores, batches = score_concurrently([[i] for i in range(5)], max_size=2)
+
+    assert batches == [[[0], [1]], [[2], [3]], [[4]]]
+    assert scores == [{"score": i} for i in range(5)]
+
+
+def test_failing_batches_are_scored_one_by_one():
+    scores, batches = score_concurrently([[1], [-1], [2]])
+
+    assert batches == [[[1], [-1], [2]], [[1]], [[-1]], [[2]]]
+    # Only the caller of the invalid feature values gets the error.
+    assert scores[0] == {"score": 1}
+    assert isinstance(scores[1], ValueError)
+    assert scores[2] == {"score": 2}
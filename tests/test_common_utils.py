@@ -0,0 +1,80 @@
+import os
+import random
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from common.utils import score_many  # noqa: E402
+
+
+def train_model(model_class, labels, **model_params):
+    """Train a small model on random wikitext feature values."""
+    from revscoring.features import wikitext
+
+    revision = wikitext.revision
+    features = [revision.chars, revision.words, revision.parent.chars]
+    model = model_class(features, labels, **model_params)
+    rng = random.Random(0)
+    observations = []
+    for _ in range(200):
+        values = [rng.randint(0, 1000) for _ in features]
+        if model_params.get("multilabel"):
+            label = [label for label in labels if rng.random() < 0.5]
+        else:
+            label = labels[values[0] % len(labels)]
+        observations.append((values, label))
+    model.train(observations)
+    return model
+
+
+def feature_values_list():
+    rng = random.Random(1)
+    return [[rng.randint(0, 1000) for _ in range(3)] for _ in range(20)]
+
+
+@pytest.mark.parametrize(
+    "model_class_name,labels,model_params",
+    [
+        ("RandomForest", [True, False], {"n_estimators": 5}),
+        ("GradientBoosting", ["stub", "start", "b", "fa"], {"n_estimators": 5}),
+        (
+            "RandomForest",
+            ["stem", "culture", "geography"],
+            {"n_estimators": 5, "multilabel": True},
+        ),
+        ("LogisticRegression", [True, False], {"scale": True, "center": True}),
+    ],
+)
+def test_score_many_matches_score(model_class_name, labels, model_params):
+    from revscoring.scoring import models
+
+    model = train_model(getattr(models, model_class_name), labels, **model_params)
+    values_list = feature_values_list()
+    expected_scores = [model.score(values) for values in values_list]
+
+    assert score_many(model, values_list) == expected_scores
+    # The fitted scaler (if any) is used as it is, not re-fitted on the
+    # values to score.
+    assert [model.score(values) for values in values_list] == expected_scores
+
+
+def test_score_many_of_no_values():
+    from revscoring.scoring.models import RandomForest
+
+    model = train_model(RandomForest, [True, False], n_estimators=5)
+
+    assert score_many(model, []) == []
+
+
+def test_score_many_scores_other_models_one_at_a_time():
+    class Model:
+        def score(self, feature_values):
+            return {"prediction": sum(feature_values)}
+
+    assert score_many(Model(), [[1, 2], [3]]) == [
+        {"prediction": 3},
+        {"prediction": 3},
+    ]
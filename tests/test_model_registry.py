@@ -0,0 +1,232 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from kserve.errors import InferenceError, InvalidInput
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "revscoring_model", "model_servers"))
+
+from model_registry import (  # noqa: E402
+    ModelRegistry,
+    discover_models,
+    get_wiki_host,
+)
+
+
+def make_models_dir(root, models):
+    """Lay out empty model binaries like <type>/<wiki>/<version>/<file>."""
+    for path in models:
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+    return str(root)
+
+
+class Reloader:
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+class Model:
+    def __init__(self, name):
+        self.name = name
+        self.model_reloader = Reloader()
+
+
+class Registry(ModelRegistry):
+    """A ModelRegistry whose models are placeholders, recording the loads
+    (the RevscoringModels need the language assets of the wikis)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loads = []
+        self.release_load = threading.Event()
+        self.release_load.set()
+
+    def _create_model(self, model_type, wiki):
+        self.loads.append((model_type, wiki))
+        self.release_load.wait()
+        if wiki == "frwiki":
+            raise EOFError("Truncated model binary")
+        return Model(f"{wiki}-{model_type}")
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    return make_models_dir(
+        tmp_path,
+        [
+            "goodfaith/enwiki/20220101000000/model.bin",
+            "goodfaith/itwiki/20220101000000/model.bin",
+            "goodfaith/dewiki/20220101000000/model.bin",
+            "damaging/enwiki/20220101000000/model.bin",
+            "goodfaith/frwiki/20220101000000/model.bin",
+        ],
+    )
+
+
+def test_discover_models_keeps_the_latest_version(tmp_path):
+    models_dir = make_models_dir(
+        tmp_path,
+        [
+            "goodfaith/enwiki/20220101000000/model.bin",
+            "goodfaith/enwiki/20230101000000/model.bin",
+            # The latest version without a binary is skipped.
+            "goodfaith/itwiki/20220101000000/model.bin",
+            "goodfaith/itwiki/20230101000000/README",
+            "draftquality/enwiki/20220101000000/model.bz2",
+            "notamodel/enwiki/20220101000000/model.bin",
+        ],
+    )
+
+    assert discover_models(models_dir) == {
+        ("draftquality", "enwiki"): os.path.join(
+            models_dir, "draftquality/enwiki/20220101000000/model.bz2"
+        ),
+        ("goodfaith", "enwiki"): os.path.join(
+            models_dir, "goodfaith/enwiki/20230101000000/model.bin"
+        ),
+        ("goodfaith", "itwiki"): os.path.join(
+            models_dir, "goodfaith/itwiki/20220101000000/model.bin"
+        ),
+    }
+
+
+@pytest.mark.parametrize(
+    "wiki,host",
+    [
+        ("enwiki", "en.wikipedia.org"),
+        ("simplewiki", "simple.wikipedia.org"),
+        ("zh_min_nanwiki", "zh-min-nan.wikipedia.org"),
+        ("be_x_oldwiki", "be-x-old.wikipedia.org"),
+        ("wikidatawiki", "www.wikidata.org"),
+        ("commonswiki", "commons.wikimedia.org"),
+    ],
+)
+def test_get_wiki_host(wiki, host):
+    assert get_wiki_host(wiki) == host
+
+
+def test_get_wiki_host_of_other_wikis():
+    with pytest.raises(ValueError):
+        get_wiki_host("votewiki")
+    wiki_hosts = {"votewiki": "vote.wikimedia.org", "enwiki": "en.example.org"}
+    assert get_wiki_host("votewiki", wiki_hosts) == "vote.wikimedia.org"
+    assert get_wiki_host("enwiki", wiki_hosts) == "en.example.org"
+
+
+def test_registry_fails_at_startup_for_unknown_wikis(tmp_path):
+    models_dir = make_models_dir(
+        tmp_path,
+        [
+            "goodfaith/enwiki/20220101000000/model.bin",
+            "goodfaith/votewiki/20220101000000/model.bin",
+        ],
+    )
+    with pytest.raises(ValueError, match="votewiki"):
+        Registry(models_dir)
+
+    registry = Registry(models_dir, wiki_hosts={"votewiki": "vote.wikimedia.org"})
+    assert registry.wiki_hosts == {
+        "enwiki": "en.wikipedia.org",
+        "votewiki": "vote.wikimedia.org",
+    }
+
+
+def test_models_are_loaded_once_on_their_first_request(models_dir):
+    registry = Registry(models_dir)
+
+    async def run():
+        registry.release_load.clear()
+        requests = [
+            asyncio.ensure_future(registry.get_model("goodfaith", "enwiki"))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0.05)
+        registry.release_load.set()
+        models = await asyncio.gather(*requests)
+        models.append(await registry.get_model("goodfaith", "enwiki"))
+        return models
+
+    models = asyncio.run(run())
+
+    assert registry.loads == [("goodfaith", "enwiki")]
+    assert all(model is models[0] for model in models)
+    assert registry.loaded() == ["enwiki-goodfaith"]
+    assert registry.model_types() == ["damaging", "goodfaith"]
+
+
+def test_requests_for_missing_or_broken_models_fail(models_dir):
+    registry = Registry(models_dir)
+
+    async def run():
+        with pytest.raises(InvalidInput):
+            await registry.get_model("goodfaith", "eswiki")
+        with pytest.raises(InferenceError):
+            await registry.get_model("goodfaith", "frwiki")
+        # A failed load is tried again on the next request.
+        with pytest.raises(InferenceError):
+            await registry.get_model("goodfaith", "frwiki")
+
+    asyncio.run(run())
+
+    assert registry.loads == [("goodfaith", "frwiki")] * 2
+    assert registry.loaded() == []
+
+
+def test_no_model_is_evicted_without_a_memory_budget(models_dir):
+    registry = Registry(models_dir)
+
+    async def run():
+        for wiki in ("enwiki", "itwiki", "dewiki"):
+            await registry.get_model("goodfaith", wiki)
+
+    asyncio.run(run())
+
+    assert len(registry.loaded()) == 3
+
+
+def test_least_recently_used_model_is_evicted_over_budget(models_dir):
+    registry = Registry(models_dir, max_rss_bytes=2**50)
+
+    async def run():
+        enwiki = await registry.get_model("goodfaith", "enwiki")
+        itwiki = await registry.get_model("goodfaith", "itwiki")
+        await registry.get_model("damaging", "enwiki")
+        # enwiki-goodfaith is used again, so itwiki-goodfaith becomes the
+        # least recently used model.
+        await registry.get_model("goodfaith", "enwiki")
+        # Any RSS exceeds the budget from now on.
+        registry.max_rss_bytes = 1
+        await registry.get_model("goodfaith", "dewiki")
+        return enwiki, itwiki
+
+    enwiki, itwiki = asyncio.run(run())
+
+    # A single model is evicted per load, and its reloader is stopped.
+    assert registry.loaded() == [
+        "enwiki-damaging",
+        "enwiki-goodfaith",
+        "dewiki-goodfaith",
+    ]
+    assert itwiki.model_reloader.stopped
+    assert not enwiki.model_reloader.stopped
+
+
+def test_model_just_loaded_is_never_evicted(models_dir):
+    registry = Registry(models_dir, max_rss_bytes=1)
+
+    async def run():
+        for wiki in ("enwiki", "itwiki", "dewiki"):
+            await registry.get_model("goodfaith", wiki)
+
+    asyncio.run(run())
+
+    assert registry.loaded() == ["dewiki-goodfaith"]
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "revscoring_model", "model_servers"))
+
+from common.constants import MODEL_CACHE_DIR  # noqa: E402
+from common.enums import RevscoringModelType  # noqa: E402
+from model_reload import (  # noqa: E402
+    ModelReloader,
+    ModelReloadRepository,
+    get_model_signature,
+    load_verified,
+)
+
+
+def write_model(path: str, version: str, checksum: bool = True) -> str:
+    """Train and dump a small model, with its .sha512 file (the one of
+    another binary if checksum is False). Returns the digest of the binary."""
+    from revscoring.features import wikitext
+    from revscoring.scoring.models import RandomForest
+
+    revision = wikitext.revision
+    model = RandomForest(
+        [revision.chars, revision.words], [True, False], version=version, n_estimators=2
+    )
+    model.train([([i % 7, i % 5], i % 2 == 0) for i in range(50)])
+    with open(path, "wb") as f:
+        model.dump(f)
+    with open(path, "rb") as f:
+        digest = hashlib.sha512(f.read()).hexdigest()
+    published = digest if checksum else hashlib.sha512(b"other").hexdigest()
+    with open(f"{path}.sha512", "w") as f:
+        f.write(f"{published} *{os.path.basename(path)}\n")
+    return digest
+
+
+class ServedModel:
+    """The attributes and the swap_model coroutine of a RevscoringModel
+    used by ModelReloader."""
+
+    def __init__(self, model_path: str):
+        self.name = "enwiki-goodfaith"
+        self.model_kind = RevscoringModelType.EDITQUALITY_GOODFAITH
+        self.model_path = model_path
+        self.model, self.checksum = load_verified(self.model_kind, model_path)
+        self.swaps = []
+
+    async def swap_model(self, model, checksum=None):
+        self.swaps.append(model.version)
+        self.model, self.checksum = model, checksum
+
+
+@pytest.fixture(autouse=True)
+def no_model_cache(monkeypatch):
+    monkeypatch.delenv(MODEL_CACHE_DIR, raising=False)
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = str(tmp_path / "model.bin")
+    write_model(path, "1.0.0")
+    return path
+
+
+def test_model_signature_changes_with_the_binary(model_path):
+    signature = get_model_signature(model_path)
+    assert None not in signature
+    assert get_model_signature(model_path) == signature
+
+    write_model(model_path, "2.0.0")
+    assert get_model_signature(model_path) != signature
+
+    os.remove(f"{model_path}.sha512")
+    assert get_model_signature(model_path)[1] is None
+
+
+def test_load_verified_checks_the_binary(model_path):
+    kind = RevscoringModelType.EDITQUALITY_GOODFAITH
+    digest = write_model(model_path, "2.0.0")
+
+    model, checksum = load_verified(kind, model_path)
+    assert model.version == "2.0.0"
+    assert checksum == digest
+
+    write_model(model_path, "3.0.0", checksum=False)
+    with pytest.raises(ValueError, match="doesn't match"):
+        load_verified(kind, model_path)
+
+
+def test_reload_swaps_the_model(model_path):
+    served = ServedModel(model_path)
+    reloader = ModelReloader(served)
+    digest = write_model(model_path, "2.0.0")
+
+    asyncio.run(reloader.reload())
+
+    assert served.swaps == ["2.0.0"]
+    assert served.checksum == digest
+    assert reloader.signature == get_model_signature(model_path)
+
+
+def test_failed_reload_keeps_the_old_model(model_path):
+    served = ServedModel(model_path)
+    reloader = ModelReloader(served)
+    write_model(model_path, "2.0.0", checksum=False)
+
+    with pytest.raises(ValueError):
+        asyncio.run(reloader.reload())
+
+    assert served.swaps == []
+    assert served.model.version == "1.0.0"
+    # The failed binary is not polled again until it changes.
+    assert reloader.signature == get_model_signature(model_path)
+
+
+def test_new_binaries_are_reloaded_once_left_unchanged(model_path):
+    served = ServedModel(model_path)
+    interval = 0.1
+
+    async def run():
+        reloader = ModelReloader(served, interval)
+        reloader.start()
+        await asyncio.sleep(interval * 2.5)
+        swaps_before = list(served.swaps)
+        write_model(model_path, "2.0.0")
+        # A new signature is reloaded at the second poll seeing it.
+        await asyncio.sleep(interval * 4)
+        reloader.stop()
+        return swaps_before, reloader
+
+    swaps_before, reloader = asyncio.run(run())
+
+    assert swaps_before == []
+    assert served.swaps == ["2.0.0"]
+    assert reloader._task is None
+
+
+def test_repository_load_reloads_the_model(model_path):
+    served = ServedModel(model_path)
+    served.model_reloader = ModelReloader(served)
+    repository = ModelReloadRepository()
+    repository.update(served)
+    write_model(model_path, "2.0.0")
+
+    assert asyncio.run(repository.load(served.name))
+    assert served.swaps == ["2.0.0"]
+
+    served.name = "itwiki-goodfaith"
+    del served.model_reloader
+    repository.update(served)
+    with pytest.raises(ValueError, match="can't be reloaded"):
+        asyncio.run(repository.load(served.name))
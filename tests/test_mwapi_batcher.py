@@ -0,0 +1,271 @@
+import asyncio
+import os
+import sys
+
+import mwapi
+from aiohttp import web
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "revscoring_model", "model_servers"))
+
+import extractor_utils  # noqa: E402
+from mwapi_utils import MWAPIBatcher, MWAPIClient  # noqa: E402
+
+USER_AGENT = "revscoring-model-servers-tests"
+
+# rev_id -> (page_id, parent rev_id, user, text)
+REVISIONS = {
+    rev_id: (rev_id * 10, rev_id - 1, f"User{rev_id % 3}", "word " * rev_id)
+    for rev_id in range(1, 21)
+}
+USERS = {"User0": 10, "User1": 11, "User2": 12}
+
+
+class StandInAPI:
+    """A local stand-in of the MW API answering the revisions and users
+    queries, that records the parameters of every query it receives.
+    The rev-ids in drop_rev_ids are left out of multi-value responses
+    (like the MW API does when a response exceeds its max result size),
+    and the user names are returned capitalized (like the MW API does
+    when it normalizes them)."""
+
+    def __init__(self, drop_rev_ids=()):
+        self.drop_rev_ids = set(drop_rev_ids)
+        self.queries = []
+        self.url = None
+        self._runner = None
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/w/api.php", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._runner.cleanup()
+
+    def revisions_queries(self):
+        return [query for query in self.queries if "revids" in query]
+
+    def users_queries(self):
+        return [query for query in self.queries if "ususers" in query]
+
+    async def handle(self, request):
+        query = dict(request.query)
+        self.queries.append(query)
+        if "revids" in query:
+            return web.json_response(self.revisions_doc(query["revids"].split("|")))
+        return web.json_response(self.users_doc(query["ususers"].split("|")))
+
+    def revisions_doc(self, rev_ids):
+        pages, bad_rev_ids = {}, {}
+        for rev_id in map(int, rev_ids):
+            if len(rev_ids) > 1 and rev_id in self.drop_rev_ids:
+                continue
+            if rev_id not in REVISIONS:
+                bad_rev_ids[str(rev_id)] = {"revid": rev_id}
+                continue
+            page_id, parent_rev_id, user, text = REVISIONS[rev_id]
+            page = pages.setdefault(
+                str(page_id),
+                {"pageid": page_id, "ns": 0, "title": f"Page {page_id}"},
+            )
+            page.setdefault("revisions", []).append(
+                {
+                    "revid": rev_id,
+                    "parentid": parent_rev_id,
+                    "user": user,
+                    "userid": int(user[-1]) + 1,
+                    "timestamp": "2024-01-01T00:00:00Z",
+                    "size": len(text),
+                    "comment": "",
+                    "slots": {
+                        "main": {
+                            "contentmodel": "wikitext",
+                            "contentformat": "text/x-wiki",
+                            "*": text,
+                        }
+                    },
+                }
+            )
+        query = {"pages": pages}
+        if bad_rev_ids:
+            query["badrevids"] = bad_rev_ids
+        return {"batchcomplete": "", "query": query}
+
+    def users_doc(self, users):
+        user_docs = []
+        for user in users:
+            name = user[0].upper() + user[1:]
+            if name in USERS:
+                user_docs.append(
+                    {
+                        "userid": int(name[-1]) + 1,
+                        "name": name,
+                        "editcount": USERS[name],
+                        "registration": "2020-01-01T00:00:00Z",
+                        "groups": ["*", "user"],
+                        "gender": "unknown",
+                    }
+                )
+            else:
+                user_docs.append({"name": name, "missing": ""})
+        return {"batchcomplete": "", "query": {"users": user_docs}}
+
+
+def run_with_batcher(coroutine_function, max_size=50, drop_rev_ids=()):
+    """Run coroutine_function(api, batcher) with a MWAPIBatcher pointed
+    at a new stand-in API, returning its result and the stand-in."""
+
+    async def run():
+        async with StandInAPI(drop_rev_ids) as api:
+            client = MWAPIClient(api.url, USER_AGENT)
+            try:
+                batcher = MWAPIBatcher(client, max_wait=0.05, max_size=max_size)
+                return await coroutine_function(api, batcher), api
+            finally:
+                await client.close()
+
+    return asyncio.run(run())
+
+
+def revision_ids(doc):
+    return [
+        revision["revid"]
+        for page in doc["query"]["pages"].values()
+        for revision in page["revisions"]
+    ]
+
+
+def test_concurrent_lookups_are_merged_into_one_query():
+    async def lookups(api, batcher):
+        return await asyncio.gather(
+            *(batcher.get_revision_doc(rev_id) for rev_id in (3, 1, 2)),
+            *(batcher.get_user_doc(user) for user in ("User1", "User2")),
+        )
+
+    docs, api = run_with_batcher(lookups)
+
+    assert len(api.queries) == 2
+    (revisions_query,) = api.revisions_queries()
+    assert sorted(revisions_query["revids"].split("|")) == ["1", "2", "3"]
+    (users_query,) = api.users_queries()
+    assert sorted(users_query["ususers"].split("|")) == ["User1", "User2"]
+    # Every caller gets a document shaped like the response of a query
+    # containing only its own rev-id or user.
+    assert [revision_ids(doc) for doc in docs[:3]] == [[3], [1], [2]]
+    assert [doc["query"]["users"][0]["name"] for doc in docs[3:]] == [
+        "User1",
+        "User2",
+    ]
+
+
+def test_same_rev_id_is_queried_once_per_batch():
+    async def lookups(api, batcher):
+        return await asyncio.gather(*(batcher.get_revision_doc(5) for _ in range(4)))
+
+    docs, api = run_with_batcher(lookups)
+
+    assert [query["revids"] for query in api.queries] == ["5"]
+    assert all(revision_ids(doc) == [5] for doc in docs)
+
+
+def test_batches_are_capped_at_max_size():
+    async def lookups(api, batcher):
+        return await asyncio.gather(
+            *(batcher.get_revision_doc(rev_id) for rev_id in range(1, 8))
+        )
+
+    docs, api = run_with_batcher(lookups, max_size=3)
+
+    batches = [query["revids"].split("|") for query in api.revisions_queries()]
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert sorted(int(rev_id) for batch in batches for rev_id in batch) == list(
+        range(1, 8)
+    )
+    assert [revision_ids(doc) for doc in docs] == [[rev_id] for rev_id in range(1, 8)]
+
+
+def test_missing_items_fall_back_to_individual_queries():
+    async def lookups(api, batcher):
+        return await asyncio.gather(
+            *(batcher.get_revision_doc(rev_id) for rev_id in (1, 2, 3, 99)),
+            *(batcher.get_user_doc(user) for user in ("User1", "user2")),
+        )
+
+    docs, api = run_with_batcher(lookups, drop_rev_ids=[2])
+
+    revids = [query["revids"] for query in api.revisions_queries()]
+    assert sorted(revids[0].split("|")) == ["1", "2", "3", "99"]
+    # Only the rev-id left out of the batch response is queried again,
+    # unknown rev-ids are reported as badrevids by the batch response.
+    assert revids[1:] == ["2"]
+    assert [revision_ids(doc) for doc in docs[:3]] == [[1], [2], [3]]
+    assert docs[3]["query"]["badrevids"] == {"99": {"revid": 99}}
+    # A user name normalized by the MW API can't be matched in the batch
+    # response, so it is queried alone.
+    ususers = [query["ususers"] for query in api.users_queries()]
+    assert sorted(ususers[0].split("|")) == ["User1", "user2"]
+    assert ususers[1:] == ["user2"]
+    assert docs[5]["query"]["users"][0]["name"] == "User2"
+
+
+def test_batch_responses_are_split_into_per_request_caches():
+    async def get_caches(api, batcher):
+        return await asyncio.gather(
+            *(
+                extractor_utils.get_revscoring_extractor_cache(
+                    rev_id,
+                    USER_AGENT,
+                    None,
+                    api.url,
+                    fetch_extra_info=True,
+                    mwapi_session=batcher.session,
+                    mwapi_batcher=batcher,
+                )
+                for rev_id in (7, 12)
+            )
+        )
+
+    caches, api = run_with_batcher(get_caches)
+
+    # The rev-ids are fetched in one query and their parents (and users)
+    # in a second one.
+    batches = [sorted(query["revids"].split("|")) for query in api.revisions_queries()]
+    assert batches == [["12", "7"], ["11", "6"]]
+    assert sorted(api.users_queries()[0]["ususers"].split("|")) == ["User0", "User1"]
+    for cache, rev_id in zip(caches, (7, 12)):
+        _, parent_rev_id, user, _ = REVISIONS[rev_id]
+        for cached_rev_id in (rev_id, parent_rev_id):
+            doc = cache.get_revisions_batch_doc([cached_rev_id])
+            assert revision_ids(doc) == [cached_rev_id]
+        users_doc = cache.get_users_batch_doc([user])
+        assert [doc["name"] for doc in users_doc["query"]["users"]] == [user]
+
+    # The caches are all the revscoring extractor needs to solve the features.
+    from revscoring.extractors import api as revscoring_api
+    from revscoring.features import temporal, wikitext
+
+    features = [
+        wikitext.revision.words,
+        wikitext.revision.parent.words,
+        temporal.revision.user.seconds_since_registration,
+    ]
+    # From the users' registration (2020-01-01) to the revisions (2024-01-01).
+    seconds_since_registration = 1461 * 24 * 60 * 60
+    for cache, rev_id in zip(caches, (7, 12)):
+        _, parent_rev_id, _, _ = REVISIONS[rev_id]
+        extractor = revscoring_api.Extractor(
+            mwapi.Session(api.url, user_agent=USER_AGENT), http_cache=cache
+        )
+        assert list(extractor.extract(rev_id, features)) == [
+            rev_id,
+            parent_rev_id,
+            seconds_since_registration,
+        ]
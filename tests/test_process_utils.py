@@ -0,0 +1,170 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "revscoring_model", "model_servers"))
+
+import process_utils  # noqa: E402
+from process_utils import (  # noqa: E402
+    BudgetedProcessPool,
+    JobTimeoutError,
+    WorkerDiedError,
+    run_in_process_pool,
+)
+
+# The jobs below are pickled by reference, the workers are forked so that
+# they find them in this module.
+START_METHOD = "fork"
+TIMEOUT = 1.0
+
+
+def init(value):
+    globals()["INITIALIZED"] = value
+
+
+def work(seconds):
+    time.sleep(seconds)
+    return os.getpid(), INITIALIZED
+
+
+def fail():
+    raise ValueError("Invalid feature values")
+
+
+def crash():
+    os._exit(1)
+
+
+def size(payload):
+    return len(payload)
+
+
+def run_with_pool(coroutine_function, workers=2):
+    """Run coroutine_function(pool) with a new BudgetedProcessPool, whose
+    workers are initialized with init("ready")."""
+    pool = process_utils.create_process_pool(
+        workers, init, ("ready",), timeout=TIMEOUT, start_method=START_METHOD
+    )
+    assert isinstance(pool, BudgetedProcessPool)
+    try:
+        return asyncio.run(coroutine_function(pool))
+    finally:
+        pool.shutdown()
+
+
+def test_jobs_run_in_the_initialized_workers():
+    async def run(pool):
+        pids = set(pool.worker_pids())
+        results = await asyncio.gather(
+            *(run_in_process_pool(pool, work, 0.1) for _ in range(4))
+        )
+        return pids, results
+
+    pids, results = run_with_pool(run)
+
+    assert {pid for pid, _ in results} <= pids
+    assert [value for _, value in results] == ["ready"] * 4
+
+
+def test_large_payloads_are_sent_to_the_workers():
+    async def run(pool):
+        return await run_in_process_pool(pool, size, b"x" * 10_000_000)
+
+    assert run_with_pool(run) == 10_000_000
+
+
+def test_job_errors_are_raised_and_the_worker_is_kept():
+    async def run(pool):
+        pids = set(pool.worker_pids())
+        with pytest.raises(ValueError, match="Invalid feature values"):
+            await run_in_process_pool(pool, fail)
+        return pids, set(pool.worker_pids())
+
+    pids, pids_after = run_with_pool(run, workers=1)
+
+    assert pids_after == pids
+
+
+def test_jobs_over_budget_are_killed_and_their_worker_replaced():
+    async def run(pool):
+        (pid,) = pool.worker_pids()
+        start = time.monotonic()
+        with pytest.raises(JobTimeoutError) as error:
+            await run_in_process_pool(pool, work, 10)
+        elapsed = time.monotonic() - start
+        # The next job waits for the replacement worker.
+        new_pid, value = await run_in_process_pool(pool, work, 0)
+        return pid, elapsed, error.value, new_pid, value
+
+    pid, elapsed, error, new_pid, value = run_with_pool(run, workers=1)
+
+    assert elapsed < TIMEOUT + 1
+    assert error.function_name == "work"
+    assert error.budget == TIMEOUT
+    assert new_pid != pid
+    assert value == "ready"
+
+
+def test_dead_workers_are_replaced():
+    async def run(pool):
+        (pid,) = pool.worker_pids()
+        with pytest.raises(WorkerDiedError):
+            await run_in_process_pool(pool, crash)
+        new_pid, _ = await run_in_process_pool(pool, work, 0)
+        return pid, new_pid
+
+    pid, new_pid = run_with_pool(run, workers=1)
+
+    assert new_pid != pid
+
+
+def test_cancelled_jobs_complete_and_keep_their_worker():
+    async def run(pool):
+        (pid,) = pool.worker_pids()
+        job = asyncio.ensure_future(run_in_process_pool(pool, work, 0.2))
+        await asyncio.sleep(0.05)
+        job.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await job
+        # The worker is released once the cancelled job has completed.
+        start = time.monotonic()
+        new_pid, _ = await run_in_process_pool(pool, work, 0)
+        return pid, new_pid, time.monotonic() - start
+
+    pid, new_pid, waited = run_with_pool(run, workers=1)
+
+    assert new_pid == pid
+    assert 0.05 < waited < TIMEOUT
+
+
+def test_jobs_wait_for_an_idle_worker():
+    async def run(pool):
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(run_in_process_pool(pool, work, 0.2) for _ in range(4))
+        )
+        return results, time.monotonic() - start
+
+    results, elapsed = run_with_pool(run, workers=2)
+
+    assert len({pid for pid, _ in results}) == 2
+    assert 0.4 <= elapsed < TIMEOUT
+
+
+def test_drained_pools_stop_their_workers_once_idle():
+    async def run(pool):
+        job = asyncio.ensure_future(run_in_process_pool(pool, work, 0.2))
+        await asyncio.sleep(0.05)
+        pool.drain()
+        # The idle worker is stopped right away, the busy one once its
+        # job is completed.
+        workers_while_running = len(pool.worker_pids())
+        await job
+        return workers_while_running, len(pool.worker_pids())
+
+    assert run_with_pool(run, workers=2) == (1, 0)
@@ -0,0 +1,116 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from common.feature_store import FeatureStore, feature_fingerprint  # noqa: E402
+
+
+def train_model(path: str):
+    """Train a small model on wikitext features, that are extracted from the
+    dump alone (no MW API call is needed for anonymous edits)."""
+    from revscoring.features import wikitext
+    from revscoring.scoring.models import RandomForest
+
+    revision = wikitext.revision
+    features = [
+        revision.chars,
+        revision.words,
+        revision.parent.chars,
+        revision.diff.words_added,
+    ]
+    model = RandomForest(features, [True, False], version="0.0.1", n_estimators=3)
+    model.train([([i % 7, i % 5, i % 3, i % 2], i % 2 == 0) for i in range(200)])
+    with open(path, "wb") as f:
+        model.dump(f)
+    return model
+
+
+def write_dump(path: str) -> None:
+    revisions = [
+        {"rev_id": 101, "text": "Hello world."},
+        {"rev_id": 102, "rev_parent_id": 101, "text": "Hello world, again."},
+    ]
+    with open(path, "w") as f:
+        for revision in revisions:
+            revision.update(
+                page_id=1,
+                page_title="Test",
+                page_namespace=0,
+                rev_timestamp="2024-01-01T00:00:00Z",
+                user_text="127.0.0.1",
+                user_id=0,
+            )
+            f.write(json.dumps(revision) + "\n")
+
+
+def run_revscore(tmp_path, env):
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.join(REPO_DIR, "src", "revscore.py"),
+            "--model_name",
+            "enwiki-goodfaith",
+            "--model_type",
+            "goodfaith",
+            "--dump_path",
+            str(tmp_path / "dump.jsonl"),
+            "--dump_format",
+            "jsonl",
+            "--data_dir",
+            str(tmp_path / "data"),
+        ],
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+
+
+@pytest.fixture
+def script_env(tmp_path):
+    model = train_model(str(tmp_path / "model.bin"))
+    write_dump(str(tmp_path / "dump.jsonl"))
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO_DIR,
+        MODEL_PATH=str(tmp_path / "model.bin"),
+        WIKI_URL="https://en.wikipedia.org",
+        FEATURE_STORE_PATH=str(tmp_path / "features.sqlite3"),
+    )
+    return model, env
+
+
+def test_revscore_saves_features_to_the_store(tmp_path, script_env):
+    model, env = script_env
+    run_revscore(tmp_path, env)
+
+    store = FeatureStore(env["FEATURE_STORE_PATH"])
+    fingerprint = feature_fingerprint(model.features)
+    for rev_id in (101, 102):
+        assert os.path.exists(tmp_path / "data" / "inferences" / f"{rev_id}.json")
+        assert len(store.get(rev_id, fingerprint)) == len(model.features)
+
+
+def test_revscore_reads_features_from_the_store(tmp_path, script_env):
+    model, env = script_env
+    run_revscore(tmp_path, env)
+    with open(tmp_path / "data" / "inferences" / "102.json") as f:
+        scored = json.load(f)
+
+    # Without the dump's content, the extraction would need the MW API.
+    os.remove(tmp_path / "data" / "inferences" / "102.json")
+    with open(tmp_path / "dump.jsonl") as f:
+        lines = [json.loads(line) for line in f]
+    with open(tmp_path / "dump.jsonl", "w") as f:
+        for revision in lines:
+            revision["text"] = ""
+            f.write(json.dumps(revision) + "\n")
+    run_revscore(tmp_path, env)
+
+    with open(tmp_path / "data" / "inferences" / "102.json") as f:
+        assert json.load(f) == scored